@@ -0,0 +1,81 @@
+"""
+Compare the bytes sent for a large PDF when it is downloaded in full, against loading it the way PDF viewers such
+as pdf.js do when range requests are supported: the cross-reference table at the end of the file first, then one
+chunk per page that is viewed. Also compares a CDN revalidating a cached PDF with and without If-None-Match.
+
+Usage: python bench/artifact_ranges.py [SIZE_MB] [PAGES] [PAGES_VIEWED]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+import httpx
+from fastapi import FastAPI
+
+# Default chunk size used by pdf.js for range requests
+CHUNK_SIZE = 64 * 1024
+
+URL = "/api/v1/files/bench.pdf"
+
+
+async def measure(client: httpx.AsyncClient, name: str, requests: list[dict[str, str]], *, size: int) -> None:
+    start = time.perf_counter()
+    sent = 0
+
+    for headers in requests:
+        response = await client.get(URL, headers=headers)
+        assert response.status_code in {200, 206, 304}
+
+        sent += len(response.content)
+
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:<24} {len(requests):4} requests {sent / 1_000_000:8.2f}MB "
+        f"({sent / size:6.1%} of file) {elapsed * 1000:8.1f}ms"
+    )
+
+
+async def run(size: int, pages: int, pages_viewed: int) -> None:
+    # The artifact store is created on import, so these can only be imported once the env vars are set
+    from reportobello.api.api import router  # noqa: PLC0415
+    from reportobello.infra.artifacts import ARTIFACTS  # noqa: PLC0415
+
+    app = FastAPI()
+    app.include_router(router)
+
+    await ARTIFACTS.put("pdfs/bench.pdf", os.urandom(size))
+
+    # Pages are assumed to be evenly spread throughout the file
+    offsets = sorted({
+        size - CHUNK_SIZE,
+        *(page * size // pages // CHUNK_SIZE * CHUNK_SIZE for page in range(pages_viewed)),
+    })
+    ranges = [{"range": f"bytes={offset}-{offset + CHUNK_SIZE - 1}"} for offset in offsets]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        etag = (await client.head(URL)).headers["etag"]
+
+        await measure(client, "full download", [{}], size=size)
+        await measure(client, f"first {pages_viewed} of {pages} pages", ranges, size=size)
+        await measure(client, "revalidate", [{}], size=size)
+        await measure(client, "revalidate (ETag)", [{"if-none-match": etag}], size=size)
+
+
+def main() -> None:
+    size = int(float(sys.argv[1]) * 1_000_000) if len(sys.argv) > 1 else 20_000_000
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    pages_viewed = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    with TemporaryDirectory() as tmp:
+        os.environ.setdefault("REPORTOBELLO_DOMAIN", "localhost")
+        os.environ["REPORTOBELLO_ARTIFACT_DIR"] = tmp
+
+        asyncio.run(run(size, pages, pages_viewed))
+
+
+if __name__ == "__main__":
+    main()
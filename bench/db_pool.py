@@ -0,0 +1,109 @@
+"""
+Compare the throughput of authenticated requests using a single shared SQLite connection against
+the WAL connection pool, while another thread keeps saving reports with large data payloads.
+
+Each "request" does the same queries as building a report: looking up the API key, then the template.
+
+Usage: python bench/db_pool.py [REQUESTS] [CONCURRENCY]
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from tempfile import TemporaryDirectory
+
+
+def run(requests: int, concurrency: int) -> None:
+    # The database is opened on import, so these can only be imported once the env vars are set
+    from reportobello.domain.report import Report  # noqa: PLC0415
+    from reportobello.domain.user import User  # noqa: PLC0415
+    from reportobello.infra.db import (  # noqa: PLC0415
+        create_or_update_template_for_user,
+        create_or_update_user,
+        create_random_api_key,
+        get_files_for_template,
+        get_template_for_user,
+        get_user_by_api_key,
+        save_recent_report_build_for_user,
+    )
+
+    user = create_or_update_user(User(id=0, api_key=create_random_api_key(), username="bench"))
+
+    for i in range(20):
+        create_or_update_template_for_user(user.id, name="bench", content=f"Hello world {i}")
+
+    now = datetime.now(tz=UTC)
+    report = Report(
+        filename="bench.pdf",
+        requested_version=-1,
+        actual_version=20,
+        template_name="bench",
+        started_at=now,
+        finished_at=now,
+        expires_at=now,
+        data="x" * 1_000_000,
+    )
+
+    stop = threading.Event()
+    writes = 0
+
+    def write_reports() -> None:
+        nonlocal writes
+
+        while not stop.is_set():
+            save_recent_report_build_for_user(user.id, report)
+            writes += 1
+
+    def request(_: int) -> float:
+        start = time.perf_counter()
+
+        assert get_user_by_api_key(user.api_key)
+        assert get_template_for_user(user.id, "bench")
+        get_files_for_template(user.id, "bench")
+
+        return time.perf_counter() - start
+
+    writer = threading.Thread(target=write_reports)
+    writer.start()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        latencies = sorted(executor.map(request, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    stop.set()
+    writer.join()
+
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+
+    print(f"{requests / elapsed:8.1f} requests/s, p99 {p99:6.2f}ms, {writes / elapsed:6.1f} writes/s")
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    if os.getenv("BENCH_RUN"):
+        run(requests, concurrency)
+        return
+
+    for name, readers in [("single connection", "0"), ("connection pool  ", str(concurrency))]:
+        with TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                "BENCH_RUN": "1",
+                "REPORTOBELLO_DB": f"{tmp}/bench.db",
+                "REPORTOBELLO_DB_READERS": readers,
+            }
+
+            print(f"{name}: ", end="", flush=True)
+
+            subprocess.run([sys.executable, __file__, str(requests), str(concurrency)], env=env, check=True)  # noqa: S603
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Time the queries that run on every request as the database grows. Each size gets a fresh database seeded
+with that many reports (spread across 100 versions of a few templates) and a tenth as many uploaded files.
+With the right indexes, query times should stay flat as the tables grow.
+
+Usage: python bench/db_queries.py [ITERATIONS]
+"""
+
+import sys
+import time
+from datetime import UTC, datetime, timedelta
+
+from reportobello.domain.user import User
+from reportobello.infra import db
+
+SIZES = [1_000, 10_000, 100_000]
+TEMPLATE_VERSIONS = 100
+
+
+def seed(reports: int) -> User:
+    db.pool = db.ConnectionPool(":memory:", readers=0)
+
+    user, other = [
+        db.create_or_update_user(
+            User(id=-1, api_key=db.create_random_api_key(), username=username, provider_user_id=username)
+        )
+        for username in ("bench", "other")
+    ]
+
+    now = datetime.now(tz=UTC)
+
+    with db.pool.write() as conn:
+        conn.executemany(
+            "INSERT INTO templates (owner_id, name, version, template) VALUES (?, ?, ?, ?)",
+            [
+                (owner.id, name, version, f"Hello world {version}")
+                for owner in (user, other)
+                for name in ("bench", "other")
+                for version in range(1, TEMPLATE_VERSIONS + 1)
+            ],
+        )
+
+        template_ids = [row[0] for row in conn.execute("SELECT id FROM templates")]
+
+        conn.executemany(
+            """
+            INSERT INTO reports (
+                template_id, filename, requested_version, started_at, finished_at, expires_at, cache_key
+            )
+            VALUES (?, ?, -1, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    template_ids[i % len(template_ids)],
+                    f"{i}.pdf",
+                    (now - timedelta(seconds=i)).isoformat(),
+                    (now - timedelta(seconds=i)).isoformat(),
+                    (now + timedelta(days=1)).isoformat(),
+                    str(i),
+                )
+                for i in range(reports)
+            ],
+        )
+
+        # The bench template always has the same number of files, the rest belong to other templates
+        file_owners = [(user, "bench")] * 10 + [
+            [(user, "other"), (other, "bench"), (other, "other")][i % 3] for i in range(reports // 10 - 10)
+        ]
+
+        conn.executemany(
+            "INSERT INTO file_hashes (hash, size) VALUES (?, 1)",
+            [(str(i),) for i in range(reports // 10)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO uploaded_files (uploaded_at, uploaded_by_user_id, template_name, file_id, filename)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(now.isoformat(), owner.id, name, i + 1, f"{i}.png") for i, (owner, name) in enumerate(file_owners)],
+        )
+
+    return user
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    queries = {
+        "get_user_by_api_key": lambda user: db.get_user_by_api_key(user.api_key),
+        "get_template_for_user": lambda user: db.get_template_for_user(user.id, "bench"),
+        "get_recent_report_builds_for_user": lambda user: db.get_recent_report_builds_for_user(user.id, "bench"),
+        "get_cached_report_by_cache_key": lambda user: db.get_cached_report_by_cache_key(
+            user.id, "0", now=datetime.now(tz=UTC)
+        ),
+        "get_files_for_template": lambda user: db.get_files_for_template(user.id, "bench"),
+        "get_file_for_template": lambda user: db.get_file_for_template(user.id, "bench", "0.png"),
+    }
+
+    print(f"{'':36}" + "".join(f"{f'{size:,} reports':>18}" for size in SIZES))
+
+    results: dict[str, list[float]] = {name: [] for name in queries}
+
+    for size in SIZES:
+        user = seed(size)
+
+        for name, query in queries.items():
+            start = time.perf_counter()
+
+            for _ in range(iterations):
+                query(user)
+
+            results[name].append((time.perf_counter() - start) / iterations * 1_000_000)
+
+    for name, timings in results.items():
+        print(f"{name:36}" + "".join(f"{f'{timing:,.1f}us':>18}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the throughput of starting a new compiler per build against the warm Typst worker pool.
+
+Usage: python bench/typst_compile.py [BUILDS] [CONCURRENCY]
+"""
+
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from reportobello.infra.typst_worker import TypstWorkerPool
+
+TEMPLATE = """
+#set page(paper: "a4")
+= Invoice #sys.inputs.at("invoice", default: "0")
+
+#table(columns: 3, ..range(60).map(i => [Item #i]))
+"""
+
+ONE_SHOT_COMPILE = """
+import sys, typst
+typst.compile(sys.argv[1], output=sys.argv[2], sys_inputs={"invoice": sys.argv[3]})
+"""
+
+
+def fork_per_build(file: Path, i: int) -> None:
+    subprocess.run(  # noqa: S603
+        [sys.executable, "-c", ONE_SHOT_COMPILE, str(file), str(file.with_name(f"{i}.pdf")), str(i)],
+        check=True,
+    )
+
+
+def main() -> None:
+    builds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with TemporaryDirectory() as tmp:
+        file = Path(tmp) / "report.typ"
+        file.write_text(TEMPLATE)
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda i: fork_per_build(file, i), range(builds)))
+            elapsed = time.perf_counter() - start
+
+        print(f"fork per build: {builds / elapsed:8.1f} builds/s ({elapsed:.2f}s)")
+
+        pool = TypstWorkerPool(concurrency, max_builds_per_worker=500, build_timeout=60)
+
+        def warm(i: int) -> None:
+            returncode, output = pool.compile(str(file), str(file.with_name(f"{i}.pdf")), {"invoice": str(i)})
+            assert returncode == 0, output
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            # Start all workers before measuring, since this only happens once per worker
+            list(executor.map(warm, range(concurrency)))
+
+            start = time.perf_counter()
+            list(executor.map(warm, range(builds)))
+            elapsed = time.perf_counter() - start
+
+        pool.close()
+
+        print(f"warm pool:      {builds / elapsed:8.1f} builds/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
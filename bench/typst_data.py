@@ -0,0 +1,83 @@
+"""
+Compare writing the report data to a file against passing it to the Typst worker in memory as an input,
+for increasingly large JSON payloads. The template only reads the data, so the time is dominated by getting
+the data into the compiler.
+
+Usage: python bench/typst_data.py [ITERATIONS]
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from reportobello.infra.typst_worker import TypstWorkerPool
+
+# Number of rows needed for roughly 1MB, 10MB, and 50MB of JSON
+SIZES = [15_000, 150_000, 750_000]
+
+FILE_TEMPLATE = '#let data = json("data.json"); Rows: #data.len()'
+INPUT_TEMPLATE = '#let data = json(bytes(sys.inputs.at("data"))); Rows: #data.len()'
+
+
+def make_data(rows: int, seed: int) -> str:
+    # Typst caches parsed data, so every build needs different data to be realistic
+    table = [{"id": i, "name": f"Item {i}", "price": i * seed, "tags": ["a", "b"]} for i in range(rows)]
+
+    return json.dumps(table, separators=(",", ":"))
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    pool = TypstWorkerPool(1, max_builds_per_worker=1_000, build_timeout=300)
+
+    with TemporaryDirectory() as tmp:
+        root = Path(tmp)
+
+        file_template = root / "file.typ"
+        file_template.write_text(FILE_TEMPLATE)
+
+        input_template = root / "input.typ"
+        input_template.write_text(INPUT_TEMPLATE)
+
+        output = str(root / "report.pdf")
+
+        def from_file(data: str) -> None:
+            (root / "data.json").write_text(data)
+
+            returncode, stdout = pool.compile(str(file_template), output, {})
+            assert returncode == 0, stdout
+
+        def from_input(data: str) -> None:
+            returncode, stdout = pool.compile(str(input_template), output, {"data": data})
+            assert returncode == 0, stdout
+
+        # Start the worker before measuring
+        from_input("[]")
+
+        print(f"{'':12}" + "".join(f"{f'{rows:,} rows':>16}" for rows in SIZES))
+
+        datas = [[make_data(rows, seed) for seed in range(iterations)] for rows in SIZES]
+
+        print(f"{'size':12}" + "".join(f"{f'{len(data[0]) / 1_000_000:.1f}MB':>16}" for data in datas))
+
+        for name, build in (("file", from_file), ("input", from_input)):
+            timings = []
+
+            for data in datas:
+                start = time.perf_counter()
+
+                for seed in range(iterations):
+                    build(data[seed])
+
+                timings.append((time.perf_counter() - start) / iterations * 1_000)
+
+            print(f"{name:12}" + "".join(f"{f'{timing:,.1f}ms':>16}" for timing in timings))
+
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import asyncio
+import sys
 import warnings
 from contextlib import asynccontextmanager
 
@@ -18,10 +19,13 @@ SQLite3Instrumentor().instrument()
 load_dotenv()
 
 from reportobello.api.limiter import add_ratelimiter
-from reportobello.config import IS_LIVE_SITE
+from reportobello.application.build_jobs import run_build_worker, start_build_worker
+from reportobello.application.build_pdf import BUILD_ROOTS
+from reportobello.config import IS_LIVE_SITE, REMOTE_BUILDS
 from reportobello.infra.docker import pull_pdf_converter_in_background
+from reportobello.infra.file_gc import periodically_collect_garbage
 from reportobello.infra.logging import get_uvicorn_logging_config, setup_logging
-from reportobello.infra.otel import setup_otel_tracing
+from reportobello.infra.otel import setup_otel_metrics, setup_otel_tracing
 from reportobello.infra.retention import periodically_remove_expired_data
 from reportobello.infra.seed.user import create_admin_user_if_not_exists, create_demo_user_if_not_exists
 
@@ -31,6 +35,10 @@ setup_logging()
 @asynccontextmanager
 async def lifespan(_: FastAPI):  # type: ignore  # noqa: ANN201
     periodically_remove_expired_data()
+    periodically_collect_garbage()
+
+    # Otherwise, jobs are built by separate build workers (see below)
+    worker = None if REMOTE_BUILDS else start_build_worker()
 
     task = asyncio.create_task(pull_pdf_converter_in_background())
 
@@ -40,6 +48,11 @@ async def lifespan(_: FastAPI):  # type: ignore  # noqa: ANN201
     finally:
         task.cancel()
 
+        if worker:
+            worker.cancel()
+
+        BUILD_ROOTS.close()
+
 
 app = FastAPI(
     title="Reportobello API",
@@ -60,6 +73,7 @@ from reportobello.api.middleware import add_middleware
 app.include_router(reportobello.api.router.router)
 add_middleware(app)
 setup_otel_tracing(app)
+setup_otel_metrics()
 add_ratelimiter(app)
 
 
@@ -72,7 +86,10 @@ for method_item in app.openapi().get("paths", {}).values():
         param.get("responses", {}).pop("422", None)
 
 
-if __name__ == "__main__":
+if __name__ == "__main__" and sys.argv[1:] == ["worker"]:
+    asyncio.run(run_build_worker())
+
+elif __name__ == "__main__":
     create_admin_user_if_not_exists()
 
     if IS_LIVE_SITE:
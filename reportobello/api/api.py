@@ -1,34 +1,70 @@
 import asyncio
-import hashlib
+import json
 import logging
-import shutil
+import os
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
 from dataclasses import asdict, dataclass
 from datetime import datetime
+from email.utils import formatdate
 from pathlib import Path
-from secrets import token_urlsafe
 from tempfile import TemporaryDirectory
 from typing import Annotated
 from urllib.parse import quote
 
 from fastapi import APIRouter, Body, Form, Query, Request, Response, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from opentelemetry import trace
 
-from reportobello.api.common import CurrentUser, mimetype_strip_encoding
+from reportobello.api.common import (
+    CurrentUser,
+    cancel_on_disconnect,
+    decode_report_cursor,
+    encode_report_cursor,
+    mimetype_strip_encoding,
+)
 from reportobello.api.limiter import limiter
+from reportobello.api.ranges import RangeNotSatisfiable, etag_matches, get_byte_range
+from reportobello.application.build_jobs import ReportobelloInvalidWebhookUrl, submit_build_job
 from reportobello.application.build_pdf import (
+    BatchBuild,
+    BuildContext,
     ReportobelloBuildFailed,
     ReportobelloInvalidContentType,
     ReportobelloTemplateNotFound,
+    ReportobelloTemplateVersionNotFound,
+    build_merged_report,
     build_report,
-    typst_compile,
+    forget_cached_templates,
+    load_build_context,
+    typst_compile_pdf,
 )
 from reportobello.application.convert import convert_file_in_memory
-from reportobello.config import DOMAIN, IS_LIVE_SITE, PDF_ARTIFACT_DIR, get_file_artifact_path_from_hash
+from reportobello.application.resumable_uploads import (
+    cancel_upload,
+    finish_upload,
+    get_upload,
+    start_upload,
+    upload_chunk,
+)
+from reportobello.config import (
+    BATCH_MAX_SIZE,
+    DOMAIN,
+    IS_LIVE_SITE,
+    S3_PRESIGNED_DOWNLOADS,
+    TYPST_WORKER_COUNT,
+    UPLOAD_DIR,
+    UPLOAD_MAX_FILE_SIZE,
+)
+from reportobello.domain.build_job import BuildJob
 from reportobello.domain.file import File
 from reportobello.domain.report import Report
 from reportobello.domain.template import Template
-from reportobello.infra.db import (
+from reportobello.domain.upload_session import UploadSession
+from reportobello.domain.user import User
+from reportobello.infra.admission import AdmissionRejected
+from reportobello.infra.artifacts import ARTIFACTS, get_file_artifact_key, get_pdf_artifact_key
+from reportobello.infra.db_async import (
     check_template_exists_for_user,
     create_or_update_template_for_user,
     delete_env_vars_for_user,
@@ -36,13 +72,16 @@ from reportobello.infra.db import (
     delete_template_for_user,
     get_all_template_versions_for_user,
     get_all_templates_for_user,
+    get_build_job,
     get_env_vars_for_user,
     get_file_for_template,
     get_recent_report_builds_for_user,
+    get_report_data_for_user,
     get_template_for_user,
     save_file_metadata,
     update_env_vars_for_user,
 )
+from reportobello.infra.uploads import UploadedFile, UploadRejected, receive_files
 
 tracer = trace.get_tracer("reportobello")
 logger = logging.getLogger("reportobello")
@@ -73,7 +112,7 @@ async def get_templates(user: CurrentUser, request: Request) -> JSONResponse:
     Get a list of all uploaded templates.
     """
 
-    templates = [asdict(t) for t in get_all_templates_for_user(user.id)]
+    templates = [asdict(t) for t in await get_all_templates_for_user(user.id)]
 
     return JSONResponse(templates)
 
@@ -99,7 +138,7 @@ async def get_template(user: CurrentUser, name: str, request: Request) -> Respon
     Get the current (and previous) versions of a given template based on **name**.
     """
 
-    if templates := get_all_template_versions_for_user(user.id, name):
+    if templates := await get_all_template_versions_for_user(user.id, name):
         converted = [asdict(t) for t in sorted(templates, key=lambda x: x.version, reverse=True)]
 
         return JSONResponse(converted)
@@ -143,10 +182,10 @@ async def add_or_update_template(
 
     logger.info("template created", extra={"user": user.id})
 
-    if (most_recent_template := get_template_for_user(user.id, name)) and most_recent_template.template == body:
+    if (most_recent_template := await get_template_for_user(user.id, name)) and most_recent_template.template == body:
         return JSONResponse(asdict(most_recent_template), status_code=200)
 
-    template = create_or_update_template_for_user(user.id, name=name, content=body)
+    template = await create_or_update_template_for_user(user.id, name=name, content=body)
 
     return JSONResponse(asdict(template))
 
@@ -176,7 +215,8 @@ async def delete_template(user: CurrentUser, name: str, request: Request) -> Pla
     This behavior might change in the future.
     """
 
-    delete_template_for_user(user.id, name)
+    await delete_template_for_user(user.id, name)
+    forget_cached_templates(user.id, name)
 
     logger.info("template deleted", extra={"user": user.id})
 
@@ -188,6 +228,7 @@ class BuildTemplatePayload:
     data: object
     content_type: str = "application/json"
     template_raw: str | None = None
+    webhook_url: str | None = None
 
 
 @router.post(
@@ -195,6 +236,13 @@ class BuildTemplatePayload:
     status_code=303,
     responses={
         303: {},
+        202: {
+            "content": {
+                "application/json": {
+                    "examples": [{"id": "q2IpLi0VtxcXxVNJ0wuyBA", "state": "queued"}],
+                }
+            },
+        },
         400: {
             "model": str,
             "content": {
@@ -211,17 +259,34 @@ class BuildTemplatePayload:
                 }
             },
         },
+        429: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Too many builds are already queued"],
+                }
+            },
+        },
+        503: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Build queue is full, try again later"],
+                }
+            },
+        },
     },
     tags=["report"],
 )
 @limiter.limit("2/second")
-async def template_build(
+async def template_build(  # noqa: PLR0911
     user: CurrentUser,
     request: Request,
     name: str,
     body: BuildTemplatePayload,
     just_url: Annotated[str | None, Query(alias="justUrl")] = None,
-    is_pure: Annotated[str | None, Query(alias="isPure")] = None,
+    no_cache: Annotated[str | None, Query(alias="noCache")] = None,
+    run_async: Annotated[str | None, Query(alias="async")] = None,
     version: int = -1,
 ) -> Response:
     """
@@ -238,41 +303,414 @@ async def template_build(
     The optional query parameter **just_url** can be set to return the URL directly instead of a PDF blob.
     This is useful for JavaScript libraries since fetch does not provide a good way to intercept headers for 3xx redirect requests.
 
-    The optional query parameter **is_pure** can be set to return a cached (already built) report based on the hash of the JSON data.
-    By default, a new report is built every time regardless of whether the JSON data matches an existing report.
-    This is due to the fact that Typst templates can be non-deterministic, meaning the same input might yield different outputs.
+    If the server is too busy to build the report, a `429` status is returned if you have too many builds queued,
+    or `503` if the build queue is full. In both cases the `Retry-After` header is set to the number of seconds to wait before retrying.
+
+    Builds are cached: if the template, uploaded files, environment variables, and JSON data are identical to a previous build,
+    the previously built report is returned instead of building a new one (as long as it hasn't expired yet).
+    Typst templates can be non-deterministic, meaning the same input might yield different outputs.
     For example, using `#datetime.today()` will be different depending on which day the report is generated.
-    If your report only depends on the JSON data does not have side effects, and does not rely on environment variables, consider using **is_pure**.
+    If your template relies on side effects like this, set the optional query parameter **no_cache** to always build a new report.
+
+    > The **is_pure** query parameter is no longer needed, since caching is now enabled by default.
 
-    > Note that **is_pure** applies to a template version and not the template itself, meaning if you make a new version of a template, the template will need to be rebuilt.
+    The optional query parameter **async** can be set to build the report in the background. Instead of waiting for the report to build,
+    a `202` is returned with the **id** of the build job, which can be passed to `GET /api/v1/jobs/{id}` to check if the report has finished building.
+    Set **webhook_url** in the request body to have Reportobello send a `POST` request to that URL once the job is done.
+    Webhook URLs must point to a public address, and redirects are not followed.
+    The **template_raw** option is not supported for async builds.
     """
 
+    if run_async is not None:
+        return await submit_async_build(
+            request,
+            user=user,
+            name=name,
+            body=body,
+            version=version,
+            use_cache=no_cache is None,
+        )
+
+    try:
+        report = await cancel_on_disconnect(
+            request,
+            build_report(
+                user=user,
+                template_name=name,
+                template_version=version,
+                template_raw=body.template_raw,
+                content_type=body.content_type,
+                data=body.data,
+                use_cache=no_cache is None,
+            ),
+        )
+
+    except ReportobelloTemplateNotFound:
+        return PlainTextResponse("Template not found", status_code=404)
+
+    except ReportobelloTemplateVersionNotFound as ex:
+        return PlainTextResponse(f"Version {ex.version} does not exist for template", status_code=400)
+
+    except (ReportobelloBuildFailed, ReportobelloInvalidContentType) as ex:
+        return PlainTextResponse(str(ex), status_code=400)
+
+    except AdmissionRejected as ex:
+        return build_rejected_response(ex)
+
+    if report is None:
+        # Client disconnected before the build finished, so there is nobody to send a response to
+        return Response(status_code=499)
+
+    assert report.filename
+
+    if just_url is not None:
+        return PlainTextResponse(get_pdf_url(request, report.filename), status_code=200)
+
+    return await artifact_response(
+        request, get_pdf_artifact_key(report.filename), etag=None, media_type="application/pdf"
+    )
+
+
+async def submit_async_build(
+    request: Request,
+    *,
+    user: User,
+    name: str,
+    body: BuildTemplatePayload,
+    version: int,
+    use_cache: bool,
+) -> Response:
+    if body.template_raw is not None:
+        return PlainTextResponse("template_raw is not supported for async builds", status_code=400)
+
     try:
-        report = await build_report(
+        job = await submit_build_job(
             user=user,
             template_name=name,
             template_version=version,
-            template_raw=body.template_raw,
             content_type=body.content_type,
             data=body.data,
-            is_pure=is_pure is not None,
+            webhook_url=body.webhook_url,
+            use_cache=use_cache,
         )
 
     except ReportobelloTemplateNotFound:
         return PlainTextResponse("Template not found", status_code=404)
 
-    except (ReportobelloBuildFailed, ReportobelloInvalidContentType) as ex:
+    except ReportobelloTemplateVersionNotFound as ex:
+        return PlainTextResponse(f"Version {ex.version} does not exist for template", status_code=400)
+
+    except (ReportobelloInvalidContentType, ReportobelloInvalidWebhookUrl) as ex:
         return PlainTextResponse(str(ex), status_code=400)
 
-    if just_url is not None:
-        scheme = request.headers.get("x-forwarded-proto", request.url.scheme)
-        domain = request.headers.get("host", DOMAIN)
+    return JSONResponse(
+        build_job_as_json(request, job),
+        status_code=202,
+        headers={"Location": f"/api/v1/jobs/{job.id}"},
+    )
 
-        return PlainTextResponse(f"{scheme}://{domain}/api/v1/files/{report.filename}", status_code=200)
 
-    assert report.filename
+def build_job_as_json(request: Request, job: BuildJob) -> dict[str, object]:
+    data: dict[str, object] = {
+        "id": job.id,
+        "state": job.state,
+        "template_name": job.template_name,
+        "requested_version": job.requested_version,
+        "actual_version": job.actual_version,
+        "queued_at": job.queued_at.isoformat(),
+    }
+
+    if job.report:
+        data["started_at"] = job.report.started_at.isoformat()
+        data["finished_at"] = job.report.finished_at.isoformat()
+        data["error_message"] = job.report.error_message
+
+        if job.report.filename:
+            data["url"] = get_pdf_url(request, job.report.filename)
 
-    return FileResponse(PDF_ARTIFACT_DIR / report.filename, status_code=200)
+    return data
+
+
+@router.get(
+    "/api/v1/jobs/{job_id}",
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "examples": [
+                        {
+                            "id": "q2IpLi0VtxcXxVNJ0wuyBA",
+                            "state": "done",
+                            "template_name": "invoice",
+                            "requested_version": -1,
+                            "actual_version": 3,
+                            "queued_at": "2025-01-01T00:00:00.000000+00:00",
+                            "started_at": "2025-01-01T00:00:00.100000+00:00",
+                            "finished_at": "2025-01-01T00:00:00.300000+00:00",
+                            "error_message": None,
+                            "url": "https://example.com/api/v1/files/abc.pdf",
+                        }
+                    ],
+                }
+            },
+        },
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Job not found"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("5/second")
+async def get_job(user: CurrentUser, request: Request, job_id: str) -> Response:
+    """
+    Get the status of an async build job. The **state** is either `queued`, `running`, or `done`.
+
+    Once the job is `done`, **url** is set to the URL of the built report if it was successful,
+    otherwise **error_message** is set to the reason the build failed.
+    """
+
+    job = await get_build_job(job_id)
+
+    if job is None or job.owner_id != user.id:
+        return PlainTextResponse("Job not found", status_code=404)
+
+    return JSONResponse(build_job_as_json(request, job))
+
+
+def get_pdf_url(request: Request, filename: str) -> str:
+    scheme = request.headers.get("x-forwarded-proto", request.url.scheme)
+    domain = request.headers.get("host", DOMAIN)
+
+    return f"{scheme}://{domain}/api/v1/files/{filename}"
+
+
+def build_rejected_response(ex: AdmissionRejected) -> PlainTextResponse:
+    return PlainTextResponse(str(ex), status_code=ex.status_code, headers={"Retry-After": str(ex.retry_after)})
+
+
+@router.post(
+    "/api/v1/template/{name}/build/batch",
+    responses={
+        200: {
+            "content": {
+                "application/x-ndjson": {
+                    "examples": [
+                        '{"index":1,"url":"https://example.com/api/v1/files/abc.pdf"}\n{"index":0,"error":"Failed to build report"}'
+                    ],
+                },
+                "application/json": {
+                    "examples": [
+                        {
+                            "url": "https://example.com/api/v1/files/abc.pdf",
+                            "records": [{"index": 0, "pages": [1, 2]}, {"index": 1, "pages": [3, 3]}],
+                        }
+                    ],
+                },
+            },
+        },
+        400: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": [
+                        "Version 1 does not exist for template\nContent type is invalid\nInvalid JSON\nFailed to build report"
+                    ],
+                }
+            },
+        },
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Template not found"],
+                }
+            },
+        },
+        413: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Too many records, max is 10000"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("2/second")
+async def template_build_batch(
+    user: CurrentUser,
+    request: Request,
+    name: str,
+    merge: str | None = None,
+    no_cache: Annotated[str | None, Query(alias="noCache")] = None,
+    version: int = -1,
+) -> Response:
+    """
+    Build many reports from the template **name** in a single request.
+
+    Rate limit: 2 requests per second.
+
+    The request body is the JSON data for each report, either as a JSON array (`Content-Type: application/json`),
+    or as newline-delimited JSON with one JSON value per line (`Content-Type: application/x-ndjson`).
+    Batches with more than 10,000 items (configurable by self-hosted instances) are rejected with a `413`.
+
+    The optional query parameter **version** can be used to specify what version of the template to use. By default, the latest is used.
+
+    Results are streamed back as newline-delimited JSON as soon as each report finishes building, meaning they are not in the same order as the request body.
+    Each line includes the **index** of the data it was built from, and either the **url** of the built report or an **error** message.
+
+    If the **merge** query parameter is set, all of the data is instead rendered into a single PDF using one build, with each item starting on a new page.
+    This is much faster for large batches. The response is a JSON object with the **url** of the merged report, and a list of **records**
+    containing the **index** and first and last **pages** (inclusive) of each item. If the build fails, a `400` is returned with the error message.
+
+    Like single builds, reports that are identical to a previously built report are returned from the cache unless **no_cache** is set.
+    Merged builds are never cached.
+    """
+
+    content_type = mimetype_strip_encoding(request.headers.get("Content-Type"))
+
+    if content_type not in {"application/json", "application/x-ndjson"}:
+        return PlainTextResponse("Content type is invalid", status_code=400)
+
+    try:
+        context = await load_build_context(user=user, template_name=name, template_version=version)
+
+    except ReportobelloTemplateNotFound:
+        return PlainTextResponse("Template not found", status_code=404)
+
+    except ReportobelloTemplateVersionNotFound as ex:
+        return PlainTextResponse(f"Version {ex.version} does not exist for template", status_code=400)
+
+    if merge is not None:
+        return await build_merged_batch(request, context, content_type=content_type)
+
+    batch = BatchBuild(context, concurrency=TYPST_WORKER_COUNT, use_cache=no_cache is None)
+
+    try:
+        # Builds are started while the request body is still being read, but the response cannot be streamed
+        # until the request body has been fully read.
+        async for data in iter_batch_records(request, content_type=content_type):
+            batch.submit(data)
+
+    except (BatchTooLarge, ValueError) as ex:
+        batch.cancel()
+
+        return invalid_batch_response(ex)
+
+    logger.info("batch build", extra={"user": user.id, "count": batch.count})
+
+    async def stream_results() -> AsyncGenerator[str]:
+        async for index, result in batch.results():
+            if isinstance(result, Report):
+                assert result.filename
+
+                line: dict[str, object] = {"index": index, "url": get_pdf_url(request, result.filename)}
+
+            else:
+                line = {"index": index, "error": str(result)}
+
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+async def build_merged_batch(request: Request, context: BuildContext, *, content_type: str) -> Response:
+    try:
+        records = [data async for data in iter_batch_records(request, content_type=content_type)]
+
+    except (BatchTooLarge, ValueError) as ex:
+        return invalid_batch_response(ex)
+
+    if not records:
+        return PlainTextResponse("Expected at least one record", status_code=400)
+
+    logger.info("merged batch build", extra={"user": context.user.id, "count": len(records)})
+
+    try:
+        merged = await build_merged_report(context, records)
+
+    except ReportobelloBuildFailed as ex:
+        return PlainTextResponse(str(ex), status_code=400)
+
+    except AdmissionRejected as ex:
+        return build_rejected_response(ex)
+
+    assert merged.report.filename
+
+    return JSONResponse({
+        "url": get_pdf_url(request, merged.report.filename),
+        "records": [{"index": i, "pages": pages} for i, pages in enumerate(merged.pages)],
+    })
+
+
+class BatchTooLarge(Exception):
+    def __init__(self) -> None:
+        super().__init__(f"Too many records, max is {BATCH_MAX_SIZE}")
+
+
+def invalid_batch_response(ex: BatchTooLarge | ValueError) -> PlainTextResponse:
+    if isinstance(ex, BatchTooLarge):
+        return PlainTextResponse(str(ex), status_code=413)
+
+    return PlainTextResponse(f"Invalid JSON: {ex}", status_code=400)
+
+
+async def iter_batch_records(request: Request, *, content_type: str) -> AsyncGenerator[object]:
+    if content_type == "application/json":
+        records = json.loads(await request.body())
+
+        if not isinstance(records, list):
+            raise ValueError("expected an array")
+
+        if len(records) > BATCH_MAX_SIZE:
+            raise BatchTooLarge
+
+        for data in records:
+            yield data
+
+        return
+
+    count = 0
+
+    async for line in iter_lines(request):
+        if line.strip():
+            count += 1
+
+            # Checked as the body is read, so that the rest of the body isn't read for nothing
+            if count > BATCH_MAX_SIZE:
+                raise BatchTooLarge
+
+            yield json.loads(line)
+
+
+async def iter_lines(request: Request) -> AsyncGenerator[bytes]:
+    # Only new chunks are split, and the parts of a line spanning multiple chunks are joined once the line ends, so
+    # long lines aren't copied again for every chunk
+    partial: list[bytes] = []
+
+    async for chunk in request.stream():
+        first, *lines = chunk.split(b"\n")
+        partial.append(first)
+
+        if not lines:
+            continue
+
+        *lines, last = lines
+
+        yield b"".join(partial)
+
+        for line in lines:
+            yield line
+
+        partial = [last]
+
+    yield b"".join(partial)
 
 
 # TODO: add query parameters to control success status, count, since, etc.
@@ -281,6 +719,14 @@ async def template_build(
     tags=["report"],
     response_model=list[Report],
     responses={
+        400: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Invalid cursor"],
+                }
+            },
+        },
         404: {
             "model": str,
             "content": {
@@ -297,21 +743,87 @@ async def get_recently_built_reports(
     user: CurrentUser,
     name: str,
     before: datetime | None = None,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    metadata_only: Annotated[str | None, Query(alias="metadataOnly")] = None,
 ) -> Response:
     """
-    Get recently built reports for template **name**.
+    Get recently built reports for template **name**, newest first.
+
+    By default, only the top 20 most recent reports are returned. Use **limit** to change the page size (max 100).
 
-    By default, only the top 20 most recent reports are returned. The page size cannot be set (yet).
+    If there are more reports, the response includes a `Link` header with a `rel="next"` URL for the next page.
+    To get the next page yourself, pass the `Link` header's **cursor** parameter.
 
     To get reports built before a given timestamp, set the **before** query parameter to an ISO 8601 timestamp.
+
+    Set **metadataOnly** to leave out the `data` field, which can be large. Use the
+    `/api/v1/template/{name}/recent/{id}/data` endpoint to get the data for a single report.
     """
 
-    recent = get_recent_report_builds_for_user(user.id, name, before=before)
+    after_cursor = None
+
+    if cursor is not None and (after_cursor := decode_report_cursor(cursor)) is None:
+        return PlainTextResponse("Invalid cursor", status_code=400)
+
+    recent = await get_recent_report_builds_for_user(
+        user.id,
+        name,
+        before=before,
+        limit=limit,
+        after_cursor=after_cursor,
+        with_data=metadata_only is None,
+    )
 
     if recent is None:
         return PlainTextResponse("Template not found", status_code=404)
 
-    return JSONResponse([r.as_json() for r in recent])
+    headers = {}
+
+    if len(recent) == limit:
+        next_url = request.url.include_query_params(cursor=encode_report_cursor(recent[-1]))
+
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return JSONResponse([r.as_json() for r in recent], headers=headers)
+
+
+@router.get(
+    "/api/v1/template/{name}/recent/{report_id}/data",
+    tags=["report"],
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "examples": [{"name": "Bob"}],
+                }
+            },
+        },
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Report not found"],
+                }
+            },
+        },
+    },
+)
+@limiter.limit("5/second")
+async def get_report_data(user: CurrentUser, name: str, report_id: int, request: Request) -> Response:
+    """
+    Get the data that report **report_id** was built with. The report `id` is included in the recent reports
+    endpoint.
+    """
+
+    report = await get_report_data_for_user(user.id, name, report_id)
+
+    if report is None:
+        return PlainTextResponse("Report not found", status_code=404)
+
+    media_type = "application/json" if report.data_type == "json" else "text/plain"
+
+    return Response(report.data, media_type=media_type)
 
 
 @router.post(
@@ -358,42 +870,288 @@ async def upload_files_for_template(
     have the same hash).
     """
 
-    # TODO: allow this to be configurable
-    MAX_FILESIZE = 10 * 1000 * 1000  # 10 MB
-
-    if not check_template_exists_for_user(user.id, name):
+    if not await check_template_exists_for_user(user.id, name):
         return PlainTextResponse("Template not found", status_code=404)
 
-    async with request.form(max_files=100, max_fields=0) as form:
-        for filename, upload in form.multi_items():
-            if isinstance(upload, str):
-                return PlainTextResponse("Only files can be uploaded", status_code=400)
+    # Files are streamed to disk (and hashed) as they are received, instead of being buffered in memory first
+    files = receive_files(
+        request.headers,
+        request.stream(),
+        directory=UPLOAD_DIR,
+        max_file_size=UPLOAD_MAX_FILE_SIZE,
+        max_files=100,
+    )
+
+    try:
+        async with aclosing(files):
+            async for upload in files:
+                await save_uploaded_file(user, name, upload)
+
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
+
+    return PlainTextResponse()
+
+
+async def save_uploaded_file(user: User, template_name: str, upload: UploadedFile) -> None:
+    key = get_file_artifact_key(upload.hash)
+
+    if not await ARTIFACTS.exists(key):
+        await ARTIFACTS.put_file(key, upload.path)
+
+    file = File(
+        filename=upload.filename or upload.field_name,
+        hash=upload.hash,
+        content_type=upload.content_type,
+        size=upload.size,
+    )
+
+    await save_file_metadata(user_id=user.id, template_name=template_name, file=file)
+
+
+@dataclass
+class StartUploadPayload:
+    filename: str
+    size: int
+    hash: str
+    chunk_size: int
+    chunk_hashes: list[str]
+    content_type: str | None = None
+
+
+def upload_session_as_json(session: UploadSession) -> dict[str, object]:
+    return {
+        "id": session.id,
+        "filename": session.filename,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "expires_at": session.expires_at.isoformat(),
+        "missing": [chunk.offset for chunk in session.missing_chunks],
+    }
+
+
+UPLOAD_SESSION_EXAMPLE = {
+    "id": "u4s4VIrxbmTUnQ7mlXAp5w",
+    "filename": "font.ttf",
+    "size": 25000000,
+    "chunk_size": 8000000,
+    "expires_at": "2025-01-02T00:00:00.000000+00:00",
+    "missing": [8000000, 24000000],
+}
+
+
+@router.post(
+    "/api/v1/template/{name}/uploads",
+    status_code=201,
+    responses={
+        201: {"content": {"application/json": {"examples": [UPLOAD_SESSION_EXAMPLE]}}},
+        400: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Expected one hash per chunk, and at most 10000 chunks"],
+                }
+            },
+        },
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Template not found"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("5/second")
+async def start_resumable_upload(
+    request: Request,
+    user: CurrentUser,
+    name: str,
+    body: StartUploadPayload,
+) -> Response:
+    """
+    Start a resumable upload of a data file to template **name**. Use this instead of the multipart upload endpoint
+    for large files, or when the connection is unreliable.
+
+    The file is split into chunks of **chunk_size** bytes (the last chunk can be smaller). **hash** is the SHA3-512
+    hash of the whole file, and **chunk_hashes** is the SHA3-512 hash of each chunk, in order (all hex encoded).
+
+    **missing** is the offset of each chunk that needs to be uploaded. Chunks that you have already uploaded before
+    are skipped, and if you have already uploaded the whole file, no chunks need to be uploaded at all. To upload a
+    chunk, `PUT` it to `/api/v1/template/{name}/uploads/{id}/chunks/{offset}`. Once every chunk is uploaded, `POST`
+    to `/api/v1/template/{name}/uploads/{id}/complete` to attach the file to the template.
+
+    Uploads that aren't completed expire after a day, by default.
+    """
+
+    try:
+        session = await start_upload(
+            user=user,
+            template_name=name,
+            filename=body.filename,
+            content_type=body.content_type,
+            size=body.size,
+            hash=body.hash,
+            chunk_size=body.chunk_size,
+            chunk_hashes=body.chunk_hashes,
+        )
+
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
+
+    return JSONResponse(
+        upload_session_as_json(session),
+        status_code=201,
+        headers={"Location": f"/api/v1/template/{quote(name)}/uploads/{session.id}"},
+    )
+
+
+@router.get(
+    "/api/v1/template/{name}/uploads/{upload_id}",
+    responses={
+        200: {"content": {"application/json": {"examples": [UPLOAD_SESSION_EXAMPLE]}}},
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Upload not found"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("5/second")
+async def get_resumable_upload(request: Request, user: CurrentUser, name: str, upload_id: str) -> Response:
+    """
+    Get the status of a resumable upload. Use **missing** to find out which chunks still need to be uploaded when
+    resuming an upload.
+    """
+
+    try:
+        session = await get_upload(user=user, template_name=name, upload_id=upload_id)
+
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
+
+    return JSONResponse(upload_session_as_json(session))
+
+
+@router.put(
+    "/api/v1/template/{name}/uploads/{upload_id}/chunks/{offset}",
+    responses={
+        400: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Chunk does not match its size or hash"],
+                }
+            },
+        },
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Upload not found"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("10/second")
+async def upload_resumable_upload_chunk(
+    request: Request,
+    user: CurrentUser,
+    name: str,
+    upload_id: str,
+    offset: int,
+) -> PlainTextResponse:
+    """
+    Upload the chunk starting at **offset** bytes into the file. The request body is the raw chunk.
+
+    Uploading a chunk that was already received does nothing, so chunks can safely be retried.
+    """
 
-            if upload.size is None or upload.size > MAX_FILESIZE:
-                return PlainTextResponse("One or more files are too large", status_code=413)
+    try:
+        await upload_chunk(user=user, template_name=name, upload_id=upload_id, offset=offset, stream=request.stream())
 
-            content = await upload.read()
-            file_hash = hashlib.sha3_512(content).hexdigest().lower()
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
+
+    return PlainTextResponse()
 
-            raw_filename = get_file_artifact_path_from_hash(file_hash)
 
-            if not raw_filename.exists():
-                raw_filename.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
-                raw_filename.write_bytes(content)
-                raw_filename.chmod(0o400)
+@router.post(
+    "/api/v1/template/{name}/uploads/{upload_id}/complete",
+    responses={
+        404: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Upload not found"],
+                }
+            },
+        },
+        409: {
+            "model": str,
+            "content": {
+                "text/plain": {
+                    "examples": ["Not all chunks have been uploaded"],
+                }
+            },
+        },
+    },
+    tags=["report"],
+)
+@limiter.limit("5/second")
+async def complete_resumable_upload(
+    request: Request,
+    user: CurrentUser,
+    name: str,
+    upload_id: str,
+) -> PlainTextResponse:
+    """
+    Attach a resumable upload to template **name**, once every chunk has been uploaded.
+    A `409` is returned if any chunks are missing, in which case get the upload status to find out which.
+    """
 
-            file = File(
-                filename=upload.filename or filename,
-                hash=file_hash,
-                content_type=upload.content_type,
-                size=upload.size,
-            )
+    try:
+        await finish_upload(user=user, template_name=name, upload_id=upload_id)
 
-            save_file_metadata(user_id=user.id, template_name=name, file=file)
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
 
     return PlainTextResponse()
 
 
+@router.delete(
+    "/api/v1/template/{name}/uploads/{upload_id}",
+    tags=["report"],
+)
+@limiter.limit("5/second")
+async def cancel_resumable_upload(
+    request: Request,
+    user: CurrentUser,
+    name: str,
+    upload_id: str,
+) -> PlainTextResponse:
+    """
+    Cancel a resumable upload, removing any chunks that were uploaded.
+    """
+
+    try:
+        await cancel_upload(user=user, template_name=name, upload_id=upload_id)
+
+    except UploadRejected as ex:
+        return PlainTextResponse(str(ex), status_code=ex.status_code)
+
+    return PlainTextResponse()
+
+
+@router.head("/api/v1/template/{name}/file/{filename}", include_in_schema=False)
 @router.get(
     "/api/v1/template/{name}/file/{filename}",
     tags=["report"],
@@ -417,12 +1175,14 @@ async def get_files_for_template(
 ) -> Response:
     """
     Return the data file **filename** attached to a given template **name**, or `404` if it doesn't exist.
-    """
 
-    if file := get_file_for_template(user.id, name, filename):
-        raw_file = get_file_artifact_path_from_hash(file.hash)
+    The `ETag` header is the SHA3-512 hash of the file. Byte range and `If-None-Match` requests are supported.
+    """
 
-        return FileResponse(raw_file, media_type=file.content_type)
+    if file := await get_file_for_template(user.id, name, filename):
+        return await artifact_response(
+            request, get_file_artifact_key(file.hash), etag=file.hash, media_type=file.content_type
+        )
 
     return PlainTextResponse("File not found", status_code=404)
 
@@ -443,13 +1203,121 @@ async def delete_files_for_template(
     If the filename doesn't exist, no error is returned.
     """
 
-    delete_file_for_template(user.id, name, filename)
+    await delete_file_for_template(user.id, name, filename)
 
 
 class PdfFileResponse(FileResponse):
     media_type = "application/pdf"  # type: ignore[assignment]
 
 
+# Artifacts smaller than this are read into memory all at once instead of being streamed from disk in chunks
+IN_MEMORY_ARTIFACT_MAX_SIZE = 1_000_000
+
+
+async def artifact_response(
+    request: Request,
+    key: str,
+    *,
+    etag: str | None,
+    media_type: str | None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """
+    Send the artifact **key**, supporting conditional (`If-None-Match`), `HEAD`, and byte range requests. Artifacts
+    are immutable, so **etag** only needs to be unique per artifact, such as its content hash. If **etag** is None,
+    it is derived from the size and modification time of the artifact.
+    """
+
+    file = ARTIFACTS.local_path(key)
+    data: bytes | None = None
+
+    if file is None:
+        info = await ARTIFACTS.info(key)
+
+        if info is None:
+            return PlainTextResponse("File not found", status_code=404)
+
+        size, modified_at = info.size, info.modified_at.timestamp()
+
+    else:
+        try:
+            with tracer.start_as_current_span("read artifact"):
+                data, stat = await asyncio.to_thread(read_small_file, file, IN_MEMORY_ARTIFACT_MAX_SIZE)
+
+        except FileNotFoundError:
+            return PlainTextResponse("File not found", status_code=404)
+
+        size, modified_at = stat.st_size, stat.st_mtime
+
+    # The artifact must exist before the ETag is checked, otherwise deleted (ie, expired) artifacts would be
+    # reported as unchanged instead of missing
+    etag = etag or f"{size:x}-{int(modified_at):x}"
+
+    # Use the same headers as FileResponse so that clients see the same response either way
+    headers = {
+        **(headers or {}),
+        "etag": f'"{etag}"',
+        "accept-ranges": "bytes",
+        "last-modified": formatdate(modified_at, usegmt=True),
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if file is not None and data is None:
+        # FileResponse handles range and HEAD requests the same way. The ASGI server can use sendfile for
+        # file responses if it supports it.
+        return FileResponse(file, media_type=media_type, headers=headers, stat_result=stat)
+
+    return byte_range_response(request, key, data, size=size, etag=etag, media_type=media_type, headers=headers)
+
+
+def byte_range_response(
+    request: Request,
+    key: str,
+    data: bytes | None,
+    *,
+    size: int,
+    etag: str,
+    media_type: str | None,
+    headers: dict[str, str],
+) -> Response:
+    # Send the part of the artifact requested by the Range header (if any), either from data, or by streaming it
+    # from the artifact store. Only the requested bytes are read from the store.
+    try:
+        byte_range = get_byte_range(request.headers, size=size, etag=etag)
+
+    except RangeNotSatisfiable:
+        return PlainTextResponse("Range not satisfiable", status_code=416, headers={"content-range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size)
+    status_code = 206 if byte_range else 200
+
+    if byte_range:
+        headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+
+    headers["content-length"] = str(end - start)
+    media_type = media_type or "text/plain"
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, media_type=media_type, headers=headers)
+
+    if data is not None:
+        return Response(data[start:end], status_code=status_code, media_type=media_type, headers=headers)
+
+    return StreamingResponse(
+        ARTIFACTS.stream(key, start=start, end=end), status_code=status_code, media_type=media_type, headers=headers
+    )
+
+
+def read_small_file(file: Path, max_size: int) -> tuple[bytes | None, os.stat_result]:
+    with file.open("rb") as f:
+        stat = os.fstat(f.fileno())
+
+        return (f.read() if stat.st_size <= max_size else None), stat
+
+
+@router.head("/api/v1/files/{filename}", include_in_schema=False)
 @router.get(
     "/api/v1/files/{filename}",
     summary="Get PDF",
@@ -472,6 +1340,7 @@ class PdfFileResponse(FileResponse):
     },
 )
 async def get_pdf(
+    request: Request,
     filename: str,
     download_as: Annotated[str | None, Query(alias="downloadAs")] = None,
     download: str | None = None,
@@ -483,25 +1352,33 @@ async def get_pdf(
 
     The **download** query parameter can be set to automatically download the file when viewed in a browser.
     This is only used if **downloadAs** is set.
+
+    Byte range requests are supported, so PDF viewers can load large reports progressively. The `ETag` header
+    can be used to revalidate a cached PDF using `If-None-Match`.
     """
 
-    file = (PDF_ARTIFACT_DIR / filename).absolute()
+    key = get_pdf_artifact_key(filename)
 
-    if file.is_relative_to(PDF_ARTIFACT_DIR) and file.name.endswith(".pdf") and file.exists():
-        headers = (
-            {"Content-Disposition": f'attachment; filename="{quote(download_as)}"'} if download_as is not None else {}
-        )
+    if "/" in filename or not filename.endswith(".pdf"):
+        return PlainTextResponse("File not found", status_code=404)
 
-        if download_as is not None:
-            prefix = "attachment; " if download is not None else ""
+    headers = {"Content-Disposition": f'attachment; filename="{quote(download_as)}"'} if download_as is not None else {}
 
-            headers = {"Content-Disposition": f'{prefix}filename="{quote(download_as)}"'}
+    if download_as is not None:
+        prefix = "attachment; " if download is not None else ""
 
-        headers["Cache-Control"] = "max-age=31536000, immutable"
+        headers = {"Content-Disposition": f'{prefix}filename="{quote(download_as)}"'}
 
-        return PdfFileResponse(file, headers=headers)
+    headers["Cache-Control"] = "max-age=31536000, immutable"
 
-    return PlainTextResponse("File not found", status_code=404)
+    if (
+        S3_PRESIGNED_DOWNLOADS
+        and (url := ARTIFACTS.presigned_url(key, expires_in=3600, headers=headers))
+        and await ARTIFACTS.exists(key)
+    ):
+        return RedirectResponse(url, status_code=307)
+
+    return await artifact_response(request, key, etag=None, media_type="application/pdf", headers=headers)
 
 
 @router.get(
@@ -527,7 +1404,7 @@ async def get_env_vars(user: CurrentUser, request: Request) -> dict[str, str]:
 
     logger.info("get env vars", extra={"user": user.id})
 
-    return get_env_vars_for_user(user.id)
+    return await get_env_vars_for_user(user.id)
 
 
 @router.post(
@@ -560,7 +1437,7 @@ async def update_env_vars(
     if mimetype_strip_encoding(request.headers.get("Content-Type")) != "application/json":
         return PlainTextResponse("Content type is invalid", status_code=400)
 
-    update_env_vars_for_user(user.id, body)
+    await update_env_vars_for_user(user.id, body)
 
     logger.info("update env var", extra={"user": user.id})
 
@@ -605,13 +1482,13 @@ async def delete_env_vars(
         assert False
 
     if keys:
-        delete_env_vars_for_user(user.id, [k.strip() for k in keys.split(",")])
+        await delete_env_vars_for_user(user.id, [k.strip() for k in keys.split(",")])
         return PlainTextResponse(status_code=200)
 
     if not body or mimetype_strip_encoding(request.headers.get("Content-Type")) != "application/json":
         return PlainTextResponse("Content type is invalid", status_code=404)
 
-    delete_env_vars_for_user(user.id, body)
+    await delete_env_vars_for_user(user.id, body)
 
     logger.info("delete env var", extra={"user": user.id})
 
@@ -654,7 +1531,7 @@ async def create_template_from_existing_document(
 
         typst, data = await convert_file_in_memory(Path(tmp_dir), file)
 
-        template = create_or_update_template_for_user(user.id, name=template_name, content=typst)
+        template = await create_or_update_template_for_user(user.id, name=template_name, content=typst)
 
         await build_report(
             user=user,
@@ -692,22 +1569,21 @@ if IS_LIVE_SITE:
 
             typst_file = Path(tmp_dir) / "report.typ"
 
-            returncode, stdout = await typst_compile(typst_file, [])
+            try:
+                # Anonymous users share a single queue so they cannot starve actual users
+                returncode, stdout, filename = await typst_compile_pdf(typst_file, {}, queue_key="anonymous")
+
+            except AdmissionRejected as ex:
+                return build_rejected_response(ex)
 
             if returncode != 0:
                 return PlainTextResponse(f"Failed to build report:\n\n{stdout}", status_code=400)
 
-            final_pdf = typst_file.with_suffix(".pdf")
-
-            output_file = PDF_ARTIFACT_DIR / f"{token_urlsafe(32)}.pdf"
-
-            shutil.move(final_pdf, output_file)
-
         scheme = request.headers.get("x-forwarded-proto", request.url.scheme)
 
-        pdf_url = f"{scheme}://{DOMAIN}/api/v1/files/{output_file.name}"
+        pdf_url = f"{scheme}://{DOMAIN}/api/v1/files/{filename}"
 
-        task = asyncio.create_task(delete_file_after_timeout(output_file))
+        task = asyncio.create_task(delete_file_after_timeout(filename))
         tasks.add(task)
         task.add_done_callback(tasks.discard)
 
@@ -719,7 +1595,7 @@ if IS_LIVE_SITE:
 
         return JSONResponse(data)
 
-    async def delete_file_after_timeout(file: Path) -> None:
+    async def delete_file_after_timeout(filename: str) -> None:
         await asyncio.sleep(60)
 
-        file.unlink(missing_ok=True)  # noqa: ASYNC240
+        await ARTIFACTS.delete(get_pdf_artifact_key(filename))
@@ -1,11 +1,22 @@
+import asyncio
 import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import Coroutine
+from datetime import datetime
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer
 
+from reportobello.config import USER_CACHE_MAX_SIZE, USER_CACHE_TTL_IN_SECONDS
+from reportobello.domain.report import Report
 from reportobello.domain.user import User
-from reportobello.infra.db import get_user_by_api_key
+from reportobello.infra.cache import LRUCache
+from reportobello.infra.db_async import create_or_update_user, get_user_by_api_key
+
+# Maps API keys to users, so that authenticating a request doesn't need to hit the database.
+# Use save_user() when updating a user so that stale copies are evicted.
+USER_CACHE = LRUCache[str, User]("users", max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_IN_SECONDS)
 
 
 class CustomAuthorizer(HTTPBearer):
@@ -31,20 +42,96 @@ class CustomAuthorizer(HTTPBearer):
     async def _get_user(self, request: Request) -> User | None:
         creds = await super().__call__(request)
 
-        if creds and creds.scheme.lower() == "bearer" and (user := get_user_by_api_key(creds.credentials)):
+        if creds and creds.scheme.lower() == "bearer" and (user := await get_cached_user(creds.credentials)):
             return user
 
-        if (api_key := request.cookies.get("api_key")) and (user := get_user_by_api_key(api_key)):
+        if (api_key := request.cookies.get("api_key")) and (user := await get_cached_user(api_key)):
             return user
 
         return None
 
 
+async def get_cached_user(api_key: str) -> User | None:
+    if user := USER_CACHE.get(api_key):
+        return user
+
+    user = await get_user_by_api_key(api_key)
+
+    # Invalid API keys aren't cached, otherwise anyone could fill the cache with garbage
+    if user:
+        USER_CACHE.set(api_key, user)
+
+    return user
+
+
+async def save_user(user: User) -> User:
+    """
+    Create or update **user**, evicting any cached copies of them. Since the API key may have been rotated,
+    entries are evicted by user ID instead of API key.
+    """
+
+    user = await create_or_update_user(user)
+
+    USER_CACHE.remove_where(lambda _, cached: cached.id == user.id)
+
+    return user
+
+
 security = CustomAuthorizer(description="Add your Reportobello API key below. It should start with `rpbl_`")
 
 CurrentUser = Annotated[User, Depends(security)]
 
 
+async def cancel_on_disconnect[T](request: Request, coro: Coroutine[None, None, T]) -> T | None:
+    """
+    Run **coro**, cancelling it if the client disconnects before it finishes. If the client disconnects,
+    None is returned. The request body must be fully read before calling this function.
+    """
+
+    task = asyncio.ensure_future(coro)
+
+    async def wait_for_disconnect() -> None:
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+
+    try:
+        await asyncio.wait([task, disconnect], return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+        disconnect.cancel()
+
+        if not task.done():
+            task.cancel()
+
+    # Give the task a chance to clean up if it was cancelled
+    await asyncio.wait([task])
+
+    if task.cancelled():
+        return None
+
+    return task.result()
+
+
+def encode_report_cursor(report: Report) -> str:
+    """
+    Create an opaque cursor pointing after **report** in the build history.
+    """
+
+    return urlsafe_b64encode(f"{report.finished_at.isoformat()} {report.id}".encode()).decode()
+
+
+def decode_report_cursor(cursor: str) -> tuple[datetime, int] | None:
+    try:
+        finished_at, report_id = urlsafe_b64decode(cursor).decode().split(" ")
+
+        return datetime.fromisoformat(finished_at), int(report_id)
+
+    except ValueError:
+        return None
+
+
 # TODO: move to generic utils
 def json_prettify(j: str) -> str:
     return json.dumps(json.loads(j), indent=2, ensure_ascii=False)
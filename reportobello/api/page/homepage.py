@@ -4,7 +4,7 @@ from fastapi.templating import Jinja2Templates
 
 from reportobello.api.common import security
 from reportobello.config import IS_LIVE_SITE
-from reportobello.infra.db import get_all_templates_for_user
+from reportobello.infra.db_async import get_all_templates_for_user
 
 router = APIRouter()
 
@@ -22,7 +22,7 @@ async def get(request: Request):  # type: ignore  # noqa: ANN201
 
         return RedirectResponse("/login")
 
-    rows = get_all_templates_for_user(user.id)
+    rows = await get_all_templates_for_user(user.id)
 
     # TODO: sort by most recently used
     ctx = {"templates": sorted(rows, key=lambda x: x.name)}
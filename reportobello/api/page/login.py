@@ -8,7 +8,7 @@ from fastapi.templating import Jinja2Templates
 
 from reportobello.api.limiter import limiter
 from reportobello.config import IS_LIVE_SITE
-from reportobello.infra.db import get_user_by_api_key
+from reportobello.infra.db_async import get_user_by_api_key
 
 router = APIRouter()
 logger = logging.getLogger("reportobello")
@@ -34,7 +34,7 @@ async def login_page(
 @router.post("/login")
 @limiter.limit("10/minute")
 async def post(request: Request, api_key: Annotated[str, Form()] = "") -> RedirectResponse:
-    user = get_user_by_api_key(api_key)
+    user = await get_user_by_api_key(api_key)
 
     if not user:
         logger.info("login failed")
@@ -7,13 +7,11 @@ from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse
 from requests_oauthlib import OAuth2Session
 
+from reportobello.api.common import save_user
 from reportobello.api.limiter import limiter
 from reportobello.domain.user import User
-from reportobello.infra.db import (
-    create_or_update_user,
-    create_random_api_key,
-    get_user_by_provider_id,
-)
+from reportobello.infra.db import create_random_api_key
+from reportobello.infra.db_async import get_user_by_provider_id
 
 router = APIRouter()
 
@@ -77,7 +75,7 @@ class GitHubProvider:
         provider = "github"
         provider_user_id = str(github_user["id"])
 
-        if user := get_user_by_provider_id(provider=provider, provider_user_id=provider_user_id):
+        if user := await get_user_by_provider_id(provider=provider, provider_user_id=provider_user_id):
             return user
 
         new_user = User(
@@ -89,7 +87,7 @@ class GitHubProvider:
             email=github_user.get("email"),
         )
 
-        return create_or_update_user(new_user)
+        return await save_user(new_user)
 
 
 GitHubOAuth = GitHubProvider()
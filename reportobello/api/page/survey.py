@@ -7,8 +7,8 @@ from fastapi import APIRouter, Form, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
-from reportobello.api.common import CurrentUser
-from reportobello.infra.db import create_or_update_user, db
+from reportobello.api.common import CurrentUser, save_user
+from reportobello.infra.db_async import save_new_user_survey
 
 router = APIRouter()
 logger = logging.getLogger("reportobello")
@@ -37,23 +37,9 @@ async def post(
         "features": [f for f in features if f],
     }
 
-    # TODO: move to db.py
-    cursor = db.cursor()
-    cursor.execute(
-        """
-INSERT INTO new_user_survey (owner_id, submitted_at, value)
-VALUES (?, ?, ?)
-ON CONFLICT DO UPDATE SET
-    value=excluded.value,
-    submitted_at=excluded.submitted_at;
-""",
-        [user.id, now.isoformat(), json.dumps(data, separators=(",", ":"))],
-    )
-    cursor.close()
+    await save_new_user_survey(user.id, now, json.dumps(data, separators=(",", ":")))
 
     user.is_setting_up_account = False
-    create_or_update_user(user)
-
-    db.commit()
+    await save_user(user)
 
     return RedirectResponse("/", status_code=302)
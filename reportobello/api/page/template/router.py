@@ -1,3 +1,4 @@
+import html
 import math
 import time
 from datetime import UTC, datetime
@@ -6,11 +7,12 @@ from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
-from reportobello.api.common import CurrentUser, json_prettify
-from reportobello.infra.db import (
+from reportobello.api.common import CurrentUser, decode_report_cursor, encode_report_cursor, json_prettify
+from reportobello.infra.db_async import (
     get_env_vars_for_user,
     get_files_for_template,
     get_recent_report_builds_for_user,
+    get_report_data_for_user,
     get_template_for_user,
 )
 
@@ -22,7 +24,7 @@ templates = Jinja2Templates(directory="templates")
 @router.get("/template/{name}")
 async def get(request: Request, user: CurrentUser, name: str) -> HTMLResponse:
     now = datetime.now(tz=UTC)
-    template = get_template_for_user(user.id, name)
+    template = await get_template_for_user(user.id, name)
 
     ctx = {
         "name": name,
@@ -41,9 +43,9 @@ async def get(request: Request, user: CurrentUser, name: str) -> HTMLResponse:
             "template": template.template,
         }
 
-        ctx["env_vars"] = get_env_vars_for_user(user.id)
+        ctx["env_vars"] = await get_env_vars_for_user(user.id)
 
-        reports = get_recent_report_builds_for_user(user.id, name, before=now, limit=1)
+        reports = await get_recent_report_builds_for_user(user.id, name, before=now, limit=1)
 
         if reports:
             ctx["last_json_value"] = json_prettify(reports[0].data or "{}")
@@ -53,21 +55,42 @@ async def get(request: Request, user: CurrentUser, name: str) -> HTMLResponse:
 
 
 @router.get("/template/{name}/builds")
-async def get_builds(request: Request, user: CurrentUser, name: str, before: datetime | None = None) -> HTMLResponse:
+async def get_builds(
+    request: Request,
+    user: CurrentUser,
+    name: str,
+    before: datetime | None = None,
+    cursor: str | None = None,
+) -> HTMLResponse:
     limit = 20
-    reports = get_recent_report_builds_for_user(user.id, name, before=before, limit=limit) or []
+    after_cursor = None
+
+    if cursor is not None and (after_cursor := decode_report_cursor(cursor)) is None:
+        return HTMLResponse("Invalid cursor", status_code=400)
+
+    reports = (
+        await get_recent_report_builds_for_user(
+            user.id,
+            name,
+            before=before,
+            limit=limit,
+            after_cursor=after_cursor,
+            with_data=False,
+        )
+        or []
+    )
 
     ctx = {
         "limit": limit,
         "reports": [
             {
+                "id": report.id,
                 "was_successful": bool(report.was_successful),
                 "requested_version": report.requested_version,
                 "actual_version": report.actual_version,
                 "finished_at": report.finished_at.isoformat(),
                 "started_at": report.started_at.isoformat(),
                 "data_type": report.data_type.title(),
-                "json": json_prettify(report.data or "{}"),
                 "error_message": report.error_message,
                 "filename": report.filename,
                 "template_name": report.template_name,
@@ -76,11 +99,23 @@ async def get_builds(request: Request, user: CurrentUser, name: str, before: dat
         ],
         "name": name,
         "before": before.isoformat() if before else None,
-        "last_report_started_at": reports[-1].started_at.isoformat() if reports else None,
+        "cursor": cursor,
+        "next_cursor": encode_report_cursor(reports[-1]) if reports else None,
     }
     return templates.TemplateResponse(request, "template/build_history_list.html", context=ctx)
 
 
+@router.get("/template/{name}/builds/{report_id}/data")
+async def get_build_data(user: CurrentUser, name: str, report_id: int) -> HTMLResponse:
+    # Payloads can be large, so they are only loaded (and prettified) once a row is expanded
+    report = await get_report_data_for_user(user.id, name, report_id)
+
+    if report is None:
+        return HTMLResponse("Report not found", status_code=404)
+
+    return HTMLResponse(html.escape(json_prettify(report.data or "{}")))
+
+
 @router.get("/template/{name}/files")
 async def get_files(request: Request, user: CurrentUser, name: str) -> HTMLResponse:
     ctx = {
@@ -91,7 +126,7 @@ async def get_files(request: Request, user: CurrentUser, name: str) -> HTMLRespo
                 "size_full": f"{file.size:,}",
                 "size_pretty": prettify_byte_size(file.size),
             }
-            for file in get_files_for_template(user.id, name)
+            for file in await get_files_for_template(user.id, name)
         ],
     }
 
@@ -0,0 +1,57 @@
+import re
+
+from starlette.datastructures import Headers
+
+BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)", re.IGNORECASE)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so "W/" prefixes are ignored
+    if if_none_match is None:
+        return False
+
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    return "*" in tags or f'"{etag}"' in tags
+
+
+def get_byte_range(headers: Headers, *, size: int, etag: str) -> tuple[int, int] | None:
+    # Return the (start, exclusive end) of the byte range requested by the Range header, or None if the whole file
+    # should be sent. Requests for more than one range get the whole file, which is allowed by RFC 9110 (PDF
+    # viewers only request one range at a time). RangeNotSatisfiable is raised if the range is outside of the file.
+
+    range_header = headers.get("range")
+    if_range = headers.get("if-range")
+
+    # If-Range uses the strong comparison. Dates aren't supported, so those always get the whole file.
+    if range_header is None or (if_range is not None and if_range != f'"{etag}"'):
+        return None
+
+    match = BYTE_RANGE.fullmatch(range_header.strip())
+
+    if not match or match.group(0).endswith("=-"):
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        # Suffix range, the last N bytes
+        if not last or int(last) == 0:
+            raise RangeNotSatisfiable
+
+        return max(size - int(last), 0), size
+
+    start = int(first)
+
+    # Invalid ranges are ignored
+    if last and int(last) < start:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable
+
+    return start, min(int(last) + 1, size) if last else size
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import logging
+import socket
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+from hashlib import sha256
+from ipaddress import IPv4Address, IPv6Address, ip_address
+from secrets import token_urlsafe
+
+import httpx
+from opentelemetry import trace
+
+from reportobello.api.common import mimetype_strip_encoding
+from reportobello.application.build_pdf import (
+    ReportobelloBuildFailed,
+    ReportobelloException,
+    ReportobelloInvalidContentType,
+    build_template,
+    get_build_cache_key,
+    get_cached_report,
+    load_build_context,
+)
+from reportobello.config import (
+    BUILD_JOB_LEASE_IN_SECONDS,
+    BUILD_JOB_POLL_INTERVAL_IN_SECONDS,
+    TYPST_WORKER_COUNT,
+    WEBHOOK_ALLOWED_HOSTS,
+)
+from reportobello.domain.build_job import BuildJob
+from reportobello.domain.report import Report
+from reportobello.domain.user import User
+from reportobello.infra.admission import AdmissionRejected
+from reportobello.infra.db_async import (
+    claim_build_job,
+    create_build_job,
+    finish_build_job,
+    get_build_job,
+    get_user_by_user_id,
+    renew_build_job_lease,
+)
+
+tracer = trace.get_tracer("reportobello")
+logger = logging.getLogger("reportobello")
+
+
+WEBHOOK_ATTEMPTS = 3
+
+# Redirects aren't followed, since they could point to an internal address
+webhook_client = httpx.AsyncClient(timeout=10, follow_redirects=False)
+
+_tasks = set[asyncio.Task[None]]()
+
+# Wakes up the build workers in this process when a job is submitted, so they don't have to wait for the next poll
+_wakeups = set[asyncio.Event]()
+
+
+class ReportobelloInvalidWebhookUrl(ReportobelloException):
+    pass
+
+
+async def submit_build_job(  # noqa: PLR0913
+    *,
+    user: User,
+    template_name: str,
+    template_version: int,
+    content_type: str,
+    data: object,
+    webhook_url: str | None = None,
+    use_cache: bool = True,
+) -> BuildJob:
+    # Jobs are queued in the database, so they will be picked back up if the server is restarted before they
+    # finish, and can be built by build workers running in other processes
+    context = await load_build_context(user=user, template_name=template_name, template_version=template_version)
+
+    if mimetype_strip_encoding(content_type) != "application/json":
+        raise ReportobelloInvalidContentType(f'Invalid content type "{content_type}"')
+
+    if webhook_url is not None:
+        await resolve_webhook_url(webhook_url)
+
+    data = json.dumps(data, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+    data_hash = sha256(data.encode()).hexdigest().lower()
+
+    job = BuildJob(
+        id=token_urlsafe(16),
+        owner_id=user.id,
+        state="queued",
+        template_name=context.template.name,
+        requested_version=template_version,
+        actual_version=context.template.version,
+        queued_at=datetime.now(tz=UTC),
+        data=data,
+        hash=data_hash,
+        # The cache key is re-computed when the job runs since files and env vars might change in the meantime.
+        # An empty cache key means caching is disabled for this job.
+        cache_key=get_build_cache_key(context, data_hash) if use_cache else "",
+        webhook_url=webhook_url,
+    )
+
+    await create_build_job(job)
+
+    logger.info("build job queued", extra={"user": user.id})
+
+    for wakeup in _wakeups:
+        wakeup.set()
+
+    return job
+
+
+async def resolve_webhook_url(url: str) -> httpx.URL:
+    # Check that url is a valid webhook URL, returning it with the host replaced by the address it resolves to.
+    #
+    # To stop users from sending requests to internal services (for example, cloud metadata endpoints), hosts that
+    # resolve to loopback, private, link-local, or otherwise non-public addresses are rejected unless they are in
+    # WEBHOOK_ALLOWED_HOSTS. Webhooks must be sent to the returned address, since the host could resolve to a
+    # different address the next time it is looked up.
+
+    try:
+        parsed = httpx.URL(url)
+
+    except httpx.InvalidURL as ex:
+        raise ReportobelloInvalidWebhookUrl(f"Invalid webhook URL: {ex}") from ex
+
+    if parsed.scheme not in {"http", "https"} or not parsed.host:
+        raise ReportobelloInvalidWebhookUrl("Webhook URL must be an absolute http(s) URL")
+
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(parsed.host, port, type=socket.SOCK_STREAM)
+
+    except (socket.gaierror, UnicodeError) as ex:
+        raise ReportobelloInvalidWebhookUrl("Webhook URL host could not be resolved") from ex
+
+    ips = [ip_address(address[4][0]) for address in addresses]
+
+    if parsed.host.lower() not in WEBHOOK_ALLOWED_HOSTS and not all(map(is_public_address, ips)):
+        raise ReportobelloInvalidWebhookUrl("Webhook URL must not point to a private or internal address")
+
+    return parsed.copy_with(host=str(ips[0]))
+
+
+def is_public_address(ip: IPv4Address | IPv6Address) -> bool:
+    # IPv4 addresses can be written as IPv6 addresses (ie, ::ffff:127.0.0.1)
+    if isinstance(ip, IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+
+    return ip.is_global and not ip.is_multicast
+
+
+def start_build_worker() -> asyncio.Task[None]:
+    return asyncio.create_task(run_build_worker())
+
+
+async def run_build_worker() -> None:
+    """
+    Claim and run jobs from the job queue until cancelled. Any number of build workers can run at once, in this
+    process or in others, as long as they share the same database and artifact store. Jobs that were running
+    when their worker died are started over from the beginning once their lease expires.
+    """
+
+    logger.info("build worker started", extra={"workers": TYPST_WORKER_COUNT})
+
+    # Only run as many jobs as there are compilers so that a large backlog of jobs
+    # doesn't fill up the build queue and starve out regular builds
+    running = asyncio.Semaphore(TYPST_WORKER_COUNT)
+
+    wakeup = asyncio.Event()
+    _wakeups.add(wakeup)
+
+    try:
+        while True:
+            await running.acquire()
+
+            if job_id := await claim_next_build_job(wakeup):
+                task = asyncio.create_task(run_build_job(job_id, running=running))
+                _tasks.add(task)
+                task.add_done_callback(_tasks.discard)
+
+            else:
+                running.release()
+
+                with suppress(TimeoutError):
+                    await asyncio.wait_for(wakeup.wait(), BUILD_JOB_POLL_INTERVAL_IN_SECONDS)
+
+    finally:
+        _wakeups.discard(wakeup)
+
+
+async def claim_next_build_job(wakeup: asyncio.Event) -> str | None:
+    # Cleared before claiming so that jobs submitted while claiming aren't missed
+    wakeup.clear()
+
+    now = datetime.now(tz=UTC)
+    lease_expires_at = now + timedelta(seconds=BUILD_JOB_LEASE_IN_SECONDS)
+
+    try:
+        return await claim_build_job(now=now, lease_expires_at=lease_expires_at)
+
+    except Exception:
+        logger.exception("could not claim build job")
+
+        return None
+
+
+async def run_build_job(job_id: str, *, running: asyncio.Semaphore) -> None:
+    # Run a claimed job, releasing the slot in running that was acquired for it once the build is done
+    try:
+        job = await get_build_job(job_id)
+
+        if job is None or job.state == "done":
+            return
+
+        lease = asyncio.create_task(renew_lease(job_id))
+
+        with tracer.start_as_current_span("build job"):
+            try:
+                await _run_build_job(job)
+
+            except Exception:
+                logger.exception("build job failed", extra={"user": job.owner_id})
+
+                await _fail_build_job(job, "Internal server error")
+
+            finally:
+                lease.cancel()
+
+    finally:
+        running.release()
+
+    if job.webhook_url:
+        await send_webhook(job.id, job.webhook_url)
+
+
+async def renew_lease(job_id: str) -> None:
+    # Keep the job claimed for as long as it is running, so that long builds aren't handed to another worker
+    while True:
+        await asyncio.sleep(BUILD_JOB_LEASE_IN_SECONDS / 3)
+
+        lease_expires_at = datetime.now(tz=UTC) + timedelta(seconds=BUILD_JOB_LEASE_IN_SECONDS)
+
+        try:
+            await renew_build_job_lease(job_id, lease_expires_at=lease_expires_at)
+
+        except Exception:
+            logger.exception("could not renew build job lease")
+
+
+async def _run_build_job(job: BuildJob) -> None:
+    user = await get_user_by_user_id(job.owner_id)
+    assert user
+
+    try:
+        context = await load_build_context(
+            user=user,
+            template_name=job.template_name,
+            template_version=job.actual_version,
+        )
+
+    except ReportobelloException:
+        await _fail_build_job(job, "Template not found")
+        return
+
+    context.requested_version = job.requested_version
+
+    cache_key = get_build_cache_key(context, job.hash) if job.cache_key else ""
+
+    if cache_key and (cached_report := await get_cached_report(job.owner_id, cache_key)):
+        await finish_build_job(job.id, cached_report)
+        return
+
+    while True:
+        try:
+            report, _ = await build_template(
+                context=context,
+                started_at=datetime.now(tz=UTC),
+                extension=job.data_type,
+                data=job.data,
+                save_failed_report=lambda _, report: finish_build_job(job.id, report),
+            )
+
+        except AdmissionRejected as ex:
+            # Unlike regular builds there is no client to retry for us, so wait until the queue frees up
+            await asyncio.sleep(ex.retry_after)
+            continue
+
+        except ReportobelloBuildFailed:
+            return
+
+        report.hash = job.hash
+        report.cache_key = cache_key
+
+        await finish_build_job(job.id, report)
+
+        return
+
+
+async def _fail_build_job(job: BuildJob, error_message: str) -> None:
+    now = datetime.now(tz=UTC)
+
+    report = Report(
+        filename=None,
+        requested_version=job.requested_version,
+        actual_version=job.actual_version,
+        template_name=job.template_name,
+        started_at=now,
+        finished_at=now,
+        expires_at=now,
+        error_message=error_message,
+        data=job.data,
+        data_type=job.data_type,
+    )
+
+    await finish_build_job(job.id, report)
+
+
+async def send_webhook(job_id: str, url: str) -> None:
+    """
+    Notify **url** that a job has finished. The report URL is intentionally not included since
+    anyone with the report URL can download it. Instead, use the job id to get the job status.
+    """
+
+    job = await get_build_job(job_id)
+
+    if job is None or job.report is None:
+        return
+
+    payload = {"id": job.id, "state": job.state, "successful": job.report.was_successful}
+
+    with tracer.start_as_current_span("send webhook"):
+        for attempt in range(WEBHOOK_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(2**attempt)
+
+            try:
+                response = await post_webhook(url, payload)
+
+                if response.is_success:
+                    return
+
+            except httpx.HTTPError:
+                pass
+
+            except ReportobelloInvalidWebhookUrl:
+                # The host resolves to a different address than when the job was submitted
+                break
+
+    logger.warning("webhook failed", extra={"user": job.owner_id})
+
+
+async def post_webhook(url: str, payload: dict[str, object]) -> httpx.Response:
+    target = httpx.URL(url)
+    resolved = await resolve_webhook_url(url)
+
+    # Connect to the address that was checked, while still sending the original host name (and using it for TLS)
+    return await webhook_client.post(
+        resolved,
+        json=payload,
+        headers={"host": target.netloc.decode()},
+        extensions={"sni_hostname": target.host},
+    )
@@ -1,34 +1,77 @@
+import asyncio
 import json
 import logging
+import math
 import re
-import shutil
-import subprocess
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
 from hashlib import sha256
-from itertools import chain
+from importlib.metadata import version
 from pathlib import Path
 from secrets import token_urlsafe
-from tempfile import TemporaryDirectory
 
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 
 from reportobello.api.common import mimetype_strip_encoding
-from reportobello.config import IS_LIVE_SITE, PDF_ARTIFACT_DIR, get_file_artifact_path_from_hash
+from reportobello.config import (
+    BUILD_QUEUE_MAX_LENGTH,
+    BUILD_QUEUE_MAX_PER_USER,
+    BUILD_QUEUE_MAX_WAIT_IN_SECONDS,
+    BUILD_ROOT_CACHE_MAX_SIZE,
+    BUILD_ROOT_DIR,
+    BUILD_TIMEOUT_IN_SECONDS,
+    IS_LIVE_SITE,
+    PDF_ARTIFACT_DIR,
+    REMOTE_BUILDS,
+    TEMPLATE_CACHE_MAX_SIZE,
+    TYPST_WORKER_COUNT,
+    TYPST_WORKER_MAX_BUILDS,
+)
+from reportobello.domain.build_job import BuildJob
+from reportobello.domain.file import File
 from reportobello.domain.report import Report
 from reportobello.domain.template import Template
-from reportobello.domain.user import User
-from reportobello.infra.db import (
-    check_template_exists_for_user,
-    get_cached_report_by_hash,
+from reportobello.domain.user import User, UserId
+from reportobello.infra.admission import Admission, AdmissionRejected
+from reportobello.infra.artifacts import ARTIFACTS, get_file_artifact_key, get_pdf_artifact_key
+from reportobello.infra.build_roots import BuildRootCache
+from reportobello.infra.cache import LRUCache
+from reportobello.infra.db_async import (
+    cancel_build_job,
+    create_build_job,
+    get_build_job,
+    get_cached_report_by_cache_key,
     get_env_vars_for_user,
     get_files_for_template,
+    get_latest_template_version_for_user,
     get_template_for_user,
     save_recent_report_build_for_user,
 )
 from reportobello.infra.job_queue import JobQueue
+from reportobello.infra.single_flight import SingleFlight
+from reportobello.infra.typst_worker import TypstWorkerPool
 
 tracer = trace.get_tracer("reportobello")
 logger = logging.getLogger("reportobello")
+meter = metrics.get_meter("reportobello")
+
+CACHE_HIT_COUNT = meter.create_counter(
+    "reportobello.build_cache.hits",
+    description="Number of builds that were served from an identical, previously built report",
+)
+CACHE_MISS_COUNT = meter.create_counter(
+    "reportobello.build_cache.misses",
+    description="Number of builds that could not be served from a previously built report",
+)
+
+TYPST_VERSION = version("typst")
+
+# Template versions never change once they are saved, so they can be cached without needing to
+# invalidate them on update. The "latest" version is always resolved from the database before using this.
+TEMPLATE_CACHE = LRUCache[tuple[UserId, str, int], Template]("templates", max_size=TEMPLATE_CACHE_MAX_SIZE)
+
+IN_FLIGHT_BUILDS = SingleFlight[Report]("builds")
 
 
 # TODO: move to common location
@@ -57,6 +100,59 @@ class ReportobelloBuildFailed(ReportobelloException):
         return f"Failed to build report:\n\n{self.error_msg}"
 
 
+@dataclass(kw_only=True)
+class BuildContext:
+    """
+    Everything needed to build a report that does not depend on the data being passed in.
+    This is loaded once and can be reused across many builds.
+    """
+
+    user: User
+    template: Template
+    requested_version: int
+    files: list[File]
+    env_vars: dict[str, str]
+
+
+async def load_build_context(
+    *,
+    user: User,
+    template_name: str,
+    template_version: int,
+    template_raw: str | None = None,
+) -> BuildContext:
+    latest_version = await get_latest_template_version_for_user(user.id, template_name)
+
+    if latest_version is None:
+        raise ReportobelloTemplateNotFound
+
+    if template_raw is not None:
+        template = Template(name=template_name, template=template_raw, version=-1)
+
+    elif t := await get_cached_template(
+        user.id,
+        template_name,
+        latest_version if template_version == -1 else template_version,
+    ):
+        template = t
+
+    else:
+        raise ReportobelloTemplateVersionNotFound(template_version)
+
+    files, env_vars = await asyncio.gather(
+        get_files_for_template(user.id, template_name),
+        get_env_vars_for_user(user.id),
+    )
+
+    return BuildContext(
+        user=user,
+        template=template,
+        requested_version=template_version,
+        files=files,
+        env_vars=env_vars,
+    )
+
+
 async def build_report(  # noqa: PLR0913
     *,
     user: User,
@@ -65,154 +161,446 @@ async def build_report(  # noqa: PLR0913
     content_type: str,
     data: object,
     template_raw: str | None = None,
-    is_pure: bool = False,
+    use_cache: bool = True,
 ) -> Report:
-    started_at = datetime.now(tz=UTC)
-
-    if not check_template_exists_for_user(user.id, template_name):
-        raise ReportobelloTemplateNotFound
+    context = await load_build_context(
+        user=user,
+        template_name=template_name,
+        template_version=template_version,
+        template_raw=template_raw,
+    )
 
     if mimetype_strip_encoding(content_type) != "application/json":
         raise ReportobelloInvalidContentType(f'Invalid content type "{content_type}"')
 
+    return await build_report_from_context(context, data, use_cache=use_cache)
+
+
+async def build_report_from_context(context: BuildContext, data: object, *, use_cache: bool = True) -> Report:
+    started_at = datetime.now(tz=UTC)
+
     data = json.dumps(data, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
     data_hash = sha256(data.encode()).hexdigest().lower()
 
-    if template_raw is not None:
-        template = Template(name=template_name, template=template_raw, version=-1)
+    # Preview builds are never saved, so there is nothing to cache
+    use_cache = use_cache and context.template.version != -1
 
-    elif t := get_template_for_user(user.id, template_name, template_version):
-        template = t
+    cache_key = get_build_cache_key(context, data_hash) if use_cache else ""
+
+    async def build() -> Report:
+        # Previews can't be sent to a build worker since the template isn't saved
+        if REMOTE_BUILDS and context.template.version != -1:
+            return await build_remotely(context, data=data, data_hash=data_hash, cache_key=cache_key)
+
+        report, _ = await build_template(
+            context=context,
+            started_at=started_at,
+            extension="json",
+            data=data,
+        )
+
+        report.hash = data_hash
+        report.cache_key = cache_key
+
+        await save_recent_report_build_for_user(context.user.id, report)
+
+        return report
+
+    if not cache_key:
+        return await build()
+
+    if cached_report := await get_cached_report(context.user.id, cache_key):
+        return cached_report
+
+    # Identical builds that are already running won't be cached until they finish, so wait for them instead
+    return await IN_FLIGHT_BUILDS.run(f"{context.user.id}:{cache_key}", build)
+
+
+async def build_remotely(context: BuildContext, *, data: str, data_hash: str, cache_key: str) -> Report:
+    # Queue the build as a job (see build_jobs.py) and wait for a build worker to finish it. The report is saved by
+    # the build worker, so it doesn't need to be saved again.
+
+    job = BuildJob(
+        id=token_urlsafe(16),
+        owner_id=context.user.id,
+        state="queued",
+        template_name=context.template.name,
+        requested_version=context.requested_version,
+        actual_version=context.template.version,
+        queued_at=datetime.now(tz=UTC),
+        data=data,
+        hash=data_hash,
+        cache_key=cache_key,
+    )
+
+    await create_build_job(job)
+
+    try:
+        with tracer.start_as_current_span("wait for build worker"):
+            report = await wait_for_build_job(job.id)
+
+    except (AdmissionRejected, asyncio.CancelledError):
+        # Nobody is waiting for the report anymore (the build timed out, or the client disconnected), so don't let a
+        # worker waste a build slot on it
+        await asyncio.shield(cancel_build_job(job.id))
+
+        raise
+
+    if report.error_message is not None:
+        raise ReportobelloBuildFailed(report.error_message)
+
+    return report
+
+
+async def wait_for_build_job(job_id: str) -> Report:
+    try:
+        async with asyncio.timeout(BUILD_QUEUE_MAX_WAIT_IN_SECONDS + BUILD_TIMEOUT_IN_SECONDS):
+            return await poll_build_job(job_id)
+
+    except TimeoutError as ex:
+        raise AdmissionRejected(
+            "Build waited in queue for too long, try again later",
+            status_code=503,
+            retry_after=math.ceil(BUILD_QUEUE_MAX_WAIT_IN_SECONDS),
+        ) from ex
+
+
+async def poll_build_job(job_id: str) -> Report:
+    delay = 0.05
+
+    while True:
+        job = await get_build_job(job_id)
+
+        if job and job.report:
+            return job.report
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+async def get_cached_template(user_id: UserId, template_name: str, version: int) -> Template | None:
+    key = (user_id, template_name, version)
+
+    if template := TEMPLATE_CACHE.get(key):
+        return template
 
-        if is_pure:
-            cached_report = get_cached_report_by_hash(
-                user_id=user.id, template_name=template.name, template_version=template.version, hash=data_hash
-            )
+    template = await get_template_for_user(user_id, template_name, version)
 
-            if cached_report:
-                return cached_report
+    if template:
+        TEMPLATE_CACHE.set(key, template)
+
+    return template
+
+
+def forget_cached_templates(user_id: UserId, template_name: str) -> None:
+    """
+    Evict every cached version of **template_name**. This must be called when a template is deleted,
+    since version numbers start over if a template with the same name is created again.
+    """
+
+    TEMPLATE_CACHE.remove_where(lambda key, _: key[:2] == (user_id, template_name))
+
+
+def get_build_cache_key(context: BuildContext, data_hash: str) -> str:
+    """
+    Hash everything that goes into a build. If two builds have the same key, they will produce the same PDF,
+    barring any non-determinism in the template itself (for example, using `datetime.today()`).
+    """
+
+    key = sha256()
+
+    key.update(f"typst={TYPST_VERSION}\0".encode())
+    key.update(f"prelude={TYPST_PRELUDE}\0".encode())
+    key.update(f"template={context.template.template}\0".encode())
+
+    for file in sorted(context.files, key=lambda f: f.filename):
+        key.update(f"file={file.filename}\0{file.hash}\0".encode())
+
+    for name, value in sorted(context.env_vars.items()):
+        key.update(f"env={name}\0{value}\0".encode())
+
+    key.update(f"data={data_hash}".encode())
+
+    return key.hexdigest().lower()
+
+
+async def get_cached_report(user_id: UserId, cache_key: str) -> Report | None:
+    report = await get_cached_report_by_cache_key(user_id, cache_key, now=datetime.now(tz=UTC))
+
+    if report:
+        CACHE_HIT_COUNT.add(1)
 
     else:
-        raise ReportobelloTemplateVersionNotFound(template_version)
+        CACHE_MISS_COUNT.add(1)
 
-    report = await build_template(
-        user=user,
-        requested_version=template_version,
+    return report
+
+
+@dataclass(kw_only=True)
+class MergedReport:
+    report: Report
+
+    # First and last page (1-indexed, inclusive) for each record, in the same order as the records
+    pages: list[tuple[int, int]]
+
+
+async def build_merged_report(context: BuildContext, records: list[object]) -> MergedReport:
+    """
+    Build a single PDF containing every record in **records**, compiling the template only once.
+    Each record starts on a new page, and the page range for each record is returned alongside the report.
+    """
+
+    started_at = datetime.now(tz=UTC)
+
+    data = json.dumps(records, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+    report, stdout = await build_template(
+        context=context,
         started_at=started_at,
-        template=template,
         extension="json",
         data=data,
+        merged=True,
     )
 
-    report.hash = data_hash
+    report.hash = sha256(data.encode()).hexdigest().lower()
 
-    save_recent_report_build_for_user(user.id, report)
+    await save_recent_report_build_for_user(context.user.id, report)
 
-    return report
+    # The last entry is the page that the document ends on
+    *starts, end = json.loads(stdout)
+    ends = [*(start - 1 for start in starts[1:]), end]
 
+    # Records that don't output anything share a page with the next record
+    pages = [(start, max(start, end)) for start, end in zip(starts, ends, strict=True)]
 
-STRIP_ERROR_MSG = re.compile(r"(\s)┌─\ (.*\/)report.typ(st)?(.*)")
+    return MergedReport(report=report, pages=pages)
 
 
-POOL = JobQueue()
+class BatchBuild:
+    """
+    Build many reports using the same template. Data can be submitted while earlier reports are still being built,
+    and results are returned in the order that they finish.
+    """
 
+    def __init__(self, context: BuildContext, *, concurrency: int, use_cache: bool = True) -> None:
+        self.context = context
+        self.use_cache = use_cache
 
-async def typst_compile(file: Path, inputs: list[tuple[str, str]]) -> tuple[int, str]:
-    with tracer.start_as_current_span("typst compile"):
-        return await POOL.run(_typst_compile, str(file), inputs)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set[asyncio.Task[None]]()
+        self._results = asyncio.Queue[tuple[int, Report | ReportobelloException | AdmissionRejected]]()
+        self._count = 0
 
+    def submit(self, data: object) -> None:
+        task = asyncio.create_task(self._build(self._count, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-def _typst_compile(file: str, inputs: list[tuple[str, str]]) -> tuple[int, str]:
-    process = subprocess.run(  # noqa: S603
-        [  # noqa: S607
-            "typst",
-            "compile",
-            "--root",
-            str(Path(file).parent),
-            file,
-            *chain.from_iterable(inputs),
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=False,
-    )
+        self._count += 1
 
-    return process.returncode, process.stdout.decode()
+    @property
+    def count(self) -> int:
+        return self._count
 
+    async def _build(self, index: int, data: object) -> None:
+        # Limit the number of in-flight builds so large batches don't get rejected for flooding the build queue
+        async with self._semaphore:
+            try:
+                result: Report | ReportobelloException | AdmissionRejected = await build_report_from_context(
+                    self.context, data, use_cache=self.use_cache
+                )
 
-# This prelude needs to be inserted at the begining of the template, not at the package level.
-# The reason being is that the package is sandboxed, and does not share the same file system
-# root, meaning the `data.json` file is not accessible. Preloading it in this manner ensures it
-# can be accessed from inside the template. We also use a semicolon to ensure the line numbers
-# don't get screwed up.
-TYPST_PRELUDE = '#let data = json("data.json"); '
+            except (ReportobelloException, AdmissionRejected) as ex:
+                result = ex
+
+            except Exception:
+                # Always report a result, otherwise the caller will wait forever
+                logger.exception("batch build failed", extra={"user": self.context.user.id})
+
+                result = ReportobelloException("Internal server error")
+
+        self._results.put_nowait((index, result))
+
+    async def results(self) -> AsyncGenerator[tuple[int, Report | ReportobelloException | AdmissionRejected]]:
+        # Builds that have not finished yet are cancelled if the caller stops iterating early
+        try:
+            for _ in range(self._count):
+                yield await self._results.get()
+
+        finally:
+            self.cancel()
 
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
 
-async def build_template(  # noqa: PLR0913, PLR0914
+
+STRIP_ERROR_MSG = re.compile(r"(\s)┌─\ (.*\/)report.typ(st)?(.*)")
+
+
+POOL = JobQueue("typst", max_workers=TYPST_WORKER_COUNT)
+
+ADMISSION = Admission(
+    TYPST_WORKER_COUNT,
+    max_queue_length=BUILD_QUEUE_MAX_LENGTH,
+    max_queue_per_user=BUILD_QUEUE_MAX_PER_USER,
+    max_wait=BUILD_QUEUE_MAX_WAIT_IN_SECONDS,
+)
+
+TYPST_WORKERS = TypstWorkerPool(
+    TYPST_WORKER_COUNT,
+    max_builds_per_worker=TYPST_WORKER_MAX_BUILDS,
+    build_timeout=BUILD_TIMEOUT_IN_SECONDS,
+)
+
+BUILD_ROOTS = BuildRootCache(BUILD_ROOT_DIR, store=ARTIFACTS, max_size=BUILD_ROOT_CACHE_MAX_SIZE)
+
+
+async def typst_compile(
+    file: Path,
+    inputs: dict[str, str],
     *,
-    user: User,
-    requested_version: int,
-    started_at: datetime,
-    template: Template,
-    extension: str,
-    data: str,
-) -> Report:
-    with TemporaryDirectory() as tmp:
-        tmp_dir = Path(tmp)
+    queue_key: str,
+    output: Path,
+    query: str | None = None,
+) -> tuple[int, str]:
+    """
+    Compile **file** to **output** once a build slot is available. Builds are queued fairly based on **queue_key**.
+    Raises AdmissionRejected if the build queue is full.
+    """
 
-        files = get_files_for_template(user.id, template.name)
+    async with ADMISSION.admit(queue_key):
+        with tracer.start_as_current_span("typst compile"):
+            return await POOL.run(_typst_compile, str(file), str(output), inputs, query)
 
-        for file in files:
-            raw_file = get_file_artifact_path_from_hash(file.hash)
 
-            expanded_path = (tmp_dir / file.filename).absolute()
-            assert expanded_path.is_relative_to(tmp_dir)
+def _typst_compile(file: str, output: str, inputs: dict[str, str], query: str | None) -> tuple[int, str]:
+    return TYPST_WORKERS.compile(file, output, inputs, query=query)
 
-            expanded_path.symlink_to(raw_file)
 
-        data_file = tmp_dir / f"data.{extension}"
-        data_file.write_text(data)
+async def typst_compile_pdf(
+    file: Path,
+    inputs: dict[str, str],
+    *,
+    queue_key: str,
+    query: str | None = None,
+) -> tuple[int, str, str]:
+    """
+    Compile **file** and save it to the artifact store, returning the filename of the new PDF along with the
+    return code and output of the compiler. The filename is empty if the build failed.
+    """
 
-        typst_file = tmp_dir / "report.typ"
-        typst_file.write_text(TYPST_PRELUDE + template.template)
+    filename = f"{token_urlsafe(32)}.pdf"
 
-        env_vars = get_env_vars_for_user(user.id)
+    # Typst doesn't write the PDF atomically, so a temporary name is used to ensure partially written PDFs are never
+    # served. For local artifacts, the temporary file is in the same directory so that saving it is an atomic rename.
+    tmp = PDF_ARTIFACT_DIR / f".{filename}.tmp"
 
-        inputs: list[tuple[str, str]] = [("--input", f"{k}={v}") for k, v in env_vars.items()]
+    # Typst doesn't create missing directories, and nothing else might have created it yet (ie, on a fresh install)
+    await asyncio.to_thread(PDF_ARTIFACT_DIR.mkdir, parents=True, exist_ok=True)
 
-        returncode, stdout = await typst_compile(typst_file, inputs)
+    try:
+        returncode, stdout = await typst_compile(file, inputs, queue_key=queue_key, output=tmp, query=query)
 
-        # TODO: how do we differentiate between user error vs server error?
         if returncode != 0:
-            logger.info("build failed", extra={"user": user.id})
+            return returncode, stdout, ""
+
+        with tracer.start_as_current_span("save pdf"):
+            await ARTIFACTS.put_file(get_pdf_artifact_key(filename), tmp)
+
+    finally:
+        tmp.unlink(missing_ok=True)
 
-            finished_at = datetime.now(tz=UTC)
+    return returncode, stdout, filename
 
-            stdout = STRIP_ERROR_MSG.sub(r"\1┌─ report.typ\3", stdout)
 
-            report = Report(
-                filename=None,
-                requested_version=requested_version,
-                actual_version=template.version,
-                template_name=template.name,
-                started_at=started_at,
-                finished_at=finished_at,
-                expires_at=finished_at,
-                error_message=stdout,
-                data=data,
-                data_type=extension,
-            )
+# This prelude needs to be inserted at the begining of the template, not at the package level.
+# The reason being is that the package is sandboxed, and does not share the same scope as the
+# template. Preloading the data in this manner ensures it can be accessed from inside the template.
+# We also use a semicolon to ensure the line numbers don't get screwed up.
+#
+# The data is passed to the compiler in memory as an input instead of being written to a file, since the
+# template is shared between builds and the data can be quite large.
+TYPST_DATA_INPUT = "rpbl-data"
+TYPST_PRELUDE = f'#let data = json(bytes(sys.inputs.at("{TYPST_DATA_INPUT}"))); '
+
+# When merging, the template is rendered once per record, with each record starting on a new page.
+# Labels are placed at the start of each record so that the page ranges can be queried after compiling.
+TYPST_MERGED_PRELUDE = (
+    f'#let __records = json(bytes(sys.inputs.at("{TYPST_DATA_INPUT}"))); '
+    "#for data in __records [#pagebreak(weak: true)#metadata(none) <rpbl-record>"
+)
+TYPST_MERGED_POSTLUDE = "\n]\n#metadata(none) <rpbl-end>\n"
+TYPST_MERGED_QUERY = "(query(<rpbl-record>) + query(<rpbl-end>)).map(m => m.location().page())"
+
+
+async def build_template(  # noqa: PLR0913
+    *,
+    context: BuildContext,
+    started_at: datetime,
+    extension: str,
+    data: str,
+    merged: bool = False,
+    save_failed_report: Callable[[UserId, Report], Awaitable[None]] = save_recent_report_build_for_user,
+) -> tuple[Report, str]:
+    user = context.user
+    template = context.template
+    requested_version = context.requested_version
 
-            save_recent_report_build_for_user(user.id, report)
+    if merged:
+        source = TYPST_MERGED_PRELUDE + template.template + TYPST_MERGED_POSTLUDE
+
+    else:
+        source = TYPST_PRELUDE + template.template
 
-            raise ReportobelloBuildFailed(stdout)
+    sources = {"report.typ": source}
 
-        final_pdf = typst_file.with_suffix(".pdf")
-        output_file = PDF_ARTIFACT_DIR / f"{token_urlsafe(32)}.pdf"
+    # Templates can also read the data directly from a data file (see docs/concepts.md), in which case the data
+    # needs to be written to the build root. This means the build root can only be shared with identical builds.
+    if f"data.{extension}" in template.template:
+        sources[f"data.{extension}"] = data
 
-        with tracer.start_as_current_span("copy file"):
-            # TODO: upload to S3 bucket
-            shutil.move(final_pdf, output_file)
+    # Builds with the same template and files share a build root, even across users
+    root_key = sha256()
+    for filename, text in sorted(sources.items()):
+        root_key.update(f"{filename}\0{text}\0".encode())
+    for file in sorted(context.files, key=lambda f: f.filename):
+        root_key.update(f"\0{file.filename}\0{file.hash}".encode())
+
+    files = {file.filename: get_file_artifact_key(file.hash) for file in context.files}
+
+    async with BUILD_ROOTS.use_root(root_key.hexdigest(), sources=sources, files=files) as root:
+        returncode, stdout, filename = await typst_compile_pdf(
+            root / "report.typ",
+            {**context.env_vars, TYPST_DATA_INPUT: data},
+            queue_key=str(user.id),
+            query=TYPST_MERGED_QUERY if merged else None,
+        )
+
+    # TODO: how do we differentiate between user error vs server error?
+    if returncode != 0:
+        logger.info("build failed", extra={"user": user.id})
+
+        finished_at = datetime.now(tz=UTC)
+
+        stdout = STRIP_ERROR_MSG.sub(r"\1┌─ report.typ\3", stdout)
+
+        report = Report(
+            filename=None,
+            requested_version=requested_version,
+            actual_version=template.version,
+            template_name=template.name,
+            started_at=started_at,
+            finished_at=finished_at,
+            expires_at=finished_at,
+            error_message=stdout,
+            data=data,
+            data_type=extension,
+        )
+
+        await save_failed_report(user.id, report)
+
+        raise ReportobelloBuildFailed(stdout)
 
     # TODO: allow this to be configurable
     offset = timedelta(hours=1) if IS_LIVE_SITE else timedelta(days=7)
@@ -220,8 +608,8 @@ async def build_template(  # noqa: PLR0913, PLR0914
     finished_at = datetime.now(tz=UTC)
     expires_at = finished_at + offset
 
-    return Report(
-        filename=output_file.name,
+    report = Report(
+        filename=filename,
         requested_version=requested_version,
         actual_version=template.version,
         template_name=template.name,
@@ -231,3 +619,5 @@ async def build_template(  # noqa: PLR0913, PLR0914
         data=data,
         data_type=extension,
     )
+
+    return report, stdout
@@ -0,0 +1,214 @@
+import math
+import re
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime, timedelta
+from secrets import token_urlsafe
+
+from opentelemetry import trace
+
+from reportobello.config import (
+    UPLOAD_DIR,
+    UPLOAD_MAX_FILE_SIZE,
+    UPLOAD_MAX_RESUMABLE_FILE_SIZE,
+    UPLOAD_SESSION_TTL_IN_SECONDS,
+)
+from reportobello.domain.file import File
+from reportobello.domain.upload_session import UploadChunk, UploadSession
+from reportobello.domain.user import User
+from reportobello.infra.artifacts import ARTIFACTS, get_chunk_artifact_key, get_file_artifact_key
+from reportobello.infra.db_async import (
+    check_file_uploaded_by_user,
+    check_template_exists_for_user,
+    create_upload_session,
+    delete_upload_session,
+    get_upload_session,
+    mark_upload_chunks_received,
+    save_file_metadata,
+)
+from reportobello.infra.uploads import UploadRejected, receive_body
+
+tracer = trace.get_tracer("reportobello")
+
+# Same limit as S3 multipart uploads
+MAX_CHUNKS = 10_000
+
+SHA3_512_HASH = re.compile(r"[0-9a-f]{128}")
+
+
+async def start_upload(  # noqa: PLR0913
+    *,
+    user: User,
+    template_name: str,
+    filename: str,
+    content_type: str | None,
+    size: int,
+    hash: str,  # noqa: A002
+    chunk_size: int,
+    chunk_hashes: list[str],
+) -> UploadSession:
+    # Start a resumable upload of a file to template_name. The file is split into chunks of chunk_size bytes (the
+    # last chunk can be smaller), and chunk_hashes is the SHA3-512 hash of each chunk.
+    #
+    # Chunks are stored by their hash, so chunks that have already been received (by this or another upload of the
+    # same user) are marked as received right away and don't need to be sent again. If the user already uploaded the
+    # whole file, no chunks need to be sent at all. Files and chunks of other users are never reused this way, since
+    # the hash alone doesn't prove that the client actually has the file.
+
+    hash = hash.lower()  # noqa: A001
+    chunk_hashes = [chunk_hash.lower() for chunk_hash in chunk_hashes]
+
+    if not filename:
+        raise UploadRejected("Filename is required", status_code=400)
+
+    if not 0 < size <= UPLOAD_MAX_RESUMABLE_FILE_SIZE:
+        raise UploadRejected("File is too large", status_code=413)
+
+    if not 0 < chunk_size <= UPLOAD_MAX_FILE_SIZE:
+        raise UploadRejected(f"Chunk size must be between 1 and {UPLOAD_MAX_FILE_SIZE} bytes", status_code=400)
+
+    if len(chunk_hashes) != math.ceil(size / chunk_size) or len(chunk_hashes) > MAX_CHUNKS:
+        raise UploadRejected(f"Expected one hash per chunk, and at most {MAX_CHUNKS} chunks", status_code=400)
+
+    if not all(SHA3_512_HASH.fullmatch(h) for h in [hash, *chunk_hashes]):
+        raise UploadRejected("Hashes must be hex encoded SHA3-512 hashes", status_code=400)
+
+    if not await check_template_exists_for_user(user.id, template_name):
+        raise UploadRejected("Template not found", status_code=404)
+
+    now = datetime.now(tz=UTC)
+
+    session = UploadSession(
+        id=token_urlsafe(16),
+        owner_id=user.id,
+        template_name=template_name,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        hash=hash,
+        chunk_size=chunk_size,
+        created_at=now,
+        expires_at=now + timedelta(seconds=UPLOAD_SESSION_TTL_IN_SECONDS),
+        chunks=[
+            UploadChunk(offset=offset, size=min(chunk_size, size - offset), hash=chunk_hash)
+            for offset, chunk_hash in zip(range(0, size, chunk_size), chunk_hashes, strict=True)
+        ],
+    )
+
+    await create_upload_session(session)
+
+    return await get_upload(user=user, template_name=template_name, upload_id=session.id)
+
+
+async def get_upload(*, user: User, template_name: str, upload_id: str) -> UploadSession:
+    session = await get_upload_session(upload_id)
+
+    if (
+        session is None
+        or session.owner_id != user.id
+        or session.template_name != template_name
+        or session.expires_at < datetime.now(tz=UTC)
+    ):
+        raise UploadRejected("Upload not found", status_code=404)
+
+    if await check_file_already_uploaded(user, session):
+        for chunk in session.chunks:
+            chunk.received = True
+
+    return session
+
+
+async def check_file_already_uploaded(user: User, session: UploadSession) -> bool:
+    return await check_file_uploaded_by_user(user.id, session.hash) and await ARTIFACTS.exists(
+        get_file_artifact_key(session.hash)
+    )
+
+
+async def upload_chunk(
+    *,
+    user: User,
+    template_name: str,
+    upload_id: str,
+    offset: int,
+    stream: AsyncIterator[bytes],
+) -> None:
+    session = await get_upload(user=user, template_name=template_name, upload_id=upload_id)
+
+    chunk = session.get_chunk(offset)
+
+    if chunk is None:
+        raise UploadRejected("Offset must be the start of a chunk", status_code=400)
+
+    # The body isn't read at all, so clients that send "Expect: 100-continue" skip sending the chunk
+    if chunk.received:
+        return
+
+    async with receive_body(stream, directory=UPLOAD_DIR, max_size=chunk.size) as body:
+        if body.size != chunk.size or body.hash != chunk.hash:
+            raise UploadRejected("Chunk does not match its size or hash", status_code=400)
+
+        key = get_chunk_artifact_key(chunk.hash)
+
+        if not await ARTIFACTS.exists(key):
+            await ARTIFACTS.put_file(key, body.path)
+
+    await mark_upload_chunks_received(upload_id, chunk.hash)
+
+
+async def finish_upload(*, user: User, template_name: str, upload_id: str) -> File:
+    session = await get_upload(user=user, template_name=template_name, upload_id=upload_id)
+
+    key = get_file_artifact_key(session.hash)
+
+    # The file is assembled (and its hash checked) even if another user already stored it, so the file is only
+    # reused once the client has shown that it has all of it
+    if not await check_file_already_uploaded(user, session):
+        if session.missing_chunks:
+            raise UploadRejected("Not all chunks have been uploaded", status_code=409)
+
+        with tracer.start_as_current_span("assemble file"):
+            async with receive_body(read_chunks(session), directory=UPLOAD_DIR, max_size=session.size) as body:
+                if body.hash != session.hash:
+                    await remove_upload(session.id)
+
+                    raise UploadRejected("File does not match its hash", status_code=400)
+
+                if not await ARTIFACTS.exists(key):
+                    await ARTIFACTS.put_file(key, body.path)
+
+    file = File(
+        filename=session.filename,
+        hash=session.hash,
+        size=session.size,
+        content_type=session.content_type,
+    )
+
+    await save_file_metadata(user_id=user.id, template_name=template_name, file=file)
+
+    await remove_upload(session.id)
+
+    return file
+
+
+async def read_chunks(session: UploadSession) -> AsyncIterator[bytes]:
+    for chunk in session.chunks:
+        try:
+            async for data in ARTIFACTS.stream(get_chunk_artifact_key(chunk.hash)):
+                yield data
+
+        except FileNotFoundError:
+            # Another upload that used the same chunk finished and deleted it in the meantime
+            await mark_upload_chunks_received(session.id, chunk.hash, received=False)
+
+            raise UploadRejected("Not all chunks have been uploaded", status_code=409) from None
+
+
+async def cancel_upload(*, user: User, template_name: str, upload_id: str) -> None:
+    await get_upload(user=user, template_name=template_name, upload_id=upload_id)
+
+    await remove_upload(upload_id)
+
+
+async def remove_upload(upload_id: str) -> None:
+    unused_chunk_hashes = await delete_upload_session(upload_id)
+
+    await ARTIFACTS.delete_many([get_chunk_artifact_key(chunk_hash) for chunk_hash in unused_chunk_hashes])
@@ -3,13 +3,29 @@ from pathlib import Path
 
 ARTIFACT_DIR = Path(os.getenv("REPORTOBELLO_ARTIFACT_DIR", "/tmp")).resolve()  # noqa: S108
 
-
-def get_file_artifact_path_from_hash(hash: str) -> Path:  # noqa: A002
-    return FILE_ARTIFACT_DIR / hash[:2] / hash[2:4] / hash[4:6] / hash[6:]
-
-
+# PDFs are compiled here before being saved to the artifact store. When artifacts are stored locally this is the same
+# directory the PDFs are stored in, so saving them is just a rename.
 PDF_ARTIFACT_DIR = ARTIFACT_DIR / "pdfs"
-FILE_ARTIFACT_DIR = ARTIFACT_DIR / "files"
+# Kept next to locally stored uploaded files so that they can be hard linked
+BUILD_ROOT_DIR = ARTIFACT_DIR / "build_roots"
+# Uploaded files are received here before being saved to the artifact store (a rename when stored locally)
+UPLOAD_DIR = ARTIFACT_DIR / "uploads"
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("REPORTOBELLO_UPLOAD_MAX_FILE_SIZE", "10")) * 1_000_000
+# Larger files can be uploaded in chunks, where each chunk is limited to UPLOAD_MAX_FILE_SIZE
+UPLOAD_MAX_RESUMABLE_FILE_SIZE = int(os.getenv("REPORTOBELLO_UPLOAD_MAX_RESUMABLE_FILE_SIZE", "1000")) * 1_000_000
+UPLOAD_SESSION_TTL_IN_SECONDS = float(os.getenv("REPORTOBELLO_UPLOAD_SESSION_TTL", "86400"))
+
+FILE_GC_INTERVAL_IN_SECONDS = float(os.getenv("REPORTOBELLO_FILE_GC_INTERVAL", "3600"))
+FILE_GC_GRACE_PERIOD_IN_SECONDS = float(os.getenv("REPORTOBELLO_FILE_GC_GRACE_PERIOD", "86400"))
+FILE_GC_DRY_RUN = os.getenv("REPORTOBELLO_FILE_GC_DRY_RUN") == "1"
+
+# Artifacts are stored in this S3 compatible bucket if set, otherwise in ARTIFACT_DIR
+S3_BUCKET = os.getenv("REPORTOBELLO_S3_BUCKET", "")
+S3_ENDPOINT = os.getenv("REPORTOBELLO_S3_ENDPOINT", "https://s3.amazonaws.com")
+S3_ACCESS_KEY_ID = os.getenv("REPORTOBELLO_S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.getenv("REPORTOBELLO_S3_SECRET_ACCESS_KEY", "")
+S3_REGION = os.getenv("REPORTOBELLO_S3_REGION", "us-east-1")
+S3_PRESIGNED_DOWNLOADS = os.getenv("REPORTOBELLO_S3_PRESIGNED_DOWNLOADS") == "1"
 
 DOMAIN = os.getenv("REPORTOBELLO_DOMAIN", "")
 assert DOMAIN
@@ -17,3 +33,27 @@ assert DOMAIN
 IS_LIVE_SITE = os.getenv("REPORTOBELLO_IS_LIVE_SITE") == "1"
 
 ADMIN_API_KEY = os.getenv("REPORTOBELLO_ADMIN_API_KEY")
+
+USER_CACHE_MAX_SIZE = int(os.getenv("REPORTOBELLO_USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_IN_SECONDS = float(os.getenv("REPORTOBELLO_USER_CACHE_TTL", "60"))
+
+TYPST_WORKER_COUNT = int(os.getenv("REPORTOBELLO_TYPST_WORKERS", "0")) or len(os.sched_getaffinity(0))
+TYPST_WORKER_MAX_BUILDS = int(os.getenv("REPORTOBELLO_TYPST_WORKER_MAX_BUILDS", "500"))
+BUILD_TIMEOUT_IN_SECONDS = float(os.getenv("REPORTOBELLO_BUILD_TIMEOUT", "60"))
+BUILD_ROOT_CACHE_MAX_SIZE = int(os.getenv("REPORTOBELLO_BUILD_ROOT_CACHE_MAX_SIZE", "1000")) * 1_000_000
+TEMPLATE_CACHE_MAX_SIZE = int(os.getenv("REPORTOBELLO_TEMPLATE_CACHE_MAX_SIZE", "1000"))
+
+BUILD_QUEUE_MAX_LENGTH = int(os.getenv("REPORTOBELLO_BUILD_QUEUE_MAX_LENGTH", "100"))
+BUILD_QUEUE_MAX_PER_USER = int(os.getenv("REPORTOBELLO_BUILD_QUEUE_MAX_PER_USER", "20"))
+BUILD_QUEUE_MAX_WAIT_IN_SECONDS = float(os.getenv("REPORTOBELLO_BUILD_QUEUE_MAX_WAIT", "30"))
+
+BATCH_MAX_SIZE = int(os.getenv("REPORTOBELLO_BATCH_MAX_SIZE", "10000"))
+
+REMOTE_BUILDS = os.getenv("REPORTOBELLO_REMOTE_BUILDS") == "1"
+BUILD_JOB_LEASE_IN_SECONDS = float(os.getenv("REPORTOBELLO_BUILD_JOB_LEASE", "30"))
+BUILD_JOB_POLL_INTERVAL_IN_SECONDS = float(os.getenv("REPORTOBELLO_BUILD_JOB_POLL_INTERVAL", "1"))
+
+# Webhooks can only be sent to public addresses, unless the host is in this list
+WEBHOOK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("REPORTOBELLO_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
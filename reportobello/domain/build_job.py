@@ -0,0 +1,27 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Literal
+
+from reportobello.domain.report import Report
+from reportobello.domain.user import UserId
+
+BuildJobState = Literal["queued", "running", "done"]
+
+
+@dataclass(kw_only=True)
+class BuildJob:
+    id: str
+    owner_id: UserId
+    state: BuildJobState
+    template_name: str
+    requested_version: int
+    actual_version: int
+    queued_at: datetime
+    data: str
+    data_type: str = "json"
+    hash: str = ""
+    cache_key: str = ""
+    webhook_url: str | None = None
+
+    # Only set once the job is done
+    report: Report | None = None
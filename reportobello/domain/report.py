@@ -15,6 +15,10 @@ class Report:
     data: str = ""
     data_type: str = "json"
     hash: str = ""
+    cache_key: str = ""
+
+    # Only set once the report has been saved
+    id: int | None = None
 
     @property
     def was_successful(self) -> bool:
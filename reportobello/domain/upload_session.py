@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from reportobello.domain.user import UserId
+
+
+@dataclass(kw_only=True)
+class UploadChunk:
+    offset: int
+    size: int
+    hash: str
+    received: bool = False
+
+
+@dataclass(kw_only=True)
+class UploadSession:
+    id: str
+    owner_id: UserId
+    template_name: str
+    filename: str
+    content_type: str | None
+    size: int
+    hash: str
+    chunk_size: int
+    created_at: datetime
+    expires_at: datetime
+    chunks: list[UploadChunk]
+
+    def get_chunk(self, offset: int) -> UploadChunk | None:
+        if offset % self.chunk_size or not 0 <= offset < self.size:
+            return None
+
+        return self.chunks[offset // self.chunk_size]
+
+    @property
+    def missing_chunks(self) -> list[UploadChunk]:
+        return [chunk for chunk in self.chunks if not chunk.received]
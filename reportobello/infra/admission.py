@@ -0,0 +1,177 @@
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, Iterable
+from contextlib import asynccontextmanager
+from typing import NoReturn
+
+from opentelemetry import metrics, trace
+from opentelemetry.metrics import CallbackOptions, Observation
+
+tracer = trace.get_tracer("reportobello")
+meter = metrics.get_meter("reportobello")
+
+REJECTED_COUNT = meter.create_counter(
+    "reportobello.build_queue.rejected",
+    description="Number of builds rejected because the build queue was full",
+)
+WAIT_TIME = meter.create_histogram(
+    "reportobello.build_queue.wait_time",
+    unit="s",
+    description="Time builds spent waiting in the build queue before being started",
+)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, msg: str, *, status_code: int, retry_after: int) -> None:
+        super().__init__(msg)
+
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Bounded queue that sits in front of the compiler. Builds that cannot be started right away
+    wait in a per-user queue, and free slots are handed out round-robin between users, meaning one
+    user submitting lots of builds cannot starve everyone else.
+
+    Builds are rejected instead of queued if the queue is full, the user already has too many queued builds,
+    or if the build waited in the queue for too long.
+    """
+
+    def __init__(self, capacity: int, *, max_queue_length: int, max_queue_per_user: int, max_wait: float) -> None:
+        self.capacity = capacity
+        self.max_queue_length = max_queue_length
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+
+        self.running = 0
+        self.waiting = 0
+
+        self._queues: dict[str, deque[asyncio.Future[None]]] = {}
+        self._turns = deque[str]()
+
+        # Rolling average of how long a build takes, used to estimate the Retry-After header
+        self._average_build_time = 1.0
+
+        meter.create_observable_gauge(
+            "reportobello.build_queue.depth",
+            callbacks=[self._observe_depth],
+            description="Number of builds waiting in the build queue",
+        )
+        meter.create_observable_gauge(
+            "reportobello.build_queue.running",
+            callbacks=[self._observe_running],
+            description="Number of builds that have been admitted and are currently running",
+        )
+
+    @asynccontextmanager
+    async def admit(self, key: str) -> AsyncGenerator[None]:
+        """
+        Wait for a build slot for **key** (typically a user id), raising AdmissionRejected if one cannot be acquired.
+        """
+
+        queued_at = time.perf_counter()
+
+        with tracer.start_as_current_span("wait for build slot") as span:
+            span.set_attribute(key="build_queue.waiting", value=self.waiting)
+
+            await self._acquire(key)
+
+        started_at = time.perf_counter()
+        WAIT_TIME.record(started_at - queued_at)
+
+        try:
+            yield
+
+        finally:
+            self._release()
+
+            self._average_build_time = 0.9 * self._average_build_time + 0.1 * (time.perf_counter() - started_at)
+
+    async def _acquire(self, key: str) -> None:
+        if self.running < self.capacity and self.waiting == 0:
+            self.running += 1
+            return
+
+        if self.waiting >= self.max_queue_length:
+            self._reject("queue_full", "Build queue is full, try again later", status_code=503)
+
+        if len(self._queues.get(key, ())) >= self.max_queue_per_user:
+            self._reject("user_queue_full", "Too many builds are already queued", status_code=429)
+
+        queue = self._queues.setdefault(key, deque())
+
+        if not queue:
+            self._turns.append(key)
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        self.waiting += 1
+
+        try:
+            async with asyncio.timeout(self.max_wait):
+                await waiter
+
+        except (TimeoutError, asyncio.CancelledError) as ex:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed to us right as we stopped waiting, so pass it on to someone else
+                self._release()
+
+            else:
+                self._remove_waiter(key, waiter)
+
+            if isinstance(ex, TimeoutError):
+                self._reject("timeout", "Build waited in queue for too long, try again later", status_code=503)
+
+            raise
+
+    def _release(self) -> None:
+        while self._turns:
+            key = self._turns.popleft()
+            queue = self._queues[key]
+
+            waiter = queue.popleft()
+            self.waiting -= 1
+
+            if queue:
+                # Move to the back of the line so other users get a turn
+                self._turns.append(key)
+
+            else:
+                del self._queues[key]
+
+            if not waiter.done():
+                # The slot is transfered directly to the waiter, so the running count stays the same
+                waiter.set_result(None)
+                return
+
+        self.running -= 1
+
+    def _remove_waiter(self, key: str, waiter: asyncio.Future[None]) -> None:
+        queue = self._queues.get(key)
+
+        if not queue or waiter not in queue:
+            return
+
+        queue.remove(waiter)
+        self.waiting -= 1
+
+        if not queue:
+            del self._queues[key]
+            self._turns.remove(key)
+
+    def _reject(self, reason: str, msg: str, *, status_code: int) -> NoReturn:
+        REJECTED_COUNT.add(1, {"reason": reason})
+
+        retry_after = math.ceil(self._average_build_time * max(self.waiting, 1) / self.capacity)
+
+        raise AdmissionRejected(msg, status_code=status_code, retry_after=max(retry_after, 1))
+
+    def _observe_depth(self, _: CallbackOptions) -> Iterable[Observation]:
+        return [Observation(self.waiting)]
+
+    def _observe_running(self, _: CallbackOptions) -> Iterable[Observation]:
+        return [Observation(self.running)]
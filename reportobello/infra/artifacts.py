@@ -0,0 +1,661 @@
+import asyncio
+import hmac
+import os
+import shutil
+import xml.etree.ElementTree as ET  # noqa: S405
+from base64 import b64encode
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from hashlib import md5, sha256
+from pathlib import Path
+from secrets import token_urlsafe
+from typing import Protocol
+from urllib.parse import quote
+
+import httpx
+from opentelemetry import trace
+
+from reportobello.config import (
+    ARTIFACT_DIR,
+    S3_ACCESS_KEY_ID,
+    S3_BUCKET,
+    S3_ENDPOINT,
+    S3_REGION,
+    S3_SECRET_ACCESS_KEY,
+)
+
+tracer = trace.get_tracer("reportobello")
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_pdf_artifact_key(filename: str) -> str:
+    return f"pdfs/{filename}"
+
+
+def get_file_artifact_key(hash: str) -> str:  # noqa: A002
+    return f"files/{hash[:2]}/{hash[2:4]}/{hash[4:6]}/{hash[6:]}"
+
+
+def get_chunk_artifact_key(hash: str) -> str:  # noqa: A002
+    # Chunks of files that are still being uploaded (see resumable_uploads.py)
+    return f"chunks/{hash[:2]}/{hash[2:4]}/{hash[4:6]}/{hash[6:]}"
+
+
+@dataclass(kw_only=True)
+class ArtifactInfo:
+    key: str
+    size: int
+    modified_at: datetime
+
+
+class ArtifactStore(Protocol):
+    """
+    Storage for build artifacts (PDFs and uploaded files), addressed by a "/" separated key.
+    Artifacts are immutable once written, and reading an artifact that doesn't exist raises FileNotFoundError.
+    """
+
+    async def put(self, key: str, data: bytes) -> None: ...
+
+    async def put_file(self, key: str, file: Path) -> None:
+        # Store the contents of file, which is moved (or deleted) once stored
+        ...
+
+    async def get(self, key: str) -> bytes | None: ...
+
+    def stream(self, key: str, *, start: int = 0, end: int | None = None) -> AsyncIterator[bytes]:
+        # Stream the bytes from start up to (but not including) end, or the whole artifact by default
+        ...
+
+    async def copy_to(self, key: str, file: Path) -> None: ...
+
+    async def exists(self, key: str) -> bool: ...
+
+    async def info(self, key: str) -> ArtifactInfo | None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+    async def delete_many(self, keys: list[str]) -> None: ...
+
+    def list(self, prefix: str) -> AsyncIterator[ArtifactInfo]:
+        # Every artifact under prefix (for example "files/"), sorted by key
+        ...
+
+    def local_path(self, key: str) -> Path | None:
+        # Path to the artifact on this machine, if it is stored locally
+        ...
+
+    def presigned_url(self, key: str, *, expires_in: int, headers: dict[str, str] | None = None) -> str | None:
+        # URL that can be used to download the artifact directly, without going through Reportobello.
+        # headers are response headers to override, such as Content-Disposition
+        ...
+
+
+class LocalArtifactStore:
+    """
+    Stores artifacts as files in **directory**. Only usable if there is a single Reportobello instance, or if
+    **directory** is on a filesystem that is shared between instances.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put, key, data)
+
+    def _put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        # Write to a temporary file first so that partially written artifacts are never read
+        tmp = path.with_name(f".{path.name}.{token_urlsafe(8)}.tmp")
+
+        try:
+            tmp.write_bytes(data)
+            tmp.chmod(0o400)
+            tmp.rename(path)
+
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    async def put_file(self, key: str, file: Path) -> None:
+        await asyncio.to_thread(self._put_file, key, file)
+
+    def _put_file(self, key: str, file: Path) -> None:
+        path = self._path(key)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        # Stored files are shared by hard links (ie, build roots), so they must never be written to. The mode is set
+        # before moving the file so that it is never writable once stored (it is kept if the file is copied instead).
+        file.chmod(0o400)
+
+        # This is a rename when the file is on the same filesystem, so nothing is copied
+        shutil.move(file, path)
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await asyncio.to_thread(self._path(key).read_bytes)
+
+        except FileNotFoundError:
+            return None
+
+    async def stream(self, key: str, *, start: int = 0, end: int | None = None) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(self._path(key).open, "rb")
+
+        try:
+            f.seek(start)
+
+            while end is None or start < end:
+                chunk = await asyncio.to_thread(f.read, CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - start))
+
+                if not chunk:
+                    break
+
+                start += len(chunk)
+
+                yield chunk
+
+        finally:
+            f.close()
+
+    async def copy_to(self, key: str, file: Path) -> None:
+        await asyncio.to_thread(link_or_copy, self._path(key), file)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._path(key).exists)
+
+    async def info(self, key: str) -> ArtifactInfo | None:
+        try:
+            stat = await asyncio.to_thread(self._path(key).stat)
+
+        except FileNotFoundError:
+            return None
+
+        return ArtifactInfo(key=key, size=stat.st_size, modified_at=datetime.fromtimestamp(stat.st_mtime, tz=UTC))
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+
+    async def delete_many(self, keys: list[str]) -> None:
+        def delete_all() -> None:
+            for key in keys:
+                self._path(key).unlink(missing_ok=True)
+
+        await asyncio.to_thread(delete_all)
+
+    async def list(self, prefix: str) -> AsyncIterator[ArtifactInfo]:
+        # Directories are listed one at a time, so the whole tree never needs to be loaded into memory
+        entries = [(self._path(prefix.rstrip("/")), True)]
+
+        while entries:
+            path, is_dir = entries.pop()
+
+            if is_dir:
+                # Pushed in reverse so that they are popped in sorted order
+                entries.extend(reversed(await asyncio.to_thread(list_directory, path)))
+                continue
+
+            stat = await asyncio.to_thread(path.stat)
+
+            yield ArtifactInfo(
+                key=path.relative_to(self.directory).as_posix(),
+                size=stat.st_size,
+                modified_at=datetime.fromtimestamp(stat.st_mtime, tz=UTC),
+            )
+
+    def local_path(self, key: str) -> Path | None:
+        return self._path(key)
+
+    def presigned_url(self, key: str, *, expires_in: int, headers: dict[str, str] | None = None) -> str | None:  # noqa: ARG002, PLR6301
+        return None
+
+    def _path(self, key: str) -> Path:
+        path = (self.directory / key).absolute()
+        assert path.is_relative_to(self.directory)
+
+        return path
+
+
+def list_directory(directory: Path) -> list[tuple[Path, bool]]:
+    try:
+        return sorted((Path(entry.path), entry.is_dir()) for entry in os.scandir(directory))
+
+    except FileNotFoundError:
+        return []
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        # Hard links are free to create and are read directly by Typst, unlike symlinks
+        os.link(src, dst)
+
+    except OSError:
+        # Artifacts are stored on a different filesystem
+        shutil.copyfile(src, dst)
+
+
+@dataclass(kw_only=True)
+class S3Credentials:
+    access_key_id: str
+    secret_access_key: str
+    region: str
+
+
+# S3 requires every part except the last to be at least 5MB
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Max number of keys that can be deleted in a single request
+S3_MAX_DELETE_KEYS = 1000
+
+
+class S3Error(Exception):
+    pass
+
+
+class S3ArtifactStore:
+    """
+    Stores artifacts in an S3 compatible bucket (AWS, MinIO, R2, etc), allowing artifacts to be shared between
+    Reportobello instances. Path style URLs are used (**endpoint**/**bucket**/key), since not all S3 compatible
+    services support virtual host style URLs.
+
+    Files larger than **part_size** are uploaded using multipart uploads so that they never need to be loaded into
+    memory all at once.
+    """
+
+    def __init__(
+        self,
+        *,
+        endpoint: str,
+        bucket: str,
+        credentials: S3Credentials,
+        part_size: int = 16 * 1024 * 1024,
+        client: httpx.AsyncClient | None = None,
+    ) -> None:
+        assert part_size >= S3_MIN_PART_SIZE
+
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.credentials = credentials
+        self.part_size = part_size
+        self.client = client or httpx.AsyncClient(timeout=60)
+
+    async def put(self, key: str, data: bytes) -> None:
+        with tracer.start_as_current_span("s3 put"):
+            response = await self._request("PUT", key, content=data)
+            response.raise_for_status()
+
+    async def put_file(self, key: str, file: Path) -> None:
+        try:
+            size = (await asyncio.to_thread(file.stat)).st_size
+
+            if size <= self.part_size:
+                await self.put(key, await asyncio.to_thread(file.read_bytes))
+
+            else:
+                await self._put_multipart(key, file)
+
+        finally:
+            await asyncio.to_thread(file.unlink, missing_ok=True)
+
+    async def _put_multipart(self, key: str, file: Path) -> None:
+        with tracer.start_as_current_span("s3 multipart upload"):
+            response = await self._request("POST", key, params={"uploads": ""})
+            response.raise_for_status()
+
+            upload_id = parse_s3_xml(response.content).findtext("{*}UploadId")
+            assert upload_id
+
+            try:
+                etags = await self._upload_parts(key, file, upload_id)
+
+                await self._complete_multipart(key, upload_id, etags)
+
+            except BaseException:
+                await self._request("DELETE", key, params={"uploadId": upload_id})
+                raise
+
+    async def _upload_parts(self, key: str, file: Path, upload_id: str) -> list[str]:
+        etags: list[str] = []
+
+        f = await asyncio.to_thread(file.open, "rb")
+
+        try:
+            while part := await asyncio.to_thread(f.read, self.part_size):
+                params = {"partNumber": str(len(etags) + 1), "uploadId": upload_id}
+
+                response = await self._request("PUT", key, params=params, content=part)
+                response.raise_for_status()
+
+                etags.append(response.headers["etag"])
+
+        finally:
+            f.close()
+
+        return etags
+
+    async def _complete_multipart(self, key: str, upload_id: str, etags: list[str]) -> None:
+        parts = "".join(
+            f"<Part><PartNumber>{i}</PartNumber><ETag>{etag}</ETag></Part>" for i, etag in enumerate(etags, start=1)
+        )
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode()
+
+        response = await self._request("POST", key, params={"uploadId": upload_id}, content=body)
+        response.raise_for_status()
+
+        # Completing an upload can fail after a 200 status has already been sent
+        if parse_s3_xml(response.content).tag.endswith("Error"):
+            raise S3Error(response.text)
+
+    async def get(self, key: str) -> bytes | None:
+        with tracer.start_as_current_span("s3 get"):
+            response = await self._request("GET", key)
+
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return None
+
+        response.raise_for_status()
+
+        return response.content
+
+    async def stream(self, key: str, *, start: int = 0, end: int | None = None) -> AsyncIterator[bytes]:
+        headers = {}
+
+        if start or end is not None:
+            headers["range"] = f"bytes={start}-{'' if end is None else end - 1}"
+
+        response = await self.client.send(self._build_request("GET", key, headers=headers), stream=True)
+
+        try:
+            if response.status_code == httpx.codes.NOT_FOUND:
+                raise FileNotFoundError(key)
+
+            response.raise_for_status()
+
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+
+        finally:
+            await response.aclose()
+
+    async def copy_to(self, key: str, file: Path) -> None:
+        f = await asyncio.to_thread(file.open, "xb")
+
+        try:
+            async for chunk in self.stream(key):
+                await asyncio.to_thread(f.write, chunk)
+
+        finally:
+            f.close()
+
+    async def exists(self, key: str) -> bool:
+        response = await self._request("HEAD", key)
+
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return False
+
+        response.raise_for_status()
+
+        return True
+
+    async def info(self, key: str) -> ArtifactInfo | None:
+        response = await self._request("HEAD", key)
+
+        if response.status_code == httpx.codes.NOT_FOUND:
+            return None
+
+        response.raise_for_status()
+
+        return ArtifactInfo(
+            key=key,
+            size=int(response.headers["content-length"]),
+            modified_at=parsedate_to_datetime(response.headers["last-modified"]),
+        )
+
+    async def delete(self, key: str) -> None:
+        response = await self._request("DELETE", key)
+
+        if response.status_code != httpx.codes.NOT_FOUND:
+            response.raise_for_status()
+
+    async def delete_many(self, keys: list[str]) -> None:
+        for i in range(0, len(keys), S3_MAX_DELETE_KEYS):
+            objects = "".join(
+                f"<Object><Key>{escape_xml(key)}</Key></Object>" for key in keys[i : i + S3_MAX_DELETE_KEYS]
+            )
+            body = f"<Delete><Quiet>true</Quiet>{objects}</Delete>".encode()
+
+            # Content-MD5 is required for this request, even though the payload is already signed
+            headers = {"content-md5": b64encode(md5(body, usedforsecurity=False).digest()).decode()}
+
+            with tracer.start_as_current_span("s3 delete objects"):
+                response = await self._request("POST", "", params={"delete": ""}, content=body, headers=headers)
+                response.raise_for_status()
+
+    async def list(self, prefix: str) -> AsyncIterator[ArtifactInfo]:
+        params = {"list-type": "2", "prefix": prefix}
+
+        while True:
+            with tracer.start_as_current_span("s3 list objects"):
+                response = await self._request("GET", "", params=params)
+                response.raise_for_status()
+
+            result = parse_s3_xml(response.content)
+
+            for item in result.iterfind("{*}Contents"):
+                yield ArtifactInfo(
+                    key=item.findtext("{*}Key", ""),
+                    size=int(item.findtext("{*}Size", "0")),
+                    modified_at=datetime.fromisoformat(item.findtext("{*}LastModified", "")),
+                )
+
+            if result.findtext("{*}IsTruncated") != "true":
+                return
+
+            params["continuation-token"] = result.findtext("{*}NextContinuationToken", "")
+
+    def local_path(self, key: str) -> Path | None:  # noqa: ARG002, PLR6301
+        return None
+
+    def presigned_url(self, key: str, *, expires_in: int, headers: dict[str, str] | None = None) -> str | None:
+        params = {f"response-{name.lower()}": value for name, value in (headers or {}).items()}
+
+        url = get_s3_url(self._url(key), params)
+
+        return presign_s3_url(url, self.credentials, expires_in=expires_in, now=datetime.now(tz=UTC))
+
+    async def _request(
+        self,
+        method: str,
+        key: str,
+        *,
+        params: dict[str, str] | None = None,
+        content: bytes = b"",
+        headers: dict[str, str] | None = None,
+    ) -> httpx.Response:
+        return await self.client.send(self._build_request(method, key, params=params, content=content, headers=headers))
+
+    def _build_request(
+        self,
+        method: str,
+        key: str,
+        *,
+        params: dict[str, str] | None = None,
+        content: bytes = b"",
+        headers: dict[str, str] | None = None,
+    ) -> httpx.Request:
+        url = get_s3_url(self._url(key), params)
+
+        headers = sign_s3_request(
+            method,
+            url,
+            headers or {},
+            payload_hash=sha256(content).hexdigest(),
+            credentials=self.credentials,
+            now=datetime.now(tz=UTC),
+        )
+
+        return self.client.build_request(method, url, content=content, headers=headers)
+
+    def _url(self, key: str) -> str:
+        return f"{self.endpoint}/{quote(self.bucket)}/{quote(key)}"
+
+
+def parse_s3_xml(data: bytes) -> ET.Element:
+    # Only responses from the configured S3 server are parsed, which is trusted
+    return ET.fromstring(data)  # noqa: S314
+
+
+def escape_xml(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def sign_s3_request(  # noqa: PLR0913
+    method: str,
+    url: httpx.URL,
+    headers: dict[str, str],
+    *,
+    payload_hash: str,
+    credentials: S3Credentials,
+    now: datetime,
+) -> dict[str, str]:
+    """
+    Return **headers** along with the headers needed to authenticate a request to S3 using AWS Signature Version 4.
+    All of the headers in **headers** are signed.
+    """
+
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+
+    headers = {
+        **{name.lower(): value for name, value in headers.items()},
+        "host": url.netloc.decode(),
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+    }
+
+    scope, signed_headers, signature = get_s3_signature(
+        method,
+        url,
+        headers,
+        payload_hash=payload_hash,
+        credentials=credentials,
+        now=now,
+    )
+
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials.access_key_id}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+
+    return headers
+
+
+def presign_s3_url(url: httpx.URL, credentials: S3Credentials, *, expires_in: int, now: datetime) -> str:
+    """
+    Return **url** with the query parameters needed to download it without any additional authentication
+    using AWS Signature Version 4. The URL is valid for **expires_in** seconds.
+    """
+
+    scope = get_s3_scope(credentials, now)
+
+    url = get_s3_url(
+        str(url.copy_with(query=None)),
+        {
+            **dict(url.params),
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{credentials.access_key_id}/{scope}",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(expires_in),
+            "X-Amz-SignedHeaders": "host",
+        },
+    )
+
+    _, _, signature = get_s3_signature(
+        "GET",
+        url,
+        {"host": url.netloc.decode()},
+        payload_hash="UNSIGNED-PAYLOAD",
+        credentials=credentials,
+        now=now,
+    )
+
+    return f"{url}&X-Amz-Signature={signature}"
+
+
+def get_s3_url(url: str, params: dict[str, str] | None) -> httpx.URL:
+    # httpx encodes spaces in query parameters as "+", which S3 doesn't treat as a space when checking signatures,
+    # so the query string is encoded the same way it is when signing
+    return httpx.URL(f"{url}?{encode_s3_query(params.items())}" if params else url)
+
+
+def encode_s3_query(params: Iterable[tuple[str, str]]) -> str:
+    def encode(s: str) -> str:
+        return quote(s, safe="-_.~")
+
+    return "&".join(f"{name}={value}" for name, value in sorted((encode(k), encode(v)) for k, v in params))
+
+
+def get_s3_scope(credentials: S3Credentials, now: datetime) -> str:
+    return f"{now:%Y%m%d}/{credentials.region}/s3/aws4_request"
+
+
+def get_s3_signature(  # noqa: PLR0913
+    method: str,
+    url: httpx.URL,
+    headers: dict[str, str],
+    *,
+    payload_hash: str,
+    credentials: S3Credentials,
+    now: datetime,
+) -> tuple[str, str, str]:
+    # Return the credential scope, signed header names, and signature for a request.
+    # See https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-header-based-auth.html
+
+    canonical_headers = sorted((name.lower(), " ".join(value.split())) for name, value in headers.items())
+    signed_headers = ";".join(name for name, _ in canonical_headers)
+
+    canonical_request = "\n".join([
+        method,
+        quote(url.path, safe="/-_.~"),
+        encode_s3_query(url.params.multi_items()),
+        "".join(f"{name}:{value}\n" for name, value in canonical_headers),
+        signed_headers,
+        payload_hash,
+    ])
+
+    scope = get_s3_scope(credentials, now)
+
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256",
+        now.strftime("%Y%m%dT%H%M%SZ"),
+        scope,
+        sha256(canonical_request.encode()).hexdigest(),
+    ])
+
+    key = f"AWS4{credentials.secret_access_key}".encode()
+
+    for part in (f"{now:%Y%m%d}", credentials.region, "s3", "aws4_request"):
+        key = hmac.digest(key, part.encode(), "sha256")
+
+    signature = hmac.digest(key, string_to_sign.encode(), "sha256").hex()
+
+    return scope, signed_headers, signature
+
+
+def get_artifact_store() -> ArtifactStore:
+    if S3_BUCKET:
+        return S3ArtifactStore(
+            endpoint=S3_ENDPOINT,
+            bucket=S3_BUCKET,
+            credentials=S3Credentials(
+                access_key_id=S3_ACCESS_KEY_ID,
+                secret_access_key=S3_SECRET_ACCESS_KEY,
+                region=S3_REGION,
+            ),
+        )
+
+    return LocalArtifactStore(ARTIFACT_DIR)
+
+
+ARTIFACTS = get_artifact_store()
@@ -0,0 +1,238 @@
+import asyncio
+import fcntl
+import os
+import shutil
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+from secrets import token_urlsafe
+from typing import TextIO
+
+from opentelemetry import metrics, trace
+
+from reportobello.infra.artifacts import ArtifactStore
+from reportobello.infra.single_flight import SingleFlight
+
+tracer = trace.get_tracer("reportobello")
+meter = metrics.get_meter("reportobello")
+
+HIT_COUNT = meter.create_counter(
+    "reportobello.build_roots.hits",
+    description="Number of builds that re-used an already prepared build root",
+)
+MISS_COUNT = meter.create_counter(
+    "reportobello.build_roots.misses",
+    description="Number of builds that needed a new build root to be prepared",
+)
+
+
+class BuildRootCache:
+    """
+    Cache of prepared build directories, one per unique template/file set. A build root contains the template
+    source (along with any other generated sources) and a copy of every uploaded file from **store** (a hard link
+    if possible), so builds that share a template and files don't need to re-create the whole directory.
+
+    Build roots are evicted least recently used first once the total size of the roots exceeds **max_size** bytes.
+    Roots that are being used by a build are never evicted.
+
+    Several processes (ie, API instances and build workers) can share the same **directory**, since each process
+    keeps its roots in its own subdirectory. Subdirectories left behind by processes that have exited are removed.
+    """
+
+    def __init__(self, directory: Path, *, store: ArtifactStore, max_size: int) -> None:
+        self.directory = directory / token_urlsafe(16)
+        self.store = store
+        self.max_size = max_size
+
+        self._roots: OrderedDict[str, int] = OrderedDict()
+        self._in_use: dict[str, int] = {}
+        self._size = 0
+        self._preparing = SingleFlight[Path]("build roots")
+
+        # Locked for as long as this process is running, to tell other processes that the roots are still in use
+        self._lock_file: TextIO | None = None
+        self._starting = asyncio.Lock()
+
+    @asynccontextmanager
+    async def use_root(self, key: str, *, sources: dict[str, str], files: dict[str, str]) -> AsyncGenerator[Path]:
+        # Get the build root for key, creating it if needed. sources maps filenames to the text to write, and files
+        # maps filenames to the artifact keys of the files to copy. The build root must not be modified, since it is
+        # shared between builds.
+
+        # Marked as in use before the root is prepared, otherwise it could be evicted before it is used
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+
+        try:
+            yield await self._get_root(key, sources=sources, files=files)
+
+        finally:
+            self._in_use[key] -= 1
+
+            if not self._in_use[key]:
+                del self._in_use[key]
+
+            await self._evict()
+
+    async def _get_root(self, key: str, *, sources: dict[str, str], files: dict[str, str]) -> Path:
+        root = self.directory / key
+
+        if key in self._roots:
+            if await asyncio.to_thread(root.is_dir):
+                self._roots.move_to_end(key)
+                HIT_COUNT.add(1)
+
+                return root
+
+            # Deleted by something else, such as a tmp cleaner
+            self._size -= self._roots.pop(key)
+
+        MISS_COUNT.add(1)
+
+        return await self._preparing.run(key, lambda: self._prepare(key, sources=sources, files=files))
+
+    async def _prepare(self, key: str, *, sources: dict[str, str], files: dict[str, str]) -> Path:
+        with tracer.start_as_current_span("prepare build root"):
+            async with self._starting:
+                if self._lock_file is None:
+                    self._lock_file = await asyncio.to_thread(self._start)
+
+            root = self.directory / key
+
+            size = await create_build_root(root, store=self.store, sources=sources, files=files)
+
+        self._roots[key] = size
+        self._size += size
+
+        return root
+
+    def _start(self) -> TextIO:
+        # Lock this process's subdirectory, then remove every subdirectory whose process has exited (or that was left
+        # behind by older versions). Those roots aren't tracked by anyone, so they would otherwise never be removed.
+        self.directory.parent.mkdir(parents=True, exist_ok=True)
+
+        lock_file = lock_directory(self.directory)
+
+        for path in self.directory.parent.iterdir():
+            directory = path.with_name(path.name.removesuffix(".lock"))
+
+            if directory != self.directory:
+                remove_unlocked_directory(directory)
+
+        return lock_file
+
+    def close(self) -> None:
+        if self._lock_file:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            get_lock_path(self.directory).unlink(missing_ok=True)
+
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _evict(self) -> None:
+        for key in list(self._roots):
+            if self._size <= self.max_size:
+                return
+
+            if key in self._in_use:
+                continue
+
+            self._size -= self._roots.pop(key)
+
+            await remove_directory(self.directory / key)
+
+
+def get_lock_path(directory: Path) -> Path:
+    return directory.with_name(f"{directory.name}.lock")
+
+
+def lock_directory(directory: Path) -> TextIO:
+    # Lock files are deleted by remove_unlocked_directory() once they're unlocked, which can happen right before the
+    # lock is taken. If so, the lock is on a file that no longer exists, so try again with a new file.
+    path = get_lock_path(directory)
+
+    while True:
+        lock_file = path.open("a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        with suppress(FileNotFoundError):
+            if path.stat().st_ino == os.fstat(lock_file.fileno()).st_ino:
+                return lock_file
+
+        lock_file.close()
+
+
+def remove_unlocked_directory(directory: Path) -> None:
+    path = get_lock_path(directory)
+
+    try:
+        lock_file = path.open()
+
+    except FileNotFoundError:
+        # Directories are only created once they are locked, so this is left over from an older version
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+
+    with lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            # The process using this directory is still running
+            return
+
+        shutil.rmtree(directory, ignore_errors=True)
+        path.unlink(missing_ok=True)
+
+
+async def remove_directory(path: Path) -> None:
+    # Move the directory out of the way first, so that it can be re-created while the old one is being deleted
+    trash = path.with_name(f".trash-{token_urlsafe(16)}")
+
+    try:
+        path.rename(trash)  # noqa: ASYNC240
+
+    except FileNotFoundError:
+        return
+
+    await asyncio.to_thread(shutil.rmtree, trash, ignore_errors=True)
+
+
+async def create_build_root(root: Path, *, store: ArtifactStore, sources: dict[str, str], files: dict[str, str]) -> int:
+    # Create the build root, returning its size in bytes. The root is built in a temporary directory and renamed
+    # into place, so a partially created root is never used.
+    tmp = root.with_name(f".tmp-{token_urlsafe(16)}")
+    await asyncio.to_thread(tmp.mkdir, parents=True)
+
+    try:
+        for filename, key in files.items():
+            await store.copy_to(key, get_build_root_path(tmp, filename))
+
+        size = await asyncio.to_thread(write_sources, tmp, sources)
+
+        await asyncio.to_thread(tmp.rename, root)
+
+    except BaseException:
+        await asyncio.to_thread(shutil.rmtree, tmp, ignore_errors=True)
+        raise
+
+    return size
+
+
+def write_sources(root: Path, sources: dict[str, str]) -> int:
+    # Sources are written last so that they take precedence over uploaded files with the same name
+    for filename, source in sources.items():
+        path = get_build_root_path(root, filename)
+
+        # Don't write through a hard link to an uploaded file
+        path.unlink(missing_ok=True)
+        path.write_text(source)
+
+    return sum(path.stat().st_size for path in root.rglob("*") if path.is_file())
+
+
+def get_build_root_path(root: Path, filename: str) -> Path:
+    path = (root / filename).absolute()
+    assert path.is_relative_to(root)
+
+    return path
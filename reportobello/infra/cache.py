@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter("reportobello")
+
+HIT_COUNT = meter.create_counter(
+    "reportobello.cache.hits",
+    description="Number of lookups that were found in an in-memory cache",
+)
+MISS_COUNT = meter.create_counter(
+    "reportobello.cache.misses",
+    description="Number of lookups that were not found in an in-memory cache",
+)
+
+
+class LRUCache[K: Hashable, V]:
+    """
+    A bounded, in-memory cache. Once **max_size** entries are stored, the least recently used entry is evicted.
+    If **ttl** is set, entries are also evicted once they are older than **ttl** seconds.
+
+    This is not thread-safe, and should only be used from the event loop.
+    """
+
+    def __init__(self, name: str, *, max_size: int, ttl: float | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.attributes = {"name": name}
+
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+
+        if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+            self._entries.pop(key, None)
+            MISS_COUNT.add(1, self.attributes)
+
+            return None
+
+        self._entries.move_to_end(key)
+        HIT_COUNT.add(1, self.attributes)
+
+        return entry[1]
+
+    def set(self, key: K, value: V) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def remove(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def remove_where(self, predicate: Callable[[K, V], bool]) -> None:
+        for key in [key for key, (_, value) in self._entries.items() if predicate(key, value)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
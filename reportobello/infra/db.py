@@ -1,19 +1,46 @@
 import os
+import queue
 import re
 import sqlite3
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager
 from datetime import datetime
+from hashlib import sha256
 from secrets import token_urlsafe
 
+import zstandard
+
+from reportobello.domain.build_job import BuildJob
 from reportobello.domain.file import File
 from reportobello.domain.report import Report
 from reportobello.domain.template import Template
+from reportobello.domain.upload_session import UploadChunk, UploadSession
 from reportobello.domain.user import User, UserId
 
 
-def build_db(location: str = ":memory:") -> sqlite3.Connection:
+def connect(location: str) -> sqlite3.Connection:
     db = sqlite3.connect(location, check_same_thread=False)
     db.row_factory = sqlite3.Row
 
+    if location != ":memory:":
+        # NORMAL is safe in WAL mode, the only downside is that the most recent commits might be
+        # rolled back after a power loss (but the database will not be corrupted).
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute("PRAGMA mmap_size=268435456")
+        db.execute("PRAGMA temp_store=MEMORY")
+
+    return db
+
+
+def build_db(location: str = ":memory:") -> sqlite3.Connection:  # noqa: C901
+    db = connect(location)
+
+    if location != ":memory:":
+        # WAL allows readers to keep reading while a write is in progress. This is persisted in the database file.
+        db.execute("PRAGMA journal_mode=WAL")
+
     user_version: int = db.execute("PRAGMA user_version").fetchone()[0]
 
     if user_version <= 0:
@@ -99,6 +126,118 @@ PRAGMA user_version=1;
 ALTER TABLE reports ADD COLUMN hash TEXT NOT NULL DEFAULT '';
 
 PRAGMA user_version=2;
+"""
+        )
+
+    if user_version <= 2:
+        db.executescript(
+            """
+ALTER TABLE reports ADD COLUMN state TEXT NOT NULL DEFAULT 'done';
+ALTER TABLE reports ADD COLUMN job_id TEXT NULL;
+ALTER TABLE reports ADD COLUMN webhook_url TEXT NULL;
+ALTER TABLE reports ADD COLUMN queued_at TEXT NULL;
+CREATE UNIQUE INDEX ux_reports_job_id ON reports(job_id);
+
+PRAGMA user_version=3;
+"""
+        )
+
+    if user_version <= 3:
+        db.executescript(
+            """
+ALTER TABLE reports ADD COLUMN cache_key TEXT NOT NULL DEFAULT '';
+CREATE INDEX ix_reports_cache_key ON reports(cache_key);
+
+PRAGMA user_version=4;
+"""
+        )
+
+    if user_version <= 4:
+        db.executescript(
+            """
+CREATE INDEX ix_reports_template_id_finished_at ON reports(template_id, finished_at);
+CREATE INDEX ix_reports_unfinished ON reports(state) WHERE state IN ('queued', 'running');
+
+PRAGMA user_version=5;
+"""
+        )
+
+    if user_version <= 5:
+        # Unlike executescript, this runs in a single transaction, so if the data move is interrupted (ie, the
+        # process is killed) the whole migration is rolled back and starts over the next time
+        with db:
+            db.execute("BEGIN")
+            db.execute(
+                """
+CREATE TABLE report_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+"""
+            )
+
+            move_report_data_to_blobs(db)
+
+            db.execute("PRAGMA user_version=6")
+
+    if user_version <= 6:
+        db.executescript(
+            """
+ALTER TABLE reports ADD COLUMN lease_expires_at TEXT NULL;
+
+PRAGMA user_version=7;
+"""
+        )
+
+    if user_version <= 7:
+        db.executescript(
+            """
+CREATE INDEX ix_reports_expiring ON reports(expires_at) WHERE filename IS NOT NULL;
+
+PRAGMA user_version=8;
+"""
+        )
+
+    if user_version <= 8:
+        db.executescript(
+            """
+ALTER TABLE file_hashes ADD COLUMN orphaned_at TEXT NULL;
+CREATE INDEX ix_uploaded_files_file_id ON uploaded_files(file_id);
+
+PRAGMA user_version=9;
+"""
+        )
+
+    if user_version <= 9:
+        db.executescript(
+            """
+CREATE TABLE upload_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    upload_id TEXT NOT NULL UNIQUE,
+    owner_id INTEGER NOT NULL,
+    template_name TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NULL,
+    size INT NOT NULL,
+    hash TEXT NOT NULL,
+    chunk_size INT NOT NULL,
+    created_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL,
+    FOREIGN KEY(owner_id) REFERENCES users(id)
+);
+
+CREATE TABLE upload_chunks (
+    session_id INTEGER NOT NULL,
+    start INT NOT NULL,
+    hash TEXT NOT NULL,
+    received INT NOT NULL DEFAULT 0,
+    PRIMARY KEY(session_id, start),
+    FOREIGN KEY(session_id) REFERENCES upload_sessions(id)
+);
+CREATE INDEX ix_upload_chunks_hash ON upload_chunks(hash);
+
+PRAGMA user_version=10;
 """
         )
 
@@ -107,7 +246,89 @@ PRAGMA user_version=2;
     return db
 
 
-db = build_db(os.getenv("REPORTOBELLO_DB", ":memory:"))
+def move_report_data_to_blobs(db: sqlite3.Connection) -> None:
+    # Older reports store their data inline. This runs in batches so the whole table doesn't need to fit in memory.
+    # The freed pages are reused by new rows, but a VACUUM is needed to shrink the database file itself.
+    last_id = 0
+
+    while rows := db.execute(
+        "SELECT id, data FROM reports WHERE id>? AND data!='' ORDER BY id LIMIT 1000",
+        [last_id],
+    ).fetchall():
+        for row in rows:
+            data_hash = sha256(row["data"].encode()).hexdigest()
+
+            db.execute(
+                "INSERT OR IGNORE INTO report_data (hash, data) VALUES (?, ?)",
+                [data_hash, compress_report_data(row["data"])],
+            )
+            db.execute("UPDATE reports SET data='', hash=? WHERE id=?", [data_hash, row["id"]])
+
+        last_id = rows[-1]["id"]
+
+
+def compress_report_data(data: str) -> bytes:
+    return zstandard.compress(data.encode())
+
+
+def decompress_report_data(data: bytes) -> str:
+    return zstandard.decompress(data).decode()
+
+
+class ConnectionPool:
+    """
+    A single writer connection, and a pool of reader connections. SQLite only allows one writer at a time,
+    so writes are serialized up front instead of fighting over the database lock. In WAL mode readers
+    are never blocked by the writer, so reads can run concurrently with each other and with writes.
+
+    In-memory databases cannot be shared across connections, so all reads go through the writer instead.
+    """
+
+    def __init__(self, location: str, *, readers: int) -> None:
+        self.writer = build_db(location)
+
+        self._write_lock = threading.RLock()
+        self._readers = queue.SimpleQueue[sqlite3.Connection]()
+
+        self.reader_count = 0 if location == ":memory:" else readers
+
+        for _ in range(self.reader_count):
+            self._readers.put(connect(location))
+
+    @contextmanager
+    def read(self) -> Generator[sqlite3.Connection]:
+        if not self.reader_count:
+            with self._write_lock:
+                yield self.writer
+
+            return
+
+        db = self._readers.get()
+
+        try:
+            yield db
+
+        finally:
+            self._readers.put(db)
+
+    @contextmanager
+    def write(self) -> Generator[sqlite3.Connection]:
+        # The transaction is committed once the block exits, or rolled back if an exception is raised
+        with self._write_lock:
+            try:
+                yield self.writer
+
+            except BaseException:
+                self.writer.rollback()
+                raise
+
+            self.writer.commit()
+
+
+pool = ConnectionPool(
+    os.getenv("REPORTOBELLO_DB", ":memory:"),
+    readers=int(os.getenv("REPORTOBELLO_DB_READERS", "4")),
+)
 
 
 def create_random_api_key() -> str:
@@ -139,21 +360,21 @@ ON CONFLICT DO UPDATE SET
     email=excluded.email;
 """
 
-    cursor = db.cursor()
-    cursor.execute(
-        sql,
-        [
-            user.created_at.isoformat(),
-            user.api_key,
-            user.provider,
-            user.provider_user_id,
-            user.username,
-            int(user.is_setting_up_account),
-            user.email,
-        ],
-    )
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            sql,
+            [
+                user.created_at.isoformat(),
+                user.api_key,
+                user.provider,
+                user.provider_user_id,
+                user.username,
+                int(user.is_setting_up_account),
+                user.email,
+            ],
+        )
+        cursor.close()
 
     fresh_user = get_user_by_api_key(user.api_key)
     assert fresh_user
@@ -164,9 +385,10 @@ ON CONFLICT DO UPDATE SET
 def get_user_by_api_key(api_key: str) -> User | None:
     sql = "SELECT * FROM users WHERE api_key=?"
 
-    cursor = db.cursor()
-    row = cursor.execute(sql, [api_key]).fetchone()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(sql, [api_key]).fetchone()
+        cursor.close()
 
     if row is None:
         return None
@@ -177,9 +399,10 @@ def get_user_by_api_key(api_key: str) -> User | None:
 def get_user_by_user_id(user_id: UserId) -> User | None:
     sql = "SELECT * FROM users WHERE id=?"
 
-    cursor = db.cursor()
-    row = cursor.execute(sql, [user_id]).fetchone()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(sql, [user_id]).fetchone()
+        cursor.close()
 
     if row is None:
         return None
@@ -190,9 +413,10 @@ def get_user_by_user_id(user_id: UserId) -> User | None:
 def get_user_by_provider_id(*, provider: str, provider_user_id: str) -> User | None:
     sql = "SELECT * FROM users WHERE provider=? AND provider_user_id=? LIMIT 1"
 
-    cursor = db.cursor()
-    row = cursor.execute(sql, [provider, provider_user_id]).fetchone()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(sql, [provider, provider_user_id]).fetchone()
+        cursor.close()
 
     if row is None:
         return None
@@ -214,85 +438,119 @@ def user_row_to_user(row: sqlite3.Row) -> User:
 
 
 def check_template_exists_for_user(user_id: UserId, template_name: str) -> bool:
-    cursor = db.cursor()
-    row = cursor.execute(
-        """
-        SELECT EXISTS(
-            SELECT id FROM templates WHERE owner_id=? AND name=?
-        );
-        """,
-        [user_id, template_name],
-    ).fetchone()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            SELECT EXISTS(
+                SELECT id FROM templates WHERE owner_id=? AND name=?
+            );
+            """,
+            [user_id, template_name],
+        ).fetchone()
+        cursor.close()
 
     return bool(row[0])
 
 
 def get_all_template_versions_for_user(user_id: UserId, template_name: str) -> list[Template]:
-    cursor = db.cursor()
-    rows = cursor.execute(
-        """
-        SELECT version, template
-        FROM templates
-        WHERE owner_id=? AND name=?;
-        """,
-        [user_id, template_name],
-    ).fetchall()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute(
+            """
+            SELECT version, template
+            FROM templates
+            WHERE owner_id=? AND name=?;
+            """,
+            [user_id, template_name],
+        ).fetchall()
+        cursor.close()
 
     return [Template(name=template_name, template=row["template"], version=row["version"]) for row in rows]
 
 
 def get_template_for_user(user_id: UserId, template_name: str, version: int = -1) -> Template | None:
-    # TODO: make specialized version of this so we aren't overfetching
-    templates = get_all_template_versions_for_user(user_id, template_name)
+    # Both of these are a single lookup using the ux_templates index, regardless of how many versions there are
+    if version == -1:
+        sql = """
+            SELECT version, template
+            FROM templates
+            WHERE owner_id=? AND name=?
+            ORDER BY version DESC
+            LIMIT 1;
+            """
+        args: list[object] = [user_id, template_name]
+
+    else:
+        sql = """
+            SELECT version, template
+            FROM templates
+            WHERE owner_id=? AND name=? AND version=?;
+            """
+        args = [user_id, template_name, version]
 
-    if not templates:
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(sql, args).fetchone()
+        cursor.close()
+
+    if row is None:
         return None
 
-    if version == -1:
-        return templates[-1]
+    return Template(name=template_name, template=row["template"], version=row["version"])
 
-    try:
-        return templates[version - 1]
 
-    except IndexError:
-        return None
+def get_latest_template_version_for_user(user_id: UserId, template_name: str) -> int | None:
+    """
+    Get the most recent version number of the template **template_name**, or None if it doesn't exist.
+    Unlike get_template_for_user(), this only reads the index, not the template itself.
+    """
+
+    with pool.read() as db:
+        cursor = db.cursor()
+        version: int | None = cursor.execute(
+            "SELECT MAX(version) FROM templates WHERE owner_id=? AND name=?;",
+            [user_id, template_name],
+        ).fetchone()[0]
+        cursor.close()
+
+    return version
 
 
 def get_all_templates_for_user(user_id: UserId) -> list[Template]:
-    cursor = db.cursor()
-    rows = cursor.execute(
-        """
-        SELECT name, MAX(version) AS version, template
-        FROM templates
-        WHERE owner_id=?
-        GROUP BY name;
-        """,
-        [user_id],
-    ).fetchall()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute(
+            """
+            SELECT name, MAX(version) AS version, template
+            FROM templates
+            WHERE owner_id=?
+            GROUP BY name;
+            """,
+            [user_id],
+        ).fetchall()
+        cursor.close()
 
     return [Template(name=row["name"], template=row["template"], version=row["version"]) for row in rows]
 
 
 def save_template_for_user(user_id: UserId, template: Template) -> None:
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        INSERT INTO templates (owner_id, name, version, template)
-        VALUES (?, ?, ?, ?);
-        """,
-        [user_id, template.name, template.version, template.template],
-    )
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            """
+            INSERT INTO templates (owner_id, name, version, template)
+            VALUES (?, ?, ?, ?);
+            """,
+            [user_id, template.name, template.version, template.template],
+        )
+        cursor.close()
 
 
 def create_or_update_template_for_user(user_id: UserId, *, name: str, content: str) -> Template:
-    old_template = get_template_for_user(user_id, name)
+    latest_version = get_latest_template_version_for_user(user_id, name)
 
-    version = 1 if old_template is None else old_template.version + 1
+    version = 1 if latest_version is None else latest_version + 1
 
     template = Template(name=name, template=content, version=version)
 
@@ -301,6 +559,50 @@ def create_or_update_template_for_user(user_id: UserId, *, name: str, content: s
     return template
 
 
+def prepare_report_data(data: str) -> tuple[str, bytes | None]:
+    """
+    Hash **data**, and compress it if it isn't already stored. Compression is done up front so
+    that the write lock isn't held while compressing large payloads.
+    """
+
+    data_hash = sha256(data.encode()).hexdigest()
+
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute("SELECT EXISTS(SELECT 1 FROM report_data WHERE hash=?);", [data_hash]).fetchone()
+        cursor.close()
+
+    return data_hash, None if row[0] else compress_report_data(data)
+
+
+def save_report_data(cursor: sqlite3.Cursor, data_hash: str, compressed_data: bytes | None) -> None:
+    if compressed_data is not None:
+        cursor.execute("INSERT OR IGNORE INTO report_data (hash, data) VALUES (?, ?);", [data_hash, compressed_data])
+
+
+def get_report_data(data_hashes: list[str]) -> dict[str, str]:
+    """
+    Load the data for the given report hashes. Each unique payload is only decompressed once.
+    """
+
+    unique_hashes = list(set(data_hashes))
+
+    if not unique_hashes:
+        return {}
+
+    placeholders = ",".join("?" * len(unique_hashes))
+
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute(
+            f"SELECT hash, data FROM report_data WHERE hash IN ({placeholders});",  # noqa: S608
+            unique_hashes,
+        ).fetchall()
+        cursor.close()
+
+    return {row["hash"]: decompress_report_data(row["data"]) for row in rows}
+
+
 def save_recent_report_build_for_user(user_id: UserId, report: Report) -> None:
     # This is a hack and I don't like it. Basically if the version is negative it is a preview
     # report, meaning it is probably used by the editor and should be ignored. The versioning system
@@ -308,130 +610,201 @@ def save_recent_report_build_for_user(user_id: UserId, report: Report) -> None:
     if report.actual_version == -1:
         return
 
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        INSERT INTO reports (
-            template_id,
-            filename,
-            requested_version,
-            started_at,
-            finished_at,
-            expires_at,
-            error_msg,
-            data,
-            data_type,
-            hash
-        ) VALUES (
-            (SELECT id FROM templates WHERE owner_id=? AND name=? AND version=? LIMIT 1),
-            ?,
-            ?,
-            ?,
-            ?,
-            ?,
-            ?,
-            ?,
-            ?,
-            ?
-        );
-        """,
-        [
-            user_id,
-            report.template_name,
-            report.actual_version,
-            report.filename,
-            report.requested_version,
-            report.started_at.isoformat(),
-            report.finished_at.isoformat(),
-            report.expires_at.isoformat(),
-            report.error_message,
-            report.data,
-            report.data_type,
-            report.hash,
-        ],
-    )
-    db.commit()
-    cursor.close()
+    data_hash, compressed_data = prepare_report_data(report.data)
+
+    with pool.write() as db:
+        cursor = db.cursor()
+        save_report_data(cursor, data_hash, compressed_data)
+        cursor.execute(
+            """
+            INSERT INTO reports (
+                template_id,
+                filename,
+                requested_version,
+                started_at,
+                finished_at,
+                expires_at,
+                error_msg,
+                data,
+                data_type,
+                hash,
+                cache_key
+            ) VALUES (
+                (SELECT id FROM templates WHERE owner_id=? AND name=? AND version=? LIMIT 1),
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?
+            );
+            """,
+            [
+                user_id,
+                report.template_name,
+                report.actual_version,
+                report.filename,
+                report.requested_version,
+                report.started_at.isoformat(),
+                report.finished_at.isoformat(),
+                report.expires_at.isoformat(),
+                report.error_message,
+                "",
+                report.data_type,
+                data_hash,
+                report.cache_key,
+            ],
+        )
+        cursor.close()
 
 
-def get_recent_report_builds_for_user(
-    user_id: UserId, template_name: str, before: datetime | None = None, limit: int = 20
+def get_recent_report_builds_for_user(  # noqa: PLR0913
+    user_id: UserId,
+    template_name: str,
+    before: datetime | None = None,
+    limit: int = 20,
+    *,
+    after_cursor: tuple[datetime, int] | None = None,
+    with_data: bool = True,
 ) -> list[Report] | None:
+    """
+    Get the most recently finished builds for **template_name**, newest first.
+
+    Pages can be fetched with **after_cursor**, which is the `(finished_at, id)` of the last report in the
+    previous page. Unlike **before**, this won't skip or repeat reports that finished at the same time.
+
+    If **with_data** is False, only the report metadata is loaded. Use get_report_data_for_user() to get
+    the data for a single report.
+    """
+
     assert isinstance(limit, int)
 
     if not check_template_exists_for_user(user_id, template_name):
         return None
 
+    conditions = ""
+    args: list[object] = []
+
     if before is not None:
-        query = "started_at<?"
-        args: list[object] = [before.isoformat()]
-    else:
-        query = "?"
-        args = [True]
-
-    cursor = db.cursor()
-    rows = cursor.execute(
-        f"""
-        SELECT
-            filename,
-            requested_version,
-            t.version,
-            t.name,
-            started_at,
-            finished_at,
-            expires_at,
-            error_msg,
-            data,
-            data_type,
-            hash
-        FROM reports r
-        JOIN templates t ON t.id = r.template_id
-        WHERE t.owner_id=? AND t.name=? AND {query}
-        ORDER BY r.finished_at DESC
-        LIMIT {limit};
-        """,  # noqa: S608
-        [user_id, template_name, *args],
-    ).fetchall()
-    cursor.close()
-
-    return [report_row_to_report(row) for row in rows]
-
-
-def get_cached_report_by_hash(user_id: UserId, template_name: str, template_version: int, hash: str) -> Report | None:  # noqa: A002
-    cursor = db.cursor()
-    rows = cursor.execute(
-        """
-        SELECT
-            filename,
-            requested_version,
-            t.version,
-            t.name,
-            started_at,
-            finished_at,
-            expires_at,
-            error_msg,
-            data,
-            data_type,
-            hash
-        FROM reports r
-        JOIN templates t ON t.id = r.template_id
-        WHERE t.owner_id=? AND t.name=? AND t.version=? AND r.hash=? AND r.filename IS NOT NULL
-        ORDER BY r.finished_at DESC
-        LIMIT 1;
-        """,
-        [user_id, template_name, template_version, hash],
-    ).fetchall()
-    cursor.close()
-
-    if not rows:
+        conditions += " AND r.started_at<?"
+        args.append(before.isoformat())
+
+    if after_cursor is not None:
+        conditions += " AND (r.finished_at, r.id)<(?, ?)"
+        args += [after_cursor[0].isoformat(), after_cursor[1]]
+
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute(
+            f"""
+            SELECT
+                r.id,
+                filename,
+                requested_version,
+                t.version,
+                t.name,
+                started_at,
+                finished_at,
+                expires_at,
+                error_msg,
+                data_type,
+                hash,
+                cache_key
+            FROM reports r
+            JOIN templates t ON t.id = r.template_id
+            WHERE t.owner_id=? AND t.name=? AND r.state='done'{conditions}
+            ORDER BY r.finished_at DESC, r.id DESC
+            LIMIT {limit};
+            """,  # noqa: S608
+            [user_id, template_name, *args],
+        ).fetchall()
+        cursor.close()
+
+    if not with_data:
+        return [report_row_to_report(row) for row in rows]
+
+    data = get_report_data([row["hash"] for row in rows])
+
+    return [report_row_to_report(row, data=data.get(row["hash"], "")) for row in rows]
+
+
+def get_report_data_for_user(user_id: UserId, template_name: str, report_id: int) -> Report | None:
+    """
+    Get report **report_id** along with its data, or None if it doesn't exist or isn't owned by **user_id**.
+    """
+
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            SELECT
+                r.id,
+                filename,
+                requested_version,
+                t.version,
+                t.name,
+                started_at,
+                finished_at,
+                expires_at,
+                error_msg,
+                d.data,
+                data_type,
+                r.hash,
+                cache_key
+            FROM reports r
+            JOIN templates t ON t.id = r.template_id
+            LEFT JOIN report_data d ON d.hash = r.hash
+            WHERE r.id=? AND t.owner_id=? AND t.name=? AND r.state='done';
+            """,
+            [report_id, user_id, template_name],
+        ).fetchone()
+        cursor.close()
+
+    if row is None:
         return None
 
-    row = rows[0]
+    return report_row_to_report(row, data="" if row["data"] is None else decompress_report_data(row["data"]))
+
+
+def get_cached_report_by_cache_key(user_id: UserId, cache_key: str, now: datetime) -> Report | None:
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            SELECT
+                r.id,
+                filename,
+                requested_version,
+                t.version,
+                t.name,
+                started_at,
+                finished_at,
+                expires_at,
+                error_msg,
+                data_type,
+                hash,
+                cache_key
+            FROM reports r
+            JOIN templates t ON t.id = r.template_id
+            WHERE r.cache_key=? AND t.owner_id=? AND r.filename IS NOT NULL AND r.expires_at>?
+            ORDER BY r.expires_at DESC
+            LIMIT 1;
+            """,
+            [cache_key, user_id, now.isoformat()],
+        ).fetchone()
+        cursor.close()
+
+    if row is None:
+        return None
 
     return report_row_to_report(row)
 
 
-def report_row_to_report(row: sqlite3.Row) -> Report:
+def report_row_to_report(row: sqlite3.Row, *, data: str = "") -> Report:
     return Report(
         filename=row["filename"],
         requested_version=row["requested_version"],
@@ -441,63 +814,266 @@ def report_row_to_report(row: sqlite3.Row) -> Report:
         finished_at=datetime.fromisoformat(row["finished_at"]),
         expires_at=datetime.fromisoformat(row["expires_at"]),
         error_message=row["error_msg"],
-        data=row["data"],
+        data=data,
+        data_type=row["data_type"],
+        hash=row["hash"],
+        id=row["id"],
+        cache_key=row["cache_key"],
+    )
+
+
+def create_build_job(job: BuildJob) -> None:
+    data_hash, compressed_data = prepare_report_data(job.data)
+
+    with pool.write() as db:
+        cursor = db.cursor()
+        save_report_data(cursor, data_hash, compressed_data)
+        cursor.execute(
+            """
+            INSERT INTO reports (
+                template_id,
+                requested_version,
+                queued_at,
+                started_at,
+                data,
+                data_type,
+                hash,
+                cache_key,
+                state,
+                job_id,
+                webhook_url
+            ) VALUES (
+                (SELECT id FROM templates WHERE owner_id=? AND name=? AND version=? LIMIT 1),
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?
+            );
+            """,
+            [
+                job.owner_id,
+                job.template_name,
+                job.actual_version,
+                job.requested_version,
+                job.queued_at.isoformat(),
+                job.queued_at.isoformat(),
+                "",
+                job.data_type,
+                data_hash,
+                job.cache_key,
+                job.state,
+                job.id,
+                job.webhook_url,
+            ],
+        )
+        cursor.close()
+
+
+def get_build_job(job_id: str) -> BuildJob | None:
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            SELECT
+                r.id,
+                job_id,
+                state,
+                webhook_url,
+                queued_at,
+                t.owner_id,
+                filename,
+                requested_version,
+                t.version,
+                t.name,
+                started_at,
+                finished_at,
+                expires_at,
+                error_msg,
+                d.data,
+                data_type,
+                r.hash,
+                cache_key
+            FROM reports r
+            JOIN templates t ON t.id = r.template_id
+            LEFT JOIN report_data d ON d.hash = r.hash AND r.state != 'done'
+            WHERE r.job_id=?;
+            """,
+            [job_id],
+        ).fetchone()
+        cursor.close()
+
+    if row is None:
+        return None
+
+    # The data is only needed to run the job, so it isn't loaded once the job is done
+    data = "" if row["data"] is None else decompress_report_data(row["data"])
+
+    return BuildJob(
+        id=row["job_id"],
+        owner_id=row["owner_id"],
+        state=row["state"],
+        template_name=row["name"],
+        requested_version=row["requested_version"],
+        actual_version=row["version"],
+        queued_at=datetime.fromisoformat(row["queued_at"]),
+        data=data,
         data_type=row["data_type"],
         hash=row["hash"],
+        cache_key=row["cache_key"],
+        webhook_url=row["webhook_url"],
+        report=report_row_to_report(row, data=data) if row["state"] == "done" else None,
     )
 
 
+def claim_build_job(*, now: datetime, lease_expires_at: datetime) -> str | None:
+    # Atomically mark the oldest runnable job as running, returning its id. Running jobs whose lease has expired
+    # are runnable again, since the worker that claimed them has (most likely) died.
+    with pool.write() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            UPDATE reports
+            SET state='running', lease_expires_at=?
+            WHERE id=(
+                SELECT id
+                FROM reports
+                WHERE
+                    state IN ('queued', 'running')
+                    AND (state='queued' OR lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY id
+                LIMIT 1
+            )
+            RETURNING job_id;
+            """,
+            [lease_expires_at.isoformat(), now.isoformat()],
+        ).fetchone()
+        cursor.close()
+
+    return None if row is None else row["job_id"]
+
+
+def renew_build_job_lease(job_id: str, *, lease_expires_at: datetime) -> None:
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            "UPDATE reports SET lease_expires_at=? WHERE job_id=? AND state='running';",
+            [lease_expires_at.isoformat(), job_id],
+        )
+        cursor.close()
+
+
+def cancel_build_job(job_id: str) -> None:
+    # Remove a job that no worker has claimed yet. Jobs that are already running are left to finish, since there is
+    # no way of stopping the worker that is running them.
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM reports WHERE job_id=? AND state='queued';", [job_id])
+        cursor.close()
+
+
+def finish_build_job(job_id: str, report: Report) -> None:
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            """
+            UPDATE reports
+            SET
+                state='done',
+                filename=?,
+                started_at=?,
+                finished_at=?,
+                expires_at=?,
+                error_msg=?,
+                cache_key=?
+            WHERE job_id=?;
+            """,
+            [
+                report.filename,
+                report.started_at.isoformat(),
+                report.finished_at.isoformat(),
+                report.expires_at.isoformat(),
+                report.error_message,
+                report.cache_key,
+                job_id,
+            ],
+        )
+        cursor.close()
+
+
+def save_new_user_survey(user_id: UserId, submitted_at: datetime, value: str) -> None:
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            """
+INSERT INTO new_user_survey (owner_id, submitted_at, value)
+VALUES (?, ?, ?)
+ON CONFLICT DO UPDATE SET
+    value=excluded.value,
+    submitted_at=excluded.submitted_at;
+""",
+            [user_id, submitted_at.isoformat(), value],
+        )
+        cursor.close()
+
+
 def get_env_vars_for_user(user_id: UserId) -> dict[str, str]:
-    cursor = db.cursor()
-    rows = cursor.execute("SELECT key, value FROM env_vars WHERE owner_id=?", [user_id]).fetchall()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute("SELECT key, value FROM env_vars WHERE owner_id=?", [user_id]).fetchall()
+        cursor.close()
 
     return dict(tuple(row) for row in rows)
 
 
 def update_env_vars_for_user(user_id: UserId, env_vars: dict[str, str]) -> None:
-    cursor = db.cursor()
-    cursor.executemany(
-        """
-        INSERT INTO env_vars (owner_id, key, value)
-        VALUES (?, ?, ?)
-        ON CONFLICT DO UPDATE SET value=excluded.value;
-        """,
-        [(user_id, k, v) for k, v in env_vars.items()],
-    )
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO env_vars (owner_id, key, value)
+            VALUES (?, ?, ?)
+            ON CONFLICT DO UPDATE SET value=excluded.value;
+            """,
+            [(user_id, k, v) for k, v in env_vars.items()],
+        )
+        cursor.close()
 
 
 def delete_env_vars_for_user(user_id: UserId, keys: list[str]) -> None:
-    cursor = db.cursor()
-    cursor.executemany("DELETE FROM env_vars WHERE owner_id=? AND key=?", [(user_id, k) for k in keys])
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.executemany("DELETE FROM env_vars WHERE owner_id=? AND key=?", [(user_id, k) for k in keys])
+        cursor.close()
 
 
 def delete_template_for_user(user_id: UserId, name: str) -> None:
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM templates WHERE owner_id=? AND name=?;", [user_id, name])
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM templates WHERE owner_id=? AND name=?;", [user_id, name])
+        # The uploaded files themselves are removed by the file garbage collector (see file_gc.py)
+        cursor.execute("DELETE FROM uploaded_files WHERE uploaded_by_user_id=? AND template_name=?;", [user_id, name])
+        cursor.close()
 
 
 def save_file_metadata(*, user_id: UserId, template_name: str, file: File) -> None:
-    sql = "INSERT OR IGNORE INTO file_hashes (hash, size) VALUES (?, ?);"
-
-    cursor = db.cursor()
-    cursor.execute(sql, [file.hash, file.size])
-    db.commit()
-    cursor.close()
-
-    sql = "SELECT id FROM file_hashes WHERE hash=?;"
+    with pool.write() as db:
+        cursor = db.cursor()
+        # Files that are uploaded again are no longer orphaned, and so must not be garbage collected
+        cursor.execute(
+            "INSERT INTO file_hashes (hash, size) VALUES (?, ?) ON CONFLICT DO UPDATE SET orphaned_at=NULL;",
+            [file.hash, file.size],
+        )
 
-    cursor = db.cursor()
-    file_id = cursor.execute(sql, [file.hash]).fetchone()[0]
-    cursor.close()
+        file_id = cursor.execute("SELECT id FROM file_hashes WHERE hash=?;", [file.hash]).fetchone()[0]
 
-    sql = """
+        cursor.execute(
+            """
 INSERT INTO uploaded_files (
     uploaded_by_user_id,
     template_name,
@@ -507,14 +1083,29 @@ INSERT INTO uploaded_files (
     uploaded_at
 ) VALUES (?, ?, ?, ?, ?, ?)
 ON CONFLICT DO UPDATE SET content_type=excluded.content_type, uploaded_at=excluded.uploaded_at;
-"""
+""",
+            [user_id, template_name, file_id, file.filename, file.content_type, file.uploaded_at.isoformat()],
+        )
+        cursor.close()
 
-    cursor = db.cursor()
-    cursor.execute(
-        sql, [user_id, template_name, file_id, file.filename, file.content_type, file.uploaded_at.isoformat()]
-    )
-    db.commit()
-    cursor.close()
+
+def check_file_uploaded_by_user(user_id: UserId, file_hash: str) -> bool:
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(
+            """
+            SELECT EXISTS(
+                SELECT 1
+                FROM file_hashes f
+                JOIN uploaded_files u ON u.file_id=f.id
+                WHERE f.hash=? AND u.uploaded_by_user_id=?
+            );
+            """,
+            [file_hash, user_id],
+        ).fetchone()
+        cursor.close()
+
+    return bool(row[0])
 
 
 def row_to_file(row: sqlite3.Row) -> File:
@@ -528,21 +1119,23 @@ def row_to_file(row: sqlite3.Row) -> File:
 
 
 def get_files_for_template(user_id: UserId, template_name: str) -> list[File]:
+    # Files are only visible while the template exists. The EXISTS doesn't reference the outer query,
+    # so it is only evaluated once instead of once per file.
     sql = """
 SELECT uf.filename, uf.content_type, uf.uploaded_at, fh.hash, fh.size
 FROM uploaded_files uf
-JOIN templates t ON t.name = uf.template_name
 JOIN file_hashes fh ON fh.id = uf.file_id
 WHERE (
-    uf.template_name=?
-    AND uf.uploaded_by_user_id=?
-    AND t.id=(SELECT id FROM templates WHERE owner_id=? AND name=? LIMIT 1)
+    uf.uploaded_by_user_id=?
+    AND uf.template_name=?
+    AND EXISTS(SELECT 1 FROM templates WHERE owner_id=? AND name=?)
 );
 """
 
-    cursor = db.cursor()
-    rows = cursor.execute(sql, [template_name, user_id, user_id, template_name]).fetchall()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        rows = cursor.execute(sql, [user_id, template_name, user_id, template_name]).fetchall()
+        cursor.close()
 
     return [row_to_file(row) for row in rows]
 
@@ -551,41 +1144,170 @@ def get_file_for_template(user_id: UserId, template_name: str, filename: str) ->
     sql = """
 SELECT uf.*, fh.hash, fh.size
 FROM uploaded_files uf
-JOIN templates t ON t.name=uf.template_name
 JOIN file_hashes fh ON fh.id=uf.file_id
 WHERE (
-    t.name=?
-    AND t.owner_id=uf.uploaded_by_user_id
-    AND t.owner_id=?
+    uf.uploaded_by_user_id=?
+    AND uf.template_name=?
     AND uf.filename=?
-)
-LIMIT 1;
+    AND EXISTS(SELECT 1 FROM templates WHERE owner_id=? AND name=?)
+);
 """
 
-    cursor = db.cursor()
-    rows = cursor.execute(sql, [template_name, user_id, filename]).fetchall()
-    cursor.close()
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute(sql, [user_id, template_name, filename, user_id, template_name]).fetchone()
+        cursor.close()
 
-    return None if not rows else row_to_file(rows[0])
+    return None if row is None else row_to_file(row)
 
 
 def delete_file_for_template(user_id: UserId, template_name: str, filename: str) -> None:
     sql = """
 DELETE FROM uploaded_files
-WHERE id IN (
-    SELECT uf.id
-    FROM uploaded_files uf
-    JOIN templates t ON t.name=uf.template_name
-    WHERE (
-        t.name=?
-        AND t.owner_id=uf.uploaded_by_user_id
-        AND t.owner_id=?
-        AND uf.filename=?
-    )
+WHERE (
+    uploaded_by_user_id=?
+    AND template_name=?
+    AND filename=?
+    AND EXISTS(SELECT 1 FROM templates WHERE owner_id=? AND name=?)
 );
 """
 
-    cursor = db.cursor()
-    cursor.execute(sql, [template_name, user_id, filename])
-    db.commit()
-    cursor.close()
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(sql, [user_id, template_name, filename, user_id, template_name])
+        cursor.close()
+
+
+def create_upload_session(session: UploadSession) -> None:
+    with pool.write() as db:
+        cursor = db.cursor()
+        session_id = cursor.execute(
+            """
+INSERT INTO upload_sessions (
+    upload_id,
+    owner_id,
+    template_name,
+    filename,
+    content_type,
+    size,
+    hash,
+    chunk_size,
+    created_at,
+    expires_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+RETURNING id;
+""",
+            [
+                session.id,
+                session.owner_id,
+                session.template_name,
+                session.filename,
+                session.content_type,
+                session.size,
+                session.hash,
+                session.chunk_size,
+                session.created_at.isoformat(),
+                session.expires_at.isoformat(),
+            ],
+        ).fetchone()[0]
+
+        # Chunks that were already received by another upload of the same user are still stored, so they don't need
+        # to be sent again. Chunks received by other users still need to be sent, otherwise knowing the hash of a
+        # chunk would be enough to get a copy of it.
+        cursor.executemany(
+            """
+INSERT INTO upload_chunks (session_id, start, hash, received)
+VALUES (?, ?, ?, EXISTS(
+    SELECT 1
+    FROM upload_chunks c
+    JOIN upload_sessions s ON s.id=c.session_id
+    WHERE c.hash=? AND c.received=1 AND s.owner_id=?
+));
+""",
+            [[session_id, chunk.offset, chunk.hash, chunk.hash, session.owner_id] for chunk in session.chunks],
+        )
+        cursor.close()
+
+
+def get_upload_session(upload_id: str) -> UploadSession | None:
+    with pool.read() as db:
+        cursor = db.cursor()
+        row = cursor.execute("SELECT * FROM upload_sessions WHERE upload_id=?", [upload_id]).fetchone()
+
+        chunks = []
+
+        if row:
+            chunks = cursor.execute(
+                "SELECT start, hash, received FROM upload_chunks WHERE session_id=? ORDER BY start",
+                [row["id"]],
+            ).fetchall()
+
+        cursor.close()
+
+    if row is None:
+        return None
+
+    return UploadSession(
+        id=row["upload_id"],
+        owner_id=row["owner_id"],
+        template_name=row["template_name"],
+        filename=row["filename"],
+        content_type=row["content_type"],
+        size=row["size"],
+        hash=row["hash"],
+        chunk_size=row["chunk_size"],
+        created_at=datetime.fromisoformat(row["created_at"]),
+        expires_at=datetime.fromisoformat(row["expires_at"]),
+        chunks=[
+            UploadChunk(
+                offset=chunk["start"],
+                size=min(row["chunk_size"], row["size"] - chunk["start"]),
+                hash=chunk["hash"],
+                received=bool(chunk["received"]),
+            )
+            for chunk in chunks
+        ],
+    )
+
+
+def mark_upload_chunks_received(upload_id: str, chunk_hash: str, *, received: bool = True) -> None:
+    # A file can contain the same chunk more than once, so every chunk with this hash is updated
+    sql = """
+UPDATE upload_chunks
+SET received=?
+WHERE session_id=(SELECT id FROM upload_sessions WHERE upload_id=?) AND hash=?;
+"""
+
+    with pool.write() as db:
+        cursor = db.cursor()
+        cursor.execute(sql, [int(received), upload_id, chunk_hash])
+        cursor.close()
+
+
+def delete_upload_session(upload_id: str) -> list[str]:
+    # Returns the hashes of the chunks that are no longer used by any other upload, and can be deleted
+    with pool.write() as db:
+        cursor = db.cursor()
+
+        rows = cursor.execute(
+            """
+DELETE FROM upload_chunks
+WHERE session_id=(SELECT id FROM upload_sessions WHERE upload_id=?)
+RETURNING hash;
+""",
+            [upload_id],
+        ).fetchall()
+
+        cursor.execute("DELETE FROM upload_sessions WHERE upload_id=?", [upload_id])
+
+        chunk_hashes = {row["hash"] for row in rows}
+
+        unused = [
+            chunk_hash
+            for chunk_hash in sorted(chunk_hashes)
+            if not cursor.execute("SELECT 1 FROM upload_chunks WHERE hash=? AND received=1", [chunk_hash]).fetchone()
+        ]
+
+        cursor.close()
+
+    return unused
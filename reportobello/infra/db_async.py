@@ -0,0 +1,55 @@
+import functools
+from collections.abc import Callable, Coroutine
+
+from reportobello.infra import db
+from reportobello.infra.job_queue import JobQueue
+
+# Async versions of the functions in reportobello.infra.db. Queries run in a dedicated thread pool so that
+# slow queries don't block the event loop. The sync versions are still used by scripts and startup code.
+#
+# There is one thread per reader, plus one for the writer. Any more threads would just wait for a connection.
+DB_QUEUE = JobQueue("db", max_workers=db.pool.reader_count + 1)
+
+
+def to_async[RType, **Args](f: Callable[Args, RType]) -> Callable[Args, Coroutine[None, None, RType]]:
+    @functools.wraps(f)
+    async def wrapper(*args: Args.args, **kwargs: Args.kwargs) -> RType:
+        return await DB_QUEUE.run(f, *args, **kwargs)
+
+    return wrapper
+
+
+create_or_update_user = to_async(db.create_or_update_user)
+get_user_by_api_key = to_async(db.get_user_by_api_key)
+get_user_by_user_id = to_async(db.get_user_by_user_id)
+get_user_by_provider_id = to_async(db.get_user_by_provider_id)
+check_template_exists_for_user = to_async(db.check_template_exists_for_user)
+get_all_template_versions_for_user = to_async(db.get_all_template_versions_for_user)
+get_template_for_user = to_async(db.get_template_for_user)
+get_latest_template_version_for_user = to_async(db.get_latest_template_version_for_user)
+get_all_templates_for_user = to_async(db.get_all_templates_for_user)
+create_or_update_template_for_user = to_async(db.create_or_update_template_for_user)
+delete_template_for_user = to_async(db.delete_template_for_user)
+save_recent_report_build_for_user = to_async(db.save_recent_report_build_for_user)
+get_recent_report_builds_for_user = to_async(db.get_recent_report_builds_for_user)
+get_report_data_for_user = to_async(db.get_report_data_for_user)
+get_cached_report_by_cache_key = to_async(db.get_cached_report_by_cache_key)
+create_build_job = to_async(db.create_build_job)
+get_build_job = to_async(db.get_build_job)
+claim_build_job = to_async(db.claim_build_job)
+renew_build_job_lease = to_async(db.renew_build_job_lease)
+finish_build_job = to_async(db.finish_build_job)
+cancel_build_job = to_async(db.cancel_build_job)
+save_new_user_survey = to_async(db.save_new_user_survey)
+get_env_vars_for_user = to_async(db.get_env_vars_for_user)
+update_env_vars_for_user = to_async(db.update_env_vars_for_user)
+delete_env_vars_for_user = to_async(db.delete_env_vars_for_user)
+save_file_metadata = to_async(db.save_file_metadata)
+check_file_uploaded_by_user = to_async(db.check_file_uploaded_by_user)
+get_files_for_template = to_async(db.get_files_for_template)
+get_file_for_template = to_async(db.get_file_for_template)
+delete_file_for_template = to_async(db.delete_file_for_template)
+create_upload_session = to_async(db.create_upload_session)
+get_upload_session = to_async(db.get_upload_session)
+mark_upload_chunks_received = to_async(db.mark_upload_chunks_received)
+delete_upload_session = to_async(db.delete_upload_session)
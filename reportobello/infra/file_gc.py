@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import re
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime, timedelta
+
+from opentelemetry import metrics, trace
+
+from reportobello.config import FILE_GC_DRY_RUN, FILE_GC_GRACE_PERIOD_IN_SECONDS, FILE_GC_INTERVAL_IN_SECONDS
+from reportobello.infra import db
+from reportobello.infra.artifacts import ARTIFACTS, ArtifactStore, get_chunk_artifact_key, get_file_artifact_key
+from reportobello.infra.db_async import DB_QUEUE
+
+tracer = trace.get_tracer("reportobello")
+meter = metrics.get_meter("reportobello")
+logger = logging.getLogger("reportobello")
+
+# Max number of rows/files looked at in a single database query or store request
+BATCH_SIZE = 1000
+
+FILE_ARTIFACT_KEY = re.compile(r"files/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]+)")
+
+DELETED_COUNT = meter.create_counter(
+    "reportobello.file_gc.files_deleted",
+    description="Number of uploaded files removed from the artifact store by the garbage collector",
+)
+
+_background_task = None
+
+
+@dataclass(kw_only=True)
+class GarbageReport:
+    # When dry_run is set nothing is deleted, and the counts are what would have been deleted
+    dry_run: bool
+
+    # Uploads that belong to a template that no longer exists
+    orphaned_uploads: int = 0
+
+    # Resumable uploads that were never completed, and the chunks that were only used by them
+    expired_uploads: int = 0
+    deleted_chunks: int = 0
+
+    # Files that are no longer used by any upload. These are only deleted once they have been unused for longer
+    # than the grace period, since the same file might be uploaded again in the meantime.
+    unreferenced_files: int = 0
+    deleted_files: int = 0
+    deleted_bytes: int = 0
+
+    # Files in the artifact store that the database doesn't know about
+    stray_files: int = 0
+
+    # Files in the database that are missing from the artifact store. These are removed from the database,
+    # since they can't be used in builds anyways.
+    missing_files: int = 0
+
+
+def periodically_collect_garbage() -> None:
+    async def loop() -> None:
+        while True:
+            with tracer.start_as_current_span("collect garbage"):
+                try:
+                    report = await collect_garbage(dry_run=FILE_GC_DRY_RUN)
+
+                    logger.info("collected garbage", extra=asdict(report))
+
+                except Exception:
+                    logger.exception("could not collect garbage")
+
+            await asyncio.sleep(FILE_GC_INTERVAL_IN_SECONDS)
+
+    global _background_task
+    _background_task = asyncio.create_task(loop())
+
+
+async def collect_garbage(
+    *,
+    store: ArtifactStore = ARTIFACTS,
+    grace_period: timedelta = timedelta(seconds=FILE_GC_GRACE_PERIOD_IN_SECONDS),
+    dry_run: bool = False,
+) -> GarbageReport:
+    """
+    Mark and sweep uploaded files: uploads are linked to a file by its hash (file_hashes), and each file is stored
+    once in **store** no matter how many uploads use it. Files are marked as orphaned once no upload uses them, and
+    are deleted once they have been orphaned for longer than **grace_period**. Afterwards, the files in **store** are
+    compared against the database to find any files that only exist in one of them. Chunks of resumable uploads
+    that expired before being completed are deleted as well.
+
+    Everything is done in batches, so the database is never locked for long, and the whole file list is never loaded
+    into memory.
+    """
+
+    report = GarbageReport(dry_run=dry_run)
+    now = datetime.now(tz=UTC)
+
+    with tracer.start_as_current_span("remove orphaned uploads"):
+        async for start, end in get_id_ranges("uploaded_files"):
+            report.orphaned_uploads += await DB_QUEUE.run(remove_orphaned_uploads, start, end, dry_run=dry_run)
+
+    with tracer.start_as_current_span("remove expired uploads"):
+        async for start, end in get_id_ranges("upload_sessions"):
+            expired, chunk_hashes = await DB_QUEUE.run(remove_expired_uploads, start, end, now=now, dry_run=dry_run)
+
+            report.expired_uploads += expired
+            report.deleted_chunks += len(chunk_hashes)
+
+            if chunk_hashes:
+                await store.delete_many([get_chunk_artifact_key(chunk_hash) for chunk_hash in chunk_hashes])
+
+                DELETED_COUNT.add(len(chunk_hashes), {"reason": "expired_upload"})
+
+    with tracer.start_as_current_span("remove unreferenced files"):
+        async for start, end in get_id_ranges("file_hashes"):
+            unreferenced, deleted = await DB_QUEUE.run(
+                remove_unreferenced_files, start, end, now=now, cutoff=now - grace_period, dry_run=dry_run
+            )
+
+            if deleted and not dry_run:
+                # The rows are deleted first, so a file that is uploaded again from now on gets a new row. Files that
+                # were uploaded again since their rows were deleted re-use the stored file, so it must be kept.
+                uploaded_again = await DB_QUEUE.run(get_existing_file_hashes, [file_hash for file_hash, _ in deleted])
+                deleted = [(file_hash, size) for file_hash, size in deleted if file_hash not in uploaded_again]
+
+                await store.delete_many([get_file_artifact_key(file_hash) for file_hash, _ in deleted])
+
+                DELETED_COUNT.add(len(deleted), {"reason": "unreferenced"})
+
+            report.unreferenced_files += unreferenced
+            report.deleted_files += len(deleted)
+            report.deleted_bytes += sum(size for _, size in deleted)
+
+    with tracer.start_as_current_span("reconcile files"):
+        await reconcile_files(store, report, cutoff=now - grace_period)
+
+    return report
+
+
+async def reconcile_files(store: ArtifactStore, report: GarbageReport, *, cutoff: datetime) -> None:
+    # Both the store and the database are iterated in hash order, so they can be compared one file at a time
+    hashes = get_all_file_hashes()
+    expected = await anext(hashes, None)
+
+    stray: list[str] = []
+    missing: list[str] = []
+
+    async for artifact in store.list("files/"):
+        match = FILE_ARTIFACT_KEY.fullmatch(artifact.key)
+        file_hash = "".join(match.groups()) if match else None
+
+        while file_hash and expected is not None and expected < file_hash:
+            missing.append(expected)
+            expected = await anext(hashes, None)
+
+        if file_hash and file_hash == expected:
+            expected = await anext(hashes, None)
+
+        # Recently stored files might not have been saved to the database yet
+        elif artifact.modified_at < cutoff:
+            stray.append(artifact.key)
+
+        if len(stray) >= BATCH_SIZE:
+            await remove_stray_files(store, stray, report)
+            stray = []
+
+        if len(missing) >= BATCH_SIZE:
+            await remove_missing_files(store, missing, report)
+            missing = []
+
+    while expected is not None:
+        missing.append(expected)
+        expected = await anext(hashes, None)
+
+        if len(missing) >= BATCH_SIZE:
+            await remove_missing_files(store, missing, report)
+            missing = []
+
+    await remove_stray_files(store, stray, report)
+    await remove_missing_files(store, missing, report)
+
+
+async def remove_stray_files(store: ArtifactStore, keys: list[str], report: GarbageReport) -> None:
+    if not keys:
+        return
+
+    report.stray_files += len(keys)
+
+    if not report.dry_run:
+        await store.delete_many(keys)
+
+        DELETED_COUNT.add(len(keys), {"reason": "stray"})
+
+
+async def remove_missing_files(store: ArtifactStore, hashes: list[str], report: GarbageReport) -> None:
+    # Files uploaded while the store was being listed show up as missing, so check again before removing them
+    missing = [file_hash for file_hash in hashes if not await store.exists(get_file_artifact_key(file_hash))]
+
+    if not missing:
+        return
+
+    logger.warning("uploaded files are missing from artifact store", extra={"count": len(missing)})
+
+    report.missing_files += len(missing)
+
+    if not report.dry_run:
+        await DB_QUEUE.run(forget_missing_files, missing)
+
+
+async def get_id_ranges(table: str) -> AsyncIterator[tuple[int, int]]:
+    # Split the ids of table into ranges of at most BATCH_SIZE rows, as (exclusive start, inclusive end) pairs
+    start = 0
+
+    while (end := await DB_QUEUE.run(get_id_range_end, table, start)) is not None:
+        yield start, end
+
+        start = end
+
+
+def get_id_range_end(table: str, start: int) -> int | None:
+    # table is never user input
+    sql = f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)"  # noqa: S608
+
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        end: int | None = cursor.execute(sql, [start, BATCH_SIZE]).fetchone()[0]
+        cursor.close()
+
+    return end
+
+
+def remove_orphaned_uploads(start: int, end: int, *, dry_run: bool) -> int:
+    # Deleting a template deletes its uploads, so this only finds uploads left behind by older versions
+    where = """
+WHERE
+    id > ? AND id <= ?
+    AND NOT EXISTS(
+        SELECT 1 FROM templates t
+        WHERE t.owner_id=uploaded_files.uploaded_by_user_id AND t.name=uploaded_files.template_name
+    )
+"""
+
+    with db.pool.write() as conn:
+        cursor = conn.cursor()
+
+        if dry_run:
+            count: int = cursor.execute(f"SELECT COUNT(*) FROM uploaded_files {where}", [start, end]).fetchone()[0]  # noqa: S608
+
+        else:
+            count = cursor.execute(f"DELETE FROM uploaded_files {where}", [start, end]).rowcount  # noqa: S608
+
+        cursor.close()
+
+    return count
+
+
+def remove_expired_uploads(start: int, end: int, *, now: datetime, dry_run: bool) -> tuple[int, list[str]]:
+    # Return the number of expired uploads in the range, and the hashes of the chunks that are no longer used
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        rows = cursor.execute(
+            "SELECT upload_id FROM upload_sessions WHERE id > ? AND id <= ? AND expires_at < ?",
+            [start, end, now.isoformat()],
+        ).fetchall()
+        cursor.close()
+
+    if dry_run:
+        return len(rows), []
+
+    chunk_hashes = [chunk_hash for row in rows for chunk_hash in db.delete_upload_session(row["upload_id"])]
+
+    return len(rows), chunk_hashes
+
+
+def remove_unreferenced_files(
+    start: int, end: int, *, now: datetime, cutoff: datetime, dry_run: bool
+) -> tuple[int, list[tuple[str, int]]]:
+    # Return the number of unreferenced files in the range, and the (hash, size) of the files that were deleted
+    where = """
+WHERE
+    id > ? AND id <= ?
+    AND NOT EXISTS(SELECT 1 FROM uploaded_files WHERE file_id=file_hashes.id)
+"""
+
+    with db.pool.write() as conn:
+        cursor = conn.cursor()
+
+        count: int = cursor.execute(f"SELECT COUNT(*) FROM file_hashes {where}", [start, end]).fetchone()[0]  # noqa: S608
+
+        if dry_run:
+            rows = cursor.execute(
+                f"SELECT hash, size FROM file_hashes {where} AND orphaned_at < ?",  # noqa: S608
+                [start, end, cutoff.isoformat()],
+            ).fetchall()
+
+        else:
+            cursor.execute(
+                f"UPDATE file_hashes SET orphaned_at=? {where} AND orphaned_at IS NULL",  # noqa: S608
+                [now.isoformat(), start, end],
+            )
+
+            rows = cursor.execute(
+                f"DELETE FROM file_hashes {where} AND orphaned_at < ? RETURNING hash, size",  # noqa: S608
+                [start, end, cutoff.isoformat()],
+            ).fetchall()
+
+        cursor.close()
+
+    return count, [(row["hash"], row["size"]) for row in rows]
+
+
+def get_existing_file_hashes(hashes: list[str]) -> set[str]:
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        existing = {
+            file_hash
+            for file_hash in hashes
+            if cursor.execute("SELECT 1 FROM file_hashes WHERE hash=?", [file_hash]).fetchone()
+        }
+        cursor.close()
+
+    return existing
+
+
+async def get_all_file_hashes() -> AsyncIterator[str]:
+    after = ""
+
+    while hashes := await DB_QUEUE.run(get_file_hashes, after=after):
+        for file_hash in hashes:
+            yield file_hash
+
+        after = hashes[-1]
+
+
+def get_file_hashes(*, after: str) -> list[str]:
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        rows = cursor.execute(
+            "SELECT hash FROM file_hashes WHERE hash > ? ORDER BY hash LIMIT ?",
+            [after, BATCH_SIZE],
+        ).fetchall()
+        cursor.close()
+
+    return [row["hash"] for row in rows]
+
+
+def forget_missing_files(hashes: list[str]) -> None:
+    with db.pool.write() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "DELETE FROM uploaded_files WHERE file_id IN (SELECT id FROM file_hashes WHERE hash=?)",
+            [[file_hash] for file_hash in hashes],
+        )
+        cursor.executemany("DELETE FROM file_hashes WHERE hash=?", [[file_hash] for file_hash in hashes])
+        cursor.close()
@@ -1,26 +1,62 @@
 import asyncio
+import contextvars
 import os
+import time
 from collections.abc import Callable
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from opentelemetry import metrics
 
-class JobQueue(ThreadPool):
-    def __init__(self) -> None:
+meter = metrics.get_meter("reportobello")
+
+QUEUE_DEPTH = meter.create_up_down_counter(
+    "reportobello.job_queue.depth",
+    description="Number of jobs waiting for a thread to become available",
+)
+QUEUE_WAIT_TIME = meter.create_histogram(
+    "reportobello.job_queue.wait_time",
+    unit="s",
+    description="Time spent waiting for a thread to become available",
+)
+
+
+class JobQueue(ThreadPoolExecutor):
+    def __init__(self, name: str = "jobs", max_workers: int | None = None) -> None:
         # See https://stackoverflow.com/a/55423170
         # This number can probably be optimized, but is good enough for now
         core_count = len(os.sched_getaffinity(0))
 
-        super().__init__(core_count * 2)
+        super().__init__(max_workers or core_count * 2, thread_name_prefix=name)
+
+        self.attributes = {"queue": name}
 
     async def run[RType, **Args](
         self,
         f: Callable[Args, RType],
         *args: Args.args,
-        **_: Args.kwargs,
+        **kwargs: Args.kwargs,
     ) -> RType:
-        task = self.apply_async(f, args)
+        """
+        Run **f** in a background thread. If the calling task is cancelled before the job is started,
+        the job is removed from the queue. Jobs that have already started will run to completion.
+        """
+
+        queued_at = time.perf_counter()
+
+        def job() -> RType:
+            QUEUE_DEPTH.add(-1, self.attributes)
+            QUEUE_WAIT_TIME.record(time.perf_counter() - queued_at, self.attributes)
+
+            return f(*args, **kwargs)
+
+        QUEUE_DEPTH.add(1, self.attributes)
+
+        # Copy the context so that tracing spans started in the job are nested under the caller's span
+        future = self.submit(contextvars.copy_context().run, job)
+        future.add_done_callback(self._on_done)
 
-        while not task.ready():  # noqa: ASYNC110
-            await asyncio.sleep(0.01)
+        return await asyncio.wrap_future(future)
 
-        return task.get()
+    def _on_done[RType](self, future: Future[RType]) -> None:
+        if future.cancelled():
+            QUEUE_DEPTH.add(-1, self.attributes)
@@ -2,9 +2,12 @@ import logging
 import os
 
 from fastapi import FastAPI
-from opentelemetry import trace
+from opentelemetry import metrics, trace
+from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
@@ -29,3 +32,19 @@ def setup_otel_tracing(app: FastAPI) -> None:
     trace.set_tracer_provider(trace_provider)
 
     FastAPIInstrumentor().instrument_app(app)
+
+
+def setup_otel_metrics() -> None:
+    metrics_endpoint = os.getenv("REPORTOBELLO_OTEL_METRICS_ENDPOINT", "")
+    if not metrics_endpoint:
+        logger.warning(
+            "Could not find REPORTOBELLO_OTEL_METRICS_ENDPOINT env var, Open Telemetry metrics will be disabled"
+        )
+        return
+
+    metric_reader = PeriodicExportingMetricReader(OTLPMetricExporter(endpoint=metrics_endpoint))
+
+    resource = Resource(attributes={SERVICE_NAME: "reportobello"})
+
+    meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+    metrics.set_meter_provider(meter_provider)
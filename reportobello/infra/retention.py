@@ -1,26 +1,52 @@
 import asyncio
 import logging
+import time
+from collections.abc import Iterable
 from datetime import UTC, datetime
 
-from opentelemetry import trace
+from opentelemetry import metrics, trace
+from opentelemetry.metrics import CallbackOptions, Observation
 
-from reportobello.config import PDF_ARTIFACT_DIR
-from reportobello.infra.db import db
+from reportobello.infra import db
+from reportobello.infra.artifacts import ARTIFACTS, get_pdf_artifact_key
+from reportobello.infra.db_async import DB_QUEUE
 
 tracer = trace.get_tracer("reportobello")
+meter = metrics.get_meter("reportobello")
 logger = logging.getLogger("reportobello")
 
 
 TASK_DELAY_IN_SECONDS = 60
 
+# Max number of files removed at once. Keeps each database query (and the memory needed for it) bounded, no matter
+# how many files have expired since the last sweep.
+BATCH_SIZE = 1000
+
+SWEEP_DURATION = meter.create_histogram(
+    "reportobello.retention.sweep_duration",
+    unit="s",
+    description="Time taken to remove every expired file",
+)
+DELETED_COUNT = meter.create_counter(
+    "reportobello.retention.files_deleted",
+    description="Number of expired files that have been deleted",
+)
+
 _background_task = None
+_backlog = 0
 
 
 def periodically_remove_expired_data() -> None:
     async def loop() -> None:
         while True:
             with tracer.start_as_current_span("remove expired files") as span:
-                remove_expired_files(span)
+                # Errors (ie, the artifact store being unavailable) are retried on the next sweep, instead of
+                # stopping the background task for good
+                try:
+                    await remove_expired_files(span)
+
+                except Exception:
+                    logger.exception("could not remove expired files")
 
             await asyncio.sleep(TASK_DELAY_IN_SECONDS)
 
@@ -28,35 +54,86 @@ def periodically_remove_expired_data() -> None:
     _background_task = asyncio.create_task(loop())
 
 
-def remove_expired_files(span: trace.Span) -> None:
-    now = datetime.now(tz=UTC).isoformat()
+async def remove_expired_files(span: trace.Span) -> None:
+    global _backlog
+
+    started_at = time.perf_counter()
+    now = datetime.now(tz=UTC)
+
+    _backlog = await DB_QUEUE.run(count_expired_files, now=now)
+
+    # Files that expire after the sweep starts are left for the next sweep, so a steady stream of expiring files
+    # can't keep the sweep running forever
+    after = None
+    count = 0
+
+    while rows := await DB_QUEUE.run(get_expired_files, now=now, after=after, limit=BATCH_SIZE):
+        if not count:
+            logger.info("deleting files", extra={"count": _backlog})
+
+        await ARTIFACTS.delete_many([get_pdf_artifact_key(filename) for _, _, filename in rows])
+
+        await DB_QUEUE.run(forget_expired_files, [report_id for report_id, _, _ in rows])
+
+        count += len(rows)
+        _backlog = max(_backlog - len(rows), 0)
+        DELETED_COUNT.add(len(rows))
+
+        report_id, expires_at, _ = rows[-1]
+        after = (expires_at, report_id)
+
+    span.set_attribute(key="files_deleted", value=count)
+
+    SWEEP_DURATION.record(time.perf_counter() - started_at)
+
+
+def count_expired_files(*, now: datetime) -> int:
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        count: int = cursor.execute(
+            "SELECT COUNT(*) FROM reports WHERE filename IS NOT NULL AND expires_at < ?",
+            [now.isoformat()],
+        ).fetchone()[0]
+        cursor.close()
+
+    return count
+
+
+def get_expired_files(*, now: datetime, after: tuple[str, int] | None, limit: int) -> list[tuple[int, str, str]]:
+    # Returns (id, expires_at, filename) for the next batch of expired files, oldest first. after is the
+    # (expires_at, id) of the last file in the previous batch, since files that could not be forgotten would
+    # otherwise be returned again.
+    expires_at, report_id = after or ("", 0)
 
     sql = """
-SELECT id, filename
+SELECT id, expires_at, filename
 FROM reports
-WHERE filename IS NOT NULL AND ? > expires_at
+WHERE filename IS NOT NULL AND expires_at < ? AND (expires_at, id) > (?, ?)
+ORDER BY expires_at, id
+LIMIT ?
 """
 
-    cursor = db.cursor()
-    rows = cursor.execute(sql, [now]).fetchall()
-    cursor.close()
+    with db.pool.read() as conn:
+        cursor = conn.cursor()
+        rows = cursor.execute(sql, [now.isoformat(), expires_at, report_id, limit]).fetchall()
+        cursor.close()
 
-    count = len(rows)
+    return [(row["id"], row["expires_at"], row["filename"]) for row in rows]
 
-    span.set_attribute(key="files_deleted", value=count)
 
-    if count == 0:
-        return
+def forget_expired_files(ids: list[int]) -> None:
+    with db.pool.write() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("UPDATE reports SET filename=NULL WHERE id=?", [[report_id] for report_id in ids])
+        cursor.close()
 
-    logger.info("deleting files", extra={"count": count})
 
-    for row in rows:
-        (PDF_ARTIFACT_DIR / row["filename"]).unlink(missing_ok=True)
+def _observe_backlog(_: CallbackOptions) -> Iterable[Observation]:
+    return [Observation(_backlog)]
 
-    # This is safe because the "id" field is an integer, which cannot contain strings
-    inner = ",".join(str(int(row["id"])) for row in rows)
 
-    cursor = db.cursor()
-    cursor.execute(f"UPDATE reports SET filename=NULL WHERE id IN ({inner})")  # noqa: S608
-    db.commit()
-    cursor.close()
+meter.create_observable_gauge(
+    "reportobello.retention.backlog",
+    callbacks=[_observe_backlog],
+    description="Number of expired files that have not been deleted yet, as of the last sweep",
+)
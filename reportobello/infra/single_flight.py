@@ -0,0 +1,65 @@
+import asyncio
+from collections.abc import Callable, Coroutine
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter("reportobello")
+
+COALESCED_COUNT = meter.create_counter(
+    "reportobello.single_flight.coalesced",
+    description="Number of calls that waited on an identical in-flight call instead of starting a new one",
+)
+
+
+class _Flight[T]:
+    def __init__(self, task: asyncio.Task[T]) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight[T]:
+    """
+    Deduplicate concurrent calls with the same key. The first caller starts the call, and anyone
+    calling with the same key while it is still running waits for (and shares) the same result.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.attributes = {"name": name}
+
+        self._flights: dict[str, _Flight[T]] = {}
+
+    async def run(self, key: str, f: Callable[[], Coroutine[None, None, T]]) -> T:
+        """
+        Run **f**, or wait for the in-flight call for **key** if there is one. The call is only cancelled
+        once every caller waiting on it has been cancelled.
+        """
+
+        flight = self._flights.get(key)
+
+        if flight is None:
+            flight = _Flight(asyncio.create_task(f()))
+            self._flights[key] = flight
+
+            flight.task.add_done_callback(lambda _: self._remove(key, flight))
+
+        else:
+            COALESCED_COUNT.add(1, self.attributes)
+
+        flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+
+        finally:
+            flight.waiters -= 1
+
+            if flight.waiters == 0 and not flight.task.done():
+                # The call can take a while to finish once cancelled, so new callers need to start a new call
+                # instead of joining (and being cancelled along with) this one
+                self._remove(key, flight)
+
+                flight.task.cancel()
+
+    def _remove(self, key: str, flight: _Flight[T]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
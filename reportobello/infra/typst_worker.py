@@ -0,0 +1,183 @@
+import logging
+import os
+import queue
+import subprocess
+import sys
+from multiprocessing.connection import Connection
+from pathlib import Path
+
+import typst
+
+logger = logging.getLogger("reportobello")
+
+CompileResult = tuple[int, str]
+CompileJob = tuple[str, str, dict[str, str], str | None]
+
+# Connection is only generic when type checking, so these need to be lazily evaluated
+type JobConnection = Connection[CompileJob, CompileJob]
+type ResultConnection = Connection[CompileResult, CompileResult]
+
+
+class TypstWorker:
+    """
+    A long-lived compiler process. Starting the compiler (font discovery, package resolution, etc.)
+    is much slower than compiling a small report, so the compiler state is kept warm across builds.
+    """
+
+    def __init__(self) -> None:
+        job_reader, job_writer = os.pipe()
+        result_reader, result_writer = os.pipe()
+
+        self.process = subprocess.Popen(  # noqa: S603
+            [sys.executable, "-m", "reportobello.infra.typst_worker", str(job_reader), str(result_writer)],
+            pass_fds=(job_reader, result_writer),
+            stdin=subprocess.DEVNULL,
+        )
+
+        os.close(job_reader)
+        os.close(result_writer)
+
+        self.jobs: JobConnection = Connection(job_writer, readable=False)
+        self.results: ResultConnection = Connection(result_reader, writable=False)
+        self.builds = 0
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self) -> None:
+        self.jobs.close()
+        self.results.close()
+
+        self.process.kill()
+        self.process.wait()
+
+
+class TypstWorkerPool:
+    def __init__(self, size: int, *, max_builds_per_worker: int, build_timeout: float) -> None:
+        self.max_builds_per_worker = max_builds_per_worker
+        self.build_timeout = build_timeout
+
+        # Workers are started lazily, so an empty slot is represented as None
+        self._slots = queue.SimpleQueue[TypstWorker | None]()
+
+        for _ in range(size):
+            self._slots.put(None)
+
+    def compile(self, file: str, output: str, inputs: dict[str, str], *, query: str | None = None) -> CompileResult:
+        """
+        Compile a Typst file using the next available worker. This blocks until a worker is available,
+        and is expected to be called from a thread pool.
+
+        If **query** is set, it is evaluated against the compiled document, and the JSON result is returned
+        instead of an empty string when the build succeeds.
+        """
+
+        worker = self._slots.get()
+        result = None
+
+        # The slot is always given back, even if the build is cancelled or fails in an unexpected way, otherwise the
+        # pool would slowly run out of slots
+        try:
+            worker = ensure_alive(worker)
+            result, error = self._run(worker, (file, output, inputs, query))
+
+        except BaseException:
+            # The worker might be in the middle of a build, so it can't be re-used
+            if worker:
+                worker.stop()
+                worker = None
+
+            raise
+
+        finally:
+            # Recycle workers periodically to keep memory usage (caches, fragmentation, etc.) in check
+            if worker and (result is None or worker.builds >= self.max_builds_per_worker):
+                worker.stop()
+                worker = None
+
+            self._slots.put(worker)
+
+        return result or (1, error)
+
+    def _run(self, worker: TypstWorker, job: CompileJob) -> tuple[CompileResult | None, str]:
+        # Returns the result along with the error to use if there is no result
+        try:
+            result = self._compile(worker, job)
+
+        except (EOFError, OSError):
+            logger.exception("typst worker crashed", extra={"pid": worker.process.pid})
+
+            return None, "error: compiler crashed unexpectedly"
+
+        if result is None:
+            logger.warning("typst worker timed out", extra={"pid": worker.process.pid})
+
+        return result, f"error: build timed out after {self.build_timeout:g} seconds"
+
+    def _compile(self, worker: TypstWorker, job: CompileJob) -> CompileResult | None:
+        worker.jobs.send(job)
+
+        if not worker.results.poll(self.build_timeout):
+            return None
+
+        worker.builds += 1
+
+        return worker.results.recv()
+
+    def close(self) -> None:
+        while True:
+            try:
+                worker = self._slots.get_nowait()
+
+            except queue.Empty:
+                return
+
+            if worker:
+                worker.stop()
+
+
+def ensure_alive(worker: TypstWorker | None) -> TypstWorker:
+    if worker and worker.is_alive:
+        return worker
+
+    if worker:
+        # Close the pipes and reap the process of the crashed worker before replacing it
+        worker.stop()
+
+    return TypstWorker()
+
+
+def run_worker(jobs: JobConnection, results: ResultConnection) -> None:
+    font_paths = [p for p in os.getenv("TYPST_FONT_PATHS", "").split(os.pathsep) if p]
+
+    compiler = typst.Compiler(font_paths=font_paths)
+
+    while True:
+        try:
+            file, output, inputs, query = jobs.recv()
+
+        except EOFError:
+            # Parent process has exited or closed the pipe
+            return
+
+        root = str(Path(file).parent)
+
+        try:
+            compiler.compile(input=file, output=output, root=root, sys_inputs=inputs)
+
+            # Evaluating right after compiling re-uses the cached layout, so this is almost free
+            stdout = compiler.eval(query, format="json", root=root) if query else ""
+
+        except typst.TypstError as ex:
+            results.send((1, ex.diagnostic or str(ex)))
+
+        else:
+            results.send((0, stdout))
+
+
+if __name__ == "__main__":
+    run_worker(
+        Connection(int(sys.argv[1]), writable=False),
+        Connection(int(sys.argv[2]), readable=False),
+    )
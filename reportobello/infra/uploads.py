@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from secrets import token_urlsafe
+from typing import BinaryIO
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.datastructures import Headers
+
+
+class UploadRejected(Exception):
+    def __init__(self, msg: str, *, status_code: int) -> None:
+        super().__init__(msg)
+
+        self.status_code = status_code
+
+
+@dataclass(kw_only=True)
+class UploadedFile:
+    field_name: str
+    filename: str | None
+    content_type: str | None
+    size: int
+    hash: str
+
+    # Temporary file containing the uploaded file, which is deleted once the caller asks for the next file.
+    # To keep it, move it somewhere else before then.
+    path: Path
+
+
+@dataclass(kw_only=True)
+class ReceivedBody:
+    size: int
+    hash: str
+
+    # Temporary file containing the request body, which is deleted once the caller is done with it
+    path: Path
+
+
+@dataclass(kw_only=True)
+class _TempFile:
+    path: Path
+    file: BinaryIO
+    size: int = 0
+    hasher: "hashlib._Hash" = field(default_factory=hashlib.sha3_512)
+
+    def write(self, data: bytes) -> None:
+        # Called from a thread, since hashing large files is slow
+        self.hasher.update(data)
+        self.file.write(data)
+
+
+@dataclass(kw_only=True)
+class _Part(_TempFile):
+    field_name: str
+    filename: str | None
+    content_type: str | None
+
+    def to_uploaded_file(self) -> UploadedFile:
+        return UploadedFile(
+            field_name=self.field_name,
+            filename=self.filename,
+            content_type=self.content_type,
+            size=self.size,
+            hash=self.hasher.hexdigest().lower(),
+            path=self.path,
+        )
+
+
+class MultipartEvents:
+    """
+    Wrapper around the python-multipart parser, which reports what was parsed using callbacks. The callbacks can't
+    do any async work, so instead the events are collected and returned once each chunk has been parsed.
+
+    Events are either a dict of part headers (a new part is starting), part data (bytes), or None (the part ended).
+    """
+
+    def __init__(self, boundary: bytes) -> None:
+        self._events: list[dict[bytes, bytes] | bytes | None] = []
+        self._header_name = b""
+        self._headers: dict[bytes, bytes] = {}
+
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def feed(self, chunk: bytes) -> list[dict[bytes, bytes] | bytes | None]:
+        try:
+            self._parser.write(chunk)
+
+        except MultipartParseError as ex:
+            raise UploadRejected("Invalid multipart form", status_code=400) from ex
+
+        events, self._events = self._events, []
+
+        return events
+
+    def finalize(self) -> None:
+        self._parser.finalize()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end].lower()
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._headers[self._header_name] = self._headers.get(self._header_name, b"") + data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._header_name = b""
+
+    def _on_headers_finished(self) -> None:
+        self._events.append(self._headers)
+        self._headers = {}
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        # Consecutive data is merged so that each chunk is written using a single thread hop
+        if self._events and isinstance(self._events[-1], bytes):
+            self._events[-1] += data[start:end]
+
+        else:
+            self._events.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        self._events.append(None)
+
+
+async def receive_files(
+    headers: Headers,
+    stream: AsyncIterator[bytes],
+    *,
+    directory: Path,
+    max_file_size: int,
+    max_files: int,
+) -> AsyncGenerator[UploadedFile]:
+    # Receive the files in a multipart/form-data request body, yielding each file as soon as it has been received.
+    # Files are written to a temporary file in directory and hashed (SHA3-512) while they are being received, so
+    # they are never loaded into memory all at once. Files larger than max_file_size bytes are rejected as soon as
+    # the limit is reached, instead of after the whole file has been received.
+    #
+    # UploadRejected is raised if the body is invalid, or contains fields that aren't files, or too many files.
+
+    _, params = parse_options_header(headers.get("content-type", ""))
+
+    if b"boundary" not in params:
+        raise UploadRejected("Files must be uploaded as a multipart/form-data form", status_code=400)
+
+    parser = MultipartEvents(params[b"boundary"])
+
+    await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+
+    part: _Part | None = None
+    file_count = 0
+
+    try:
+        async for chunk in stream:
+            for event in parser.feed(chunk):
+                if isinstance(event, dict):
+                    file_count += 1
+
+                    if file_count > max_files:
+                        raise UploadRejected(f"Too many files, max is {max_files}", status_code=400)
+
+                    part = await begin_part(event, directory)
+
+                elif isinstance(event, bytes):
+                    assert part
+
+                    part.size += len(event)
+
+                    if part.size > max_file_size:
+                        raise UploadRejected("One or more files are too large", status_code=413)
+
+                    await asyncio.to_thread(part.write, event)
+
+                else:
+                    assert part
+
+                    await asyncio.to_thread(part.file.close)
+
+                    yield part.to_uploaded_file()
+
+                    await asyncio.to_thread(part.path.unlink, missing_ok=True)
+                    part = None
+
+        parser.finalize()
+
+    finally:
+        if part:
+            await asyncio.to_thread(part.file.close)
+            await asyncio.to_thread(part.path.unlink, missing_ok=True)
+
+
+async def begin_part(headers: dict[bytes, bytes], directory: Path) -> _Part:
+    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+
+    if b"name" not in options:
+        raise UploadRejected('The Content-Disposition header field "name" must be provided', status_code=400)
+
+    if b"filename" not in options:
+        raise UploadRejected("Only files can be uploaded", status_code=400)
+
+    content_type = headers.get(b"content-type")
+
+    path = get_temp_file_path(directory)
+
+    return _Part(
+        field_name=decode_header(options[b"name"]),
+        filename=decode_header(options[b"filename"]) or None,
+        content_type=decode_header(content_type) if content_type else None,
+        path=path,
+        file=await asyncio.to_thread(path.open, "xb"),
+    )
+
+
+@asynccontextmanager
+async def receive_body(
+    stream: AsyncIterator[bytes],
+    *,
+    directory: Path,
+    max_size: int,
+) -> AsyncGenerator[ReceivedBody]:
+    # Receive a raw request body into a temporary file in directory, hashing it (SHA3-512) while it is being received.
+    # The temporary file is deleted once the context exits. Bodies larger than max_size bytes are
+    # rejected as soon as the limit is reached.
+
+    await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+
+    path = get_temp_file_path(directory)
+    body = _TempFile(path=path, file=await asyncio.to_thread(path.open, "xb"))
+
+    try:
+        async for chunk in stream:
+            body.size += len(chunk)
+
+            if body.size > max_size:
+                raise UploadRejected("Chunk is too large", status_code=413)
+
+            await asyncio.to_thread(body.write, chunk)
+
+        await asyncio.to_thread(body.file.close)
+
+        yield ReceivedBody(size=body.size, hash=body.hasher.hexdigest().lower(), path=path)
+
+    finally:
+        await asyncio.to_thread(body.file.close)
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+
+
+def get_temp_file_path(directory: Path) -> Path:
+    return directory / f".upload-{token_urlsafe(16)}.tmp"
+
+
+def decode_header(value: bytes) -> str:
+    try:
+        return value.decode()
+
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
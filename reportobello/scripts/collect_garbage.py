@@ -0,0 +1,10 @@
+import asyncio
+import json
+import sys
+from dataclasses import asdict
+
+from reportobello.infra.file_gc import collect_garbage
+
+report = asyncio.run(collect_garbage(dry_run="--dry-run" in sys.argv))
+
+print(json.dumps(asdict(report), indent=2))  # noqa: T201
@@ -0,0 +1,14 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+# Config is read when reportobello is first imported, so this needs to be set before any tests are collected
+ARTIFACT_DIR = mkdtemp(prefix="reportobello-test-")
+
+os.environ.setdefault("REPORTOBELLO_DOMAIN", "localhost")
+os.environ.setdefault("REPORTOBELLO_RATE_LIMIT_DISABLED", "1")
+os.environ["REPORTOBELLO_ARTIFACT_DIR"] = ARTIFACT_DIR
+
+
+def pytest_unconfigure() -> None:
+    shutil.rmtree(ARTIFACT_DIR, ignore_errors=True)
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from reportobello.infra.admission import Admission, AdmissionRejected
+
+
+def make_admission(*, max_queue_length: int = 10, max_queue_per_user: int = 10, max_wait: float = 10) -> Admission:
+    return Admission(
+        1,
+        max_queue_length=max_queue_length,
+        max_queue_per_user=max_queue_per_user,
+        max_wait=max_wait,
+    )
+
+
+async def hold(admission: Admission, key: str, started: list[str], done: asyncio.Event) -> None:
+    async with admission.admit(key):
+        started.append(key)
+
+        await done.wait()
+
+
+async def test_slots_are_handed_out_round_robin_between_users() -> None:
+    admission = make_admission()
+    started: list[str] = []
+    done = asyncio.Event()
+
+    async with admission.admit("a"):
+        tasks = [asyncio.create_task(hold(admission, key, started, done)) for key in ["a", "a", "a", "b", "c"]]
+        await asyncio.sleep(0)
+
+        assert admission.waiting == len(tasks)
+
+    done.set()
+    await asyncio.gather(*tasks)
+
+    assert started == ["a", "b", "c", "a", "a"]
+    assert admission.running == 0
+    assert admission.waiting == 0
+
+
+async def test_builds_are_rejected_when_queue_is_full() -> None:
+    admission = make_admission(max_queue_length=2, max_queue_per_user=1)
+    done = asyncio.Event()
+
+    async with admission.admit("a"):
+        task = asyncio.create_task(hold(admission, "a", [], done))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as ex:
+            async with admission.admit("a"):
+                pass
+
+        assert ex.value.status_code == 429
+        assert ex.value.retry_after >= 1
+
+        task2 = asyncio.create_task(hold(admission, "b", [], done))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as ex:
+            async with admission.admit("c"):
+                pass
+
+        assert ex.value.status_code == 503
+
+    done.set()
+    await asyncio.gather(task, task2)
+
+    assert admission.running == 0
+    assert admission.waiting == 0
+
+
+async def test_builds_that_wait_too_long_are_rejected() -> None:
+    admission = make_admission(max_wait=0.01)
+
+    async with admission.admit("a"):
+        with pytest.raises(AdmissionRejected) as ex:
+            async with admission.admit("b"):
+                pass
+
+        assert ex.value.status_code == 503
+        assert admission.waiting == 0
+
+    assert admission.running == 0
+
+
+async def test_cancelled_waiters_are_removed_from_queue() -> None:
+    admission = make_admission()
+    started: list[str] = []
+    done = asyncio.Event()
+    done.set()
+
+    async with admission.admit("a"):
+        cancelled = asyncio.create_task(hold(admission, "b", started, done))
+        other = asyncio.create_task(hold(admission, "c", started, done))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        assert admission.waiting == 1
+
+    await other
+
+    assert started == ["c"]
+    assert admission.running == 0
+
+
+async def test_slot_is_passed_on_if_waiter_is_cancelled_after_being_admitted() -> None:
+    admission = make_admission()
+    started: list[str] = []
+    done = asyncio.Event()
+    done.set()
+
+    async with admission.admit("a"):
+        cancelled = asyncio.create_task(hold(admission, "b", started, done))
+        other = asyncio.create_task(hold(admission, "c", started, done))
+        await asyncio.sleep(0)
+
+    # The slot has been handed to "b", but it is cancelled before it gets a chance to run
+    cancelled.cancel()
+    await other
+
+    assert started == ["c"]
+    assert cancelled.cancelled()
+    assert admission.running == 0
+    assert admission.waiting == 0
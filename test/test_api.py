@@ -0,0 +1,534 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from hashlib import sha3_512
+from operator import itemgetter
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from reportobello.api import api
+from reportobello.api.limiter import add_ratelimiter
+from reportobello.api.page.template import router as template_pages
+from reportobello.application import build_pdf
+from reportobello.application.build_pdf import TEMPLATE_CACHE
+from reportobello.domain.build_job import BuildJob
+from reportobello.domain.user import User
+from reportobello.infra import db, db_async
+from reportobello.infra.admission import Admission
+from reportobello.infra.artifacts import ARTIFACTS, get_pdf_artifact_key
+from reportobello.infra.build_roots import BuildRootCache
+
+TEMPLATE = '#set page(height: 5cm)\nHello #data.name\n#for i in range(data.at("lines", default: 0)) [#lorem(30) ]'
+
+
+@pytest.fixture
+def user(monkeypatch: pytest.MonkeyPatch) -> User:
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(":memory:", readers=0))
+
+    # Ids are re-used between databases, so cached templates from other tests would be returned otherwise
+    TEMPLATE_CACHE.clear()
+
+    user = db.create_or_update_user(User(id=-1, api_key=db.create_random_api_key(), username="test"))
+    db.create_or_update_template_for_user(user.id, name="test", content=TEMPLATE)
+
+    return user
+
+
+def create_client(user: User) -> httpx.AsyncClient:
+    app = FastAPI()
+    app.include_router(api.router)
+    add_ratelimiter(app)
+
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://test",
+        headers={"authorization": f"Bearer {user.api_key}"},
+    )
+
+
+def create_other_user() -> User:
+    other_user = db.create_or_update_user(
+        User(id=-1, api_key=db.create_random_api_key(), username="other", provider_user_id="other")
+    )
+    db.create_or_update_template_for_user(other_user.id, name="test", content=TEMPLATE)
+
+    return other_user
+
+
+@pytest.fixture
+async def client(user: User) -> AsyncIterator[httpx.AsyncClient]:
+    async with create_client(user) as client:
+        yield client
+
+
+async def post_batch(
+    client: httpx.AsyncClient, records: list[object], *, ndjson: bool = False, merge: bool = False
+) -> httpx.Response:
+    return await client.post(
+        "/api/v1/template/test/build/batch",
+        params={"merge": "1"} if merge else {},
+        content="\n".join(json.dumps(record) for record in records) if ndjson else json.dumps(records),
+        headers={"content-type": "application/x-ndjson" if ndjson else "application/json"},
+    )
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+async def test_batch_build_reports_result_of_each_item(client: httpx.AsyncClient, *, ndjson: bool) -> None:
+    response = await post_batch(client, [{"name": "a"}, {"wrong": "key"}, {"name": "c"}], ndjson=ndjson)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    # Results are streamed back in the order they finish
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=itemgetter("index"))
+
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert "url" not in results[1]
+    assert 'dictionary does not contain key "name"' in results[1]["error"]
+
+    for result in [results[0], results[2]]:
+        pdf = await client.get(httpx.URL(result["url"]).path)
+
+        assert pdf.status_code == 200
+        assert pdf.content.startswith(b"%PDF")
+
+
+@pytest.mark.parametrize(("ndjson", "merge"), [(False, False), (True, False), (False, True), (True, True)])
+async def test_batch_build_rejects_too_many_items(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch, *, ndjson: bool, merge: bool
+) -> None:
+    monkeypatch.setattr(api, "BATCH_MAX_SIZE", 2)
+
+    response = await post_batch(client, [{"name": "a"}] * 3, ndjson=ndjson, merge=merge)
+
+    assert response.status_code == 413
+    assert response.text == "Too many records, max is 2"
+
+
+async def test_batch_build_rejects_invalid_json(client: httpx.AsyncClient) -> None:
+    response = await client.post(
+        "/api/v1/template/test/build/batch",
+        content=json.dumps({"name": "a"}),
+        headers={"content-type": "application/json"},
+    )
+
+    assert response.status_code == 400
+    assert response.text == "Invalid JSON: expected an array"
+
+
+async def test_ndjson_lines_can_span_multiple_chunks(client: httpx.AsyncClient) -> None:
+    body = "\n".join(json.dumps(record) for record in [{"name": "a"}, {"name": "b" * 1000}, {"name": "c"}]).encode()
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(0, len(body), 7):
+            # Let the server read each chunk as soon as it is sent
+            await asyncio.sleep(0)
+
+            yield body[i : i + 7]
+
+    response = await client.post(
+        "/api/v1/template/test/build/batch",
+        params={"merge": "1"},
+        content=chunks(),
+        headers={"content-type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    assert [record["index"] for record in response.json()["records"]] == [0, 1, 2]
+
+
+async def test_uploaded_modules_can_be_imported(user: User, client: httpx.AsyncClient) -> None:
+    db.create_or_update_template_for_user(user.id, name="test", content='#import "names.typ": greet\n#greet(data)')
+
+    response = await client.post(
+        "/api/v1/template/test/files",
+        files={"names.typ": ("names.typ", b"#let greet(data) = [Hello #data.name]", "text/plain")},
+    )
+
+    assert response.status_code == 200
+
+    response = await client.post("/api/v1/template/test/build", json={"data": {"name": "world"}})
+
+    assert response.status_code == 200
+    assert response.content.startswith(b"%PDF")
+
+
+async def test_templates_can_read_data_file(user: User, client: httpx.AsyncClient) -> None:
+    db.create_or_update_template_for_user(user.id, name="test", content='#let d = json("data.json")\nHello #d.name')
+
+    for name in ["world", "again"]:
+        response = await client.post("/api/v1/template/test/build", json={"data": {"name": name}})
+
+        assert response.status_code == 200
+        assert response.content.startswith(b"%PDF")
+
+
+async def test_data_is_only_written_to_disk_for_templates_that_read_data_file(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    build_roots = BuildRootCache(tmp_path, store=ARTIFACTS, max_size=1_000_000)
+    monkeypatch.setattr(build_pdf, "BUILD_ROOTS", build_roots)
+
+    response = await client.post("/api/v1/template/test/build", json={"data": {"name": "world"}})
+
+    assert response.status_code == 200
+    assert list(build_roots.directory.rglob("report.typ"))
+    assert not list(build_roots.directory.rglob("data.json"))
+
+    build_roots.close()
+
+
+async def test_merged_build_returns_page_range_of_each_item(client: httpx.AsyncClient) -> None:
+    response = await post_batch(client, [{"name": "a"}, {"name": "b", "lines": 10}, {"name": "c"}], merge=True)
+
+    assert response.status_code == 200
+
+    merged = response.json()
+    (a_start, a_end), (b_start, b_end), (c_start, c_end) = [record["pages"] for record in merged["records"]]
+
+    assert [record["index"] for record in merged["records"]] == [0, 1, 2]
+
+    # Each item starts on a new page, and the second item is long enough to span multiple pages
+    assert a_start == a_end == 1
+    assert b_start == 2
+    assert b_end > b_start
+    assert c_start == c_end == b_end + 1
+
+    pdf = await client.get(httpx.URL(merged["url"]).path)
+
+    assert pdf.status_code == 200
+    assert pdf.content.startswith(b"%PDF")
+
+
+async def test_merged_build_fails_if_any_item_fails(client: httpx.AsyncClient) -> None:
+    response = await post_batch(client, [{"name": "a"}, {"wrong": "key"}], merge=True)
+
+    assert response.status_code == 400
+    assert 'dictionary does not contain key "name"' in response.text
+
+
+async def test_merged_build_requires_at_least_one_item(client: httpx.AsyncClient) -> None:
+    response = await post_batch(client, [], merge=True)
+
+    assert response.status_code == 400
+    assert response.text == "Expected at least one record"
+
+
+async def start_resumable_upload(client: httpx.AsyncClient, content: bytes, *, chunk_size: int) -> dict[str, object]:
+    chunks = [content[i : i + chunk_size] for i in range(0, len(content), chunk_size)]
+
+    response = await client.post(
+        "/api/v1/template/test/uploads",
+        json={
+            "filename": "secret.txt",
+            "size": len(content),
+            "hash": sha3_512(content).hexdigest(),
+            "chunk_size": chunk_size,
+            "chunk_hashes": [sha3_512(chunk).hexdigest() for chunk in chunks],
+        },
+    )
+
+    assert response.status_code == 201
+
+    upload: dict[str, object] = response.json()
+
+    return upload
+
+
+async def test_files_of_other_users_are_not_reused_by_resumable_uploads(client: httpx.AsyncClient) -> None:
+    content = b"secret file of another user"
+
+    response = await client.post("/api/v1/template/test/files", files={"secret.txt": ("secret.txt", content)})
+
+    assert response.status_code == 200
+
+    # Files are only skipped for the user that uploaded them
+    upload = await start_resumable_upload(client, content, chunk_size=10)
+
+    assert upload["missing"] == []
+
+    other_user = create_other_user()
+
+    async with create_client(other_user) as other_client:
+        upload = await start_resumable_upload(other_client, content, chunk_size=10)
+        url = f"/api/v1/template/test/uploads/{upload['id']}"
+
+        assert upload["missing"] == [0, 10, 20]
+
+        response = await other_client.post(f"{url}/complete")
+
+        assert response.status_code == 409
+
+        for offset in [0, 10, 20]:
+            response = await other_client.put(f"{url}/chunks/{offset}", content=content[offset : offset + 10])
+
+            assert response.status_code == 200
+
+        response = await other_client.post(f"{url}/complete")
+
+        assert response.status_code == 200
+
+    assert [file.filename for file in db.get_files_for_template(other_user.id, "test")] == ["secret.txt"]
+
+
+def count_queued_jobs() -> int:
+    count: int = db.pool.writer.execute("SELECT COUNT(*) FROM reports WHERE state='queued'").fetchone()[0]
+
+    return count
+
+
+@pytest.fixture
+def remote_builds(monkeypatch: pytest.MonkeyPatch) -> None:
+    # No build worker is running, so queued jobs are never picked up
+    monkeypatch.setattr(build_pdf, "REMOTE_BUILDS", True)
+    monkeypatch.setattr(build_pdf, "BUILD_QUEUE_MAX_WAIT_IN_SECONDS", 0.1)
+    monkeypatch.setattr(build_pdf, "BUILD_TIMEOUT_IN_SECONDS", 0)
+
+
+@pytest.mark.usefixtures("remote_builds")
+async def test_remote_builds_that_time_out_are_removed_from_queue(client: httpx.AsyncClient) -> None:
+    response = await client.post("/api/v1/template/test/build", json={"data": {"name": "world"}})
+
+    assert response.status_code == 503
+    assert count_queued_jobs() == 0
+
+
+@pytest.mark.usefixtures("remote_builds")
+async def test_remote_builds_are_removed_from_queue_once_client_disconnects(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(build_pdf, "BUILD_QUEUE_MAX_WAIT_IN_SECONDS", 10)
+
+    queued = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def create_build_job(job: BuildJob) -> None:
+        await db_async.create_build_job(job)
+        queued.set()
+
+    async def cancel_build_job(job_id: str) -> None:
+        await db_async.cancel_build_job(job_id)
+        cancelled.set()
+
+    monkeypatch.setattr(build_pdf, "create_build_job", create_build_job)
+    monkeypatch.setattr(build_pdf, "cancel_build_job", cancel_build_job)
+
+    build = asyncio.create_task(client.post("/api/v1/template/test/build", json={"data": {"name": "world"}}))
+
+    await asyncio.wait_for(queued.wait(), timeout=5)
+
+    build.cancel()
+
+    await asyncio.wait_for(cancelled.wait(), timeout=5)
+
+    now = datetime.now(tz=UTC)
+
+    assert count_queued_jobs() == 0
+    assert db.claim_build_job(now=now, lease_expires_at=now) is None
+
+
+async def test_expired_pdfs_are_not_reported_as_unchanged(client: httpx.AsyncClient) -> None:
+    response = await client.post("/api/v1/template/test/build", params={"justUrl": "1"}, json={"data": {"name": "a"}})
+
+    assert response.status_code == 200
+
+    url = httpx.URL(response.text).path
+    pdf = await client.get(url)
+
+    assert pdf.status_code == 200
+
+    response = await client.get(url, headers={"if-none-match": pdf.headers["etag"]})
+
+    assert response.status_code == 304
+
+    await ARTIFACTS.delete(get_pdf_artifact_key(url.rsplit("/", maxsplit=1)[-1]))
+
+    response = await client.get(url, headers={"if-none-match": pdf.headers["etag"]})
+
+    assert response.status_code == 404
+
+
+async def test_identical_builds_are_only_compiled_once(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    builds = 0
+    build_template = build_pdf.build_template
+
+    async def count_builds(**kwargs: object) -> object:
+        nonlocal builds
+        builds += 1
+
+        return await build_template(**kwargs)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(build_pdf, "build_template", count_builds)
+
+    async def build(data: object, params: dict[str, str] | None = None) -> str:
+        response = await client.post(
+            "/api/v1/template/test/build", params={"justUrl": "1", **(params or {})}, json={"data": data}
+        )
+
+        assert response.status_code == 200
+
+        return response.text
+
+    url = await build({"name": "a"})
+
+    assert await build({"name": "a"}) == url
+    assert builds == 1
+
+    assert await build({"name": "b"}) != url
+    assert await build({"name": "a"}, {"noCache": "1"}) != url
+    assert builds == 3
+
+
+async def test_build_history_page_rejects_invalid_cursor(user: User) -> None:
+    app = FastAPI()
+    app.include_router(template_pages.router)
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://test",
+        headers={"authorization": f"Bearer {user.api_key}"},
+    ) as client:
+        response = await client.get("/template/test/builds", params={"cursor": "invalid"})
+
+        assert response.status_code == 400
+        assert response.text == "Invalid cursor"
+
+        response = await client.get("/template/test/builds")
+
+        assert response.status_code == 200
+
+
+async def build_url(client: httpx.AsyncClient, name: str) -> httpx.Response:
+    return await client.post("/api/v1/template/test/build", params={"justUrl": "1"}, json={"data": {"name": name}})
+
+
+async def test_queued_builds_are_admitted_round_robin_between_users(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    admission = Admission(1, max_queue_length=3, max_queue_per_user=2, max_wait=10)
+    monkeypatch.setattr(build_pdf, "ADMISSION", admission)
+
+    arrived = asyncio.Queue[None]()
+    finished: list[str] = []
+    typst_compile = build_pdf.typst_compile
+
+    async def record_builds(file: Path, inputs: dict[str, str], **kwargs: str) -> tuple[int, str]:
+        # The build is queued (or rejected) before this task yields again, so it is already waiting once the test
+        # sees that it arrived
+        build = typst_compile(file, inputs, **kwargs)  # type: ignore[arg-type]
+        arrived.put_nowait(None)
+
+        result = await build
+        finished.append(json.loads(inputs[build_pdf.TYPST_DATA_INPUT])["name"])
+
+        return result
+
+    monkeypatch.setattr(build_pdf, "typst_compile", record_builds)
+
+    async def start_build(build_client: httpx.AsyncClient, name: str) -> asyncio.Task[httpx.Response]:
+        build = asyncio.create_task(build_url(build_client, name))
+        await arrived.get()
+
+        return build
+
+    async with create_client(create_other_user()) as other_client:
+        # Take the only build slot so that every build has to wait in the queue
+        async with admission.admit("blocker"):
+            builds = [await start_build(client, "a1"), await start_build(client, "a2")]
+
+            response = await (await start_build(client, "a3"))
+
+            assert response.status_code == 429
+            assert response.text == "Too many builds are already queued"
+            assert int(response.headers["retry-after"]) >= 1
+
+            builds.append(await start_build(other_client, "b1"))
+
+            response = await (await start_build(other_client, "b2"))
+
+            assert response.status_code == 503
+            assert response.text == "Build queue is full, try again later"
+            assert int(response.headers["retry-after"]) >= 1
+
+        responses = await asyncio.gather(*builds)
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert finished == ["a1", "b1", "a2"]
+
+
+async def test_report_data_is_stored_compressed_and_returned_as_is(client: httpx.AsyncClient) -> None:
+    data = {"name": "a", "padding": "x" * 10_000}
+
+    for _ in range(2):
+        response = await client.post("/api/v1/template/test/build", params={"noCache": "1"}, json={"data": data})
+
+        assert response.status_code == 200
+
+    # Identical data is only stored once, and is compressed using zstd
+    rows = db.pool.writer.execute("SELECT data FROM report_data").fetchall()
+
+    assert len(rows) == 1
+    assert rows[0]["data"].startswith(b"\x28\xb5\x2f\xfd")
+    assert len(rows[0]["data"]) < 1000
+
+    response = await client.get("/api/v1/template/test/recent")
+
+    assert response.status_code == 200
+
+    reports = response.json()
+
+    assert [json.loads(report["data"]) for report in reports] == [data, data]
+
+    response = await client.get("/api/v1/template/test/recent", params={"metadataOnly": "1"})
+
+    assert [report["data"] for report in response.json()] == ["", ""]
+
+    response = await client.get(f"/api/v1/template/test/recent/{reports[0]['id']}/data")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == data
+
+
+async def test_uploaded_files_are_hashed_and_size_limited(
+    client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(api, "UPLOAD_MAX_FILE_SIZE", 100)
+
+    content = b"x" * 100
+
+    response = await client.post(
+        "/api/v1/template/test/files",
+        files=[("a.txt", ("a.txt", content, "text/plain")), ("b.txt", ("b.txt", b"small"))],
+    )
+
+    assert response.status_code == 200
+
+    response = await client.get("/api/v1/template/test/file/a.txt")
+
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == f'"{sha3_512(content).hexdigest()}"'
+    assert response.headers["content-type"].startswith("text/plain")
+
+    response = await client.post("/api/v1/template/test/files", files={"c.txt": ("c.txt", content + b"x")})
+
+    assert response.status_code == 413
+    assert response.text == "One or more files are too large"
+
+    response = await client.get("/api/v1/template/test/file/c.txt")
+
+    assert response.status_code == 404
+
+    response = await client.post(
+        "/api/v1/template/test/files", files=[(f"{i}.txt", (f"{i}.txt", b"x")) for i in range(101)]
+    )
+
+    assert response.status_code == 400
+    assert response.text == "Too many files, max is 100"
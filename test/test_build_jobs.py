@@ -0,0 +1,147 @@
+import asyncio
+import json
+from datetime import UTC, datetime
+
+import httpx
+import pytest
+
+from reportobello.application import build_jobs
+from reportobello.application.build_jobs import (
+    ReportobelloInvalidWebhookUrl,
+    resolve_webhook_url,
+    start_build_worker,
+    submit_build_job,
+)
+from reportobello.application.build_pdf import TEMPLATE_CACHE
+from reportobello.domain.user import User
+from reportobello.infra import db
+from reportobello.infra.db_async import get_build_job
+
+
+@pytest.fixture
+def user(monkeypatch: pytest.MonkeyPatch) -> User:
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(":memory:", readers=0))
+
+    # Ids are re-used between databases, so cached templates from other tests would be returned otherwise
+    TEMPLATE_CACHE.clear()
+
+    user = db.create_or_update_user(User(id=-1, api_key=db.create_random_api_key(), username="test"))
+    db.create_or_update_template_for_user(user.id, name="test", content="Hello #data.name")
+
+    return user
+
+
+@pytest.fixture
+def webhooks(monkeypatch: pytest.MonkeyPatch) -> asyncio.Queue[httpx.Request]:
+    # Local stand-in for the server receiving the webhooks
+    webhooks = asyncio.Queue[httpx.Request]()
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        webhooks.put_nowait(request)
+
+        return httpx.Response(200)
+
+    monkeypatch.setattr(build_jobs, "webhook_client", httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+    monkeypatch.setattr(build_jobs, "WEBHOOK_ALLOWED_HOSTS", frozenset({"localhost"}))
+
+    return webhooks
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://example.com/hook",
+        "/hook",
+        "http://127.0.0.1/hook",
+        "http://localhost:8000/hook",
+        "http://169.254.169.254/latest/meta-data",
+        "http://10.0.0.1/hook",
+        "http://192.168.1.1/hook",
+        "http://[::1]/hook",
+        "http://[::ffff:127.0.0.1]/hook",
+        "http://[fe80::1]/hook",
+        "http://0.0.0.0/hook",
+        "http://100.64.0.1/hook",
+    ],
+)
+async def test_internal_webhook_urls_are_rejected(url: str) -> None:
+    with pytest.raises(ReportobelloInvalidWebhookUrl):
+        await resolve_webhook_url(url)
+
+
+async def test_webhook_url_is_resolved_to_checked_address(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert await resolve_webhook_url("https://93.184.215.14/hook?a=1") == httpx.URL("https://93.184.215.14/hook?a=1")
+
+    monkeypatch.setattr(build_jobs, "WEBHOOK_ALLOWED_HOSTS", frozenset({"localhost"}))
+
+    resolved = await resolve_webhook_url("http://localhost:8000/hook")
+
+    assert resolved.host in {"127.0.0.1", "::1"}
+    assert resolved.port == 8000
+    assert resolved.path == "/hook"
+
+
+@pytest.mark.parametrize(("data", "successful"), [({"name": "world"}, True), ({"wrong": "key"}, False)])
+async def test_webhook_is_sent_once_job_is_done(
+    user: User, webhooks: asyncio.Queue[httpx.Request], data: object, *, successful: bool
+) -> None:
+    worker = start_build_worker()
+
+    try:
+        job = await submit_build_job(
+            user=user,
+            template_name="test",
+            template_version=-1,
+            content_type="application/json",
+            data=data,
+            webhook_url="http://localhost:8000/hook",
+        )
+
+        assert job.state == "queued"
+
+        webhook = await asyncio.wait_for(webhooks.get(), timeout=10)
+
+    finally:
+        worker.cancel()
+
+    # The webhook is sent to the address that was checked, with the original host name
+    assert webhook.url.host in {"127.0.0.1", "::1"}
+    assert webhook.url.path == "/hook"
+    assert webhook.headers["host"] == "localhost:8000"
+    assert json.loads(webhook.content) == {"id": job.id, "state": "done", "successful": successful}
+
+    finished = await get_build_job(job.id)
+
+    assert finished
+    assert finished.state == "done"
+    assert finished.report
+    assert finished.report.was_successful == successful
+    assert bool(finished.report.filename) == successful
+
+
+async def test_jobs_with_internal_webhook_urls_are_rejected(user: User) -> None:
+    with pytest.raises(ReportobelloInvalidWebhookUrl):
+        await submit_build_job(
+            user=user,
+            template_name="test",
+            template_version=-1,
+            content_type="application/json",
+            data={"name": "world"},
+            webhook_url="http://169.254.169.254/latest/meta-data",
+        )
+
+    now = datetime.now(tz=UTC)
+
+    assert db.claim_build_job(now=now, lease_expires_at=now) is None
+
+
+async def test_webhooks_are_checked_again_before_being_sent(
+    webhooks: asyncio.Queue[httpx.Request], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # For example, if the host resolved to a public address when the job was submitted, but not anymore
+    monkeypatch.setattr(build_jobs, "WEBHOOK_ALLOWED_HOSTS", frozenset())
+
+    with pytest.raises(ReportobelloInvalidWebhookUrl):
+        await build_jobs.post_webhook("http://localhost:8000/hook", {})
+
+    assert webhooks.empty()
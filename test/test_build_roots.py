@@ -0,0 +1,103 @@
+import shutil
+from pathlib import Path
+
+from reportobello.infra.artifacts import LocalArtifactStore
+from reportobello.infra.build_roots import BuildRootCache
+
+
+async def test_build_root_is_reused(tmp_path: Path) -> None:
+    store = LocalArtifactStore(tmp_path / "artifacts")
+    await store.put("files/logo", b"png")
+
+    cache = BuildRootCache(tmp_path / "roots", store=store, max_size=1000)
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={"logo.png": "files/logo"}) as root:
+        assert (root / "report.typ").read_text() == "Hello"
+        assert (root / "logo.png").read_bytes() == b"png"
+        assert not (root / "logo.png").is_symlink()
+
+        first_root = root
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={"logo.png": "files/logo"}) as root:
+        assert root == first_root
+
+
+async def test_least_recently_used_roots_are_evicted(tmp_path: Path) -> None:
+    cache = BuildRootCache(tmp_path / "roots", store=LocalArtifactStore(tmp_path / "artifacts"), max_size=10)
+
+    async with cache.use_root("a", sources={"report.typ": "x" * 6}, files={}) as a:
+        # Roots that are in use are never evicted
+        async with cache.use_root("b", sources={"report.typ": "x" * 6}, files={}) as b:
+            pass
+
+        assert a.exists()
+        assert not b.exists()
+
+    async with cache.use_root("c", sources={"report.typ": "x" * 6}, files={}) as c:
+        pass
+
+    assert not a.exists()
+    assert c.exists()
+
+
+async def test_roots_are_not_evicted_while_being_prepared(tmp_path: Path) -> None:
+    class EvictingBuildRootCache(BuildRootCache):
+        async def _prepare(self, key: str, *, sources: dict[str, str], files: dict[str, str]) -> Path:
+            root = await super()._prepare(key, sources=sources, files=files)
+
+            # Another build finishes (and evicts roots) right after the root is prepared, before it is used
+            await self._evict()
+
+            return root
+
+    cache = EvictingBuildRootCache(tmp_path / "roots", store=LocalArtifactStore(tmp_path / "artifacts"), max_size=1)
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={}) as root:
+        assert (root / "report.typ").read_text() == "Hello"
+
+
+async def test_deleted_roots_are_prepared_again(tmp_path: Path) -> None:
+    cache = BuildRootCache(tmp_path / "roots", store=LocalArtifactStore(tmp_path / "artifacts"), max_size=1000)
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={}) as root:
+        pass
+
+    shutil.rmtree(root)
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={}) as root:
+        assert (root / "report.typ").read_text() == "Hello"
+
+
+async def test_roots_of_other_processes_are_only_removed_once_they_exit(tmp_path: Path) -> None:
+    store = LocalArtifactStore(tmp_path / "artifacts")
+
+    # Each cache holds its own lock, so it behaves the same as a cache in another process
+    running = BuildRootCache(tmp_path / "roots", store=store, max_size=1000)
+
+    async with running.use_root("key", sources={"report.typ": "Hello"}, files={}) as running_root:
+        pass
+
+    # Processes that exit leave their roots and (now unlocked) lock file behind
+    (tmp_path / "roots" / "exited" / "key").mkdir(parents=True)
+    (tmp_path / "roots" / "exited.lock").touch()
+
+    # Left over by older versions, which kept every root in the same directory
+    (tmp_path / "roots" / "old").mkdir()
+
+    cache = BuildRootCache(tmp_path / "roots", store=store, max_size=1000)
+
+    async with cache.use_root("key", sources={"report.typ": "Hello"}, files={}) as root:
+        assert root.exists()
+
+    assert running_root.exists()
+    assert sorted(path.name for path in (tmp_path / "roots").iterdir()) == sorted([
+        running.directory.name,
+        f"{running.directory.name}.lock",
+        cache.directory.name,
+        f"{cache.directory.name}.lock",
+    ])
+
+    running.close()
+    cache.close()
+
+    assert not any((tmp_path / "roots").iterdir())
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from reportobello.infra.cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    cache = LRUCache[str, int]("test", max_size=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_expired_entries_are_evicted(monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = LRUCache[str, int]("test", max_size=10, ttl=60)
+
+    cache.set("a", 1)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_remove_where() -> None:
+    cache = LRUCache[str, int]("test", max_size=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 1)
+
+    cache.remove_where(lambda _, value: value == 1)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") is None
@@ -0,0 +1,280 @@
+import sqlite3
+from collections.abc import Callable, Generator
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from reportobello.domain.build_job import BuildJob
+from reportobello.domain.file import File
+from reportobello.domain.report import Report
+from reportobello.domain.upload_session import UploadChunk, UploadSession
+from reportobello.domain.user import User
+from reportobello.infra import db, retention
+
+NOW = datetime.now(tz=UTC)
+
+
+@pytest.fixture
+def user(monkeypatch: pytest.MonkeyPatch) -> User:
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(":memory:", readers=0))
+
+    user = db.create_or_update_user(User(id=-1, api_key=db.create_random_api_key(), username="test"))
+
+    for i in range(3):
+        db.create_or_update_template_for_user(user.id, name="test", content=f"Hello world {i}")
+
+        db.save_recent_report_build_for_user(
+            user.id,
+            Report(
+                filename=f"{i}.pdf",
+                requested_version=-1,
+                actual_version=i + 1,
+                template_name="test",
+                started_at=NOW,
+                finished_at=NOW,
+                expires_at=NOW + timedelta(days=1),
+                cache_key=str(i),
+            ),
+        )
+
+        db.save_file_metadata(user_id=user.id, template_name="test", file=File(f"{i}.png", hash=str(i), size=1))
+
+    db.update_env_vars_for_user(user.id, {"KEY": "value"})
+
+    return user
+
+
+def get_query_plans(f: Callable[[], object]) -> Generator[list[str]]:
+    # Run f, then yield the query plan of every query it ran
+
+    queries: list[str] = []
+
+    db.pool.writer.set_trace_callback(queries.append)
+
+    try:
+        f()
+
+    finally:
+        db.pool.writer.set_trace_callback(None)
+
+    for query in queries:
+        if query.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            rows = db.pool.writer.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+
+            yield [row["detail"] for row in rows]
+
+
+HOT_QUERIES: dict[str, Callable[[User], object]] = {
+    "get_user_by_api_key": lambda user: db.get_user_by_api_key(user.api_key),
+    "check_template_exists_for_user": lambda user: db.check_template_exists_for_user(user.id, "test"),
+    "get_template_for_user (latest)": lambda user: db.get_template_for_user(user.id, "test"),
+    "get_template_for_user (version)": lambda user: db.get_template_for_user(user.id, "test", 2),
+    "get_latest_template_version_for_user": lambda user: db.get_latest_template_version_for_user(user.id, "test"),
+    "get_recent_report_builds_for_user": lambda user: db.get_recent_report_builds_for_user(user.id, "test"),
+    "get_recent_report_builds_for_user (before)": lambda user: db.get_recent_report_builds_for_user(
+        user.id, "test", before=NOW
+    ),
+    "get_cached_report_by_cache_key": lambda user: db.get_cached_report_by_cache_key(user.id, "1", now=NOW),
+    "claim_build_job": lambda _: db.claim_build_job(now=NOW, lease_expires_at=NOW),
+    "cancel_build_job": lambda _: db.cancel_build_job("1"),
+    "count_expired_files": lambda _: retention.count_expired_files(now=NOW),
+    "get_expired_files": lambda _: retention.get_expired_files(now=NOW, after=(NOW.isoformat(), 1), limit=10),
+    "forget_expired_files": lambda _: retention.forget_expired_files([1, 2]),
+    "get_env_vars_for_user": lambda user: db.get_env_vars_for_user(user.id),
+    "get_files_for_template": lambda user: db.get_files_for_template(user.id, "test"),
+    "get_file_for_template": lambda user: db.get_file_for_template(user.id, "test", "1.png"),
+    "check_file_uploaded_by_user": lambda user: db.check_file_uploaded_by_user(user.id, "1"),
+    "delete_file_for_template": lambda user: db.delete_file_for_template(user.id, "test", "1.png"),
+    "get_upload_session": lambda _: db.get_upload_session("upload"),
+    "mark_upload_chunks_received": lambda _: db.mark_upload_chunks_received("upload", "a"),
+    "delete_upload_session": lambda _: db.delete_upload_session("upload"),
+}
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_queries_use_indexes(user: User, name: str) -> None:
+    plans = list(get_query_plans(lambda: HOT_QUERIES[name](user)))
+
+    assert plans
+
+    for plan in plans:
+        for step in plan:
+            # "SCAN CONSTANT ROW" is from SELECT EXISTS(...), which is fine
+            assert not step.startswith("SCAN") or step == "SCAN CONSTANT ROW", plan
+            assert "CORRELATED" not in step, plan
+
+
+def test_files_are_not_duplicated_per_template_version(user: User) -> None:
+    files = db.get_files_for_template(user.id, "test")
+
+    assert sorted(file.filename for file in files) == ["0.png", "1.png", "2.png"]
+
+
+def test_files_are_hidden_once_template_is_deleted(user: User) -> None:
+    db.delete_template_for_user(user.id, "test")
+
+    assert db.get_files_for_template(user.id, "test") == []
+    assert db.get_file_for_template(user.id, "test", "1.png") is None
+
+
+def test_identical_report_data_is_only_stored_once(user: User) -> None:
+    for _ in range(2):
+        db.save_recent_report_build_for_user(
+            user.id,
+            Report(
+                filename="x.pdf",
+                requested_version=-1,
+                actual_version=1,
+                template_name="test",
+                started_at=NOW,
+                finished_at=NOW,
+                expires_at=NOW,
+                data='{"hello":"world"}',
+            ),
+        )
+
+    reports = db.get_recent_report_builds_for_user(user.id, "test", limit=2)
+
+    assert reports
+    assert [report.data for report in reports] == ['{"hello":"world"}'] * 2
+
+    rows = db.pool.writer.execute("SELECT COUNT(*) FROM report_data").fetchone()
+    assert rows[0] == 2
+
+
+def test_cached_reports_keep_their_cache_key(user: User) -> None:
+    report = db.get_cached_report_by_cache_key(user.id, "1", now=NOW)
+
+    assert report
+    assert report.filename == "1.pdf"
+    assert report.cache_key == "1"
+
+    reports = db.get_recent_report_builds_for_user(user.id, "test", limit=3)
+
+    assert reports
+    assert sorted(report.cache_key for report in reports) == ["0", "1", "2"]
+
+
+def test_inline_report_data_is_moved_to_blobs(user: User) -> None:
+    template_id = db.pool.writer.execute("SELECT id FROM templates WHERE version=1").fetchone()[0]
+
+    db.pool.writer.execute(
+        """
+        INSERT INTO reports (template_id, requested_version, started_at, finished_at, expires_at, data)
+        VALUES (?, -1, ?, ?, ?, '{"old":true}')
+        """,
+        [template_id, *[(NOW + timedelta(days=1)).isoformat()] * 3],
+    )
+
+    db.move_report_data_to_blobs(db.pool.writer)
+
+    assert db.pool.writer.execute("SELECT COUNT(*) FROM reports WHERE data!=''").fetchone()[0] == 0
+
+    reports = db.get_recent_report_builds_for_user(user.id, "test", limit=1)
+
+    assert reports
+    assert reports[0].data == '{"old":true}'
+
+
+def test_interrupted_report_data_migration_is_rolled_back(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    def interrupt(_: sqlite3.Connection) -> None:
+        raise KeyboardInterrupt
+
+    location = str(tmp_path / "db.sqlite")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db, "move_report_data_to_blobs", interrupt)
+
+        with pytest.raises(KeyboardInterrupt):
+            db.build_db(location)
+
+    conn = db.connect(location)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 5
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name='report_data'").fetchall()
+    conn.close()
+
+    conn = db.build_db(location)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] >= 6
+    conn.close()
+
+
+def test_build_jobs_are_claimed_once_until_their_lease_expires(user: User) -> None:
+    for i in range(2):
+        db.create_build_job(
+            BuildJob(
+                id=str(i),
+                owner_id=user.id,
+                state="queued",
+                template_name="test",
+                requested_version=-1,
+                actual_version=1,
+                queued_at=NOW,
+                data="{}",
+            )
+        )
+
+    lease_expires_at = NOW + timedelta(seconds=30)
+
+    assert db.claim_build_job(now=NOW, lease_expires_at=lease_expires_at) == "0"
+    assert db.claim_build_job(now=NOW, lease_expires_at=lease_expires_at) == "1"
+    assert db.claim_build_job(now=NOW, lease_expires_at=lease_expires_at) is None
+
+    db.renew_build_job_lease("1", lease_expires_at=lease_expires_at + timedelta(seconds=30))
+
+    # Only the job whose lease wasn't renewed is handed out again
+    later = lease_expires_at + timedelta(seconds=1)
+
+    assert db.claim_build_job(now=later, lease_expires_at=later + timedelta(seconds=30)) == "0"
+    assert db.claim_build_job(now=later, lease_expires_at=later + timedelta(seconds=30)) is None
+
+
+def test_received_chunks_are_shared_between_uploads_of_same_user(user: User) -> None:
+    def create_upload(upload_id: str, chunk_hashes: list[str], *, owner: User = user) -> UploadSession:
+        db.create_upload_session(
+            UploadSession(
+                id=upload_id,
+                owner_id=owner.id,
+                template_name="test",
+                filename="font.ttf",
+                content_type=None,
+                size=len(chunk_hashes) * 2,
+                hash=upload_id,
+                chunk_size=2,
+                created_at=NOW,
+                expires_at=NOW + timedelta(days=1),
+                chunks=[UploadChunk(offset=i * 2, size=2, hash=h) for i, h in enumerate(chunk_hashes)],
+            )
+        )
+
+        session = db.get_upload_session(upload_id)
+        assert session
+
+        return session
+
+    create_upload("first", ["a", "b", "a"])
+    db.mark_upload_chunks_received("first", "a")
+
+    first = db.get_upload_session("first")
+
+    assert first
+    assert [chunk.offset for chunk in first.missing_chunks] == [2]
+
+    second = create_upload("second", ["a", "c"])
+
+    assert [chunk.offset for chunk in second.missing_chunks] == [2]
+
+    # Other users need to send every chunk themselves
+    other_user = db.create_or_update_user(
+        User(id=-1, api_key=db.create_random_api_key(), username="other", provider_user_id="other")
+    )
+    other = create_upload("other", ["a", "c"], owner=other_user)
+
+    assert [chunk.offset for chunk in other.missing_chunks] == [0, 2]
+    assert db.delete_upload_session("other") == ["c"]
+
+    # "a" is still used by the second upload, but "b" was never received by anything else
+    assert db.delete_upload_session("first") == ["b"]
+    assert db.get_upload_session("first") is None
+
+    assert db.delete_upload_session("second") == ["a", "c"]
@@ -0,0 +1,145 @@
+from datetime import UTC, datetime, timedelta
+from hashlib import sha3_512
+from pathlib import Path
+
+import pytest
+
+from reportobello.domain.file import File
+from reportobello.domain.upload_session import UploadChunk, UploadSession
+from reportobello.domain.user import User
+from reportobello.infra import db, file_gc
+from reportobello.infra.artifacts import LocalArtifactStore, get_chunk_artifact_key, get_file_artifact_key
+from reportobello.infra.file_gc import collect_garbage
+
+
+@pytest.fixture
+def user(monkeypatch: pytest.MonkeyPatch) -> User:
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(":memory:", readers=0))
+
+    user = db.create_or_update_user(User(id=-1, api_key=db.create_random_api_key(), username="test"))
+    db.create_or_update_template_for_user(user.id, name="test", content="Hello world")
+
+    return user
+
+
+async def upload(store: LocalArtifactStore, user: User, filename: str, content: bytes) -> str:
+    file_hash = sha3_512(content).hexdigest()
+
+    await store.put(get_file_artifact_key(file_hash), content)
+    db.save_file_metadata(user_id=user.id, template_name="test", file=File(filename, hash=file_hash, size=len(content)))
+
+    return get_file_artifact_key(file_hash)
+
+
+async def test_unused_files_are_deleted_after_grace_period(user: User, tmp_path: Path) -> None:
+    store = LocalArtifactStore(tmp_path)
+
+    used = await upload(store, user, "used.png", b"used")
+    unused = await upload(store, user, "unused.png", b"unused")
+
+    db.delete_file_for_template(user.id, "test", "unused.png")
+
+    # The first run only marks the file as orphaned
+    report = await collect_garbage(store=store, grace_period=timedelta(0))
+
+    assert report.unreferenced_files == 1
+    assert report.deleted_files == 0
+    assert await store.exists(unused)
+
+    report = await collect_garbage(store=store, grace_period=timedelta(0))
+
+    assert report.deleted_files == 1
+    assert report.deleted_bytes == len(b"unused")
+    assert await store.exists(used)
+    assert not await store.exists(unused)
+
+
+async def test_files_uploaded_again_during_collection_are_kept(
+    user: User, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = LocalArtifactStore(tmp_path)
+
+    key = await upload(store, user, "logo.png", b"logo")
+    db.delete_file_for_template(user.id, "test", "logo.png")
+
+    await collect_garbage(store=store, grace_period=timedelta(0))
+
+    remove_unreferenced_files = file_gc.remove_unreferenced_files
+
+    def upload_again_after_removing(
+        start: int, end: int, *, now: datetime, cutoff: datetime, dry_run: bool
+    ) -> tuple[int, list[tuple[str, int]]]:
+        result = remove_unreferenced_files(start, end, now=now, cutoff=cutoff, dry_run=dry_run)
+
+        # The file still exists in the store, so it isn't stored again (see save_uploaded_file)
+        db.save_file_metadata(
+            user_id=user.id,
+            template_name="test",
+            file=File("logo.png", hash=sha3_512(b"logo").hexdigest(), size=len(b"logo")),
+        )
+
+        return result
+
+    monkeypatch.setattr(file_gc, "remove_unreferenced_files", upload_again_after_removing)
+
+    report = await collect_garbage(store=store, grace_period=timedelta(0))
+
+    assert report.deleted_files == 0
+    assert report.missing_files == 0
+    assert await store.exists(key)
+    assert [file.filename for file in db.get_files_for_template(user.id, "test")] == ["logo.png"]
+
+
+async def test_store_is_reconciled_with_database(user: User, tmp_path: Path) -> None:
+    store = LocalArtifactStore(tmp_path)
+
+    missing = await upload(store, user, "missing.png", b"missing")
+    await store.delete(missing)
+
+    stray = "files/00/00/00/00"
+    await store.put(stray, b"stray")
+
+    report = await collect_garbage(store=store, grace_period=timedelta(0), dry_run=True)
+
+    assert report.stray_files == 1
+    assert report.missing_files == 1
+    assert await store.exists(stray)
+    assert db.get_files_for_template(user.id, "test")
+
+    await collect_garbage(store=store, grace_period=timedelta(0))
+
+    assert not await store.exists(stray)
+    assert db.get_files_for_template(user.id, "test") == []
+
+
+async def test_expired_uploads_are_deleted(user: User, tmp_path: Path) -> None:
+    store = LocalArtifactStore(tmp_path)
+
+    chunk_hash = sha3_512(b"chunk").hexdigest()
+    await store.put(get_chunk_artifact_key(chunk_hash), b"chunk")
+
+    now = datetime.now(tz=UTC)
+
+    db.create_upload_session(
+        UploadSession(
+            id="upload",
+            owner_id=user.id,
+            template_name="test",
+            filename="font.ttf",
+            content_type=None,
+            size=10,
+            hash=sha3_512(b"file").hexdigest(),
+            chunk_size=5,
+            created_at=now - timedelta(days=2),
+            expires_at=now - timedelta(days=1),
+            chunks=[UploadChunk(offset=i * 5, size=5, hash=chunk_hash) for i in range(2)],
+        )
+    )
+    db.mark_upload_chunks_received("upload", chunk_hash)
+
+    report = await collect_garbage(store=store, grace_period=timedelta(0))
+
+    assert report.expired_uploads == 1
+    assert report.deleted_chunks == 1
+    assert db.get_upload_session("upload") is None
+    assert not await store.exists(get_chunk_artifact_key(chunk_hash))
@@ -0,0 +1,45 @@
+import pytest
+from starlette.datastructures import Headers
+
+from reportobello.api.ranges import RangeNotSatisfiable, etag_matches, get_byte_range
+
+
+@pytest.mark.parametrize(
+    ("range_header", "expected"),
+    [
+        ("bytes=0-9", (0, 10)),
+        ("bytes=10-", (10, 100)),
+        ("bytes=90-200", (90, 100)),
+        ("bytes=-10", (90, 100)),
+        ("bytes=-200", (0, 100)),
+        # Invalid or multiple ranges get the whole file
+        ("bytes=9-0", None),
+        ("bytes=-", None),
+        ("bytes=0-9,20-29", None),
+        ("lines=0-9", None),
+    ],
+)
+def test_byte_ranges_are_parsed(range_header: str, expected: tuple[int, int] | None) -> None:
+    assert get_byte_range(Headers({"range": range_header}), size=100, etag="abc") == expected
+
+
+@pytest.mark.parametrize("range_header", ["bytes=100-", "bytes=-0"])
+def test_byte_ranges_outside_of_file_are_not_satisfiable(range_header: str) -> None:
+    with pytest.raises(RangeNotSatisfiable):
+        get_byte_range(Headers({"range": range_header}), size=100, etag="abc")
+
+
+def test_byte_range_is_ignored_if_file_changed() -> None:
+    headers = {"range": "bytes=0-9"}
+
+    assert get_byte_range(Headers({**headers, "if-range": '"abc"'}), size=100, etag="abc") == (0, 10)
+    assert get_byte_range(Headers({**headers, "if-range": '"xyz"'}), size=100, etag="abc") is None
+    assert get_byte_range(Headers({**headers, "if-range": 'W/"abc"'}), size=100, etag="abc") is None
+
+
+def test_etags_are_matched() -> None:
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('"xyz", W/"abc"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"xyz"', "abc")
+    assert not etag_matches(None, "abc")
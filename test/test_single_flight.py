@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from reportobello.infra.single_flight import SingleFlight
+
+
+async def test_concurrent_calls_with_same_key_share_result() -> None:
+    flights = SingleFlight[int]("test")
+    calls = 0
+
+    async def f() -> int:
+        nonlocal calls
+        calls += 1
+
+        await asyncio.sleep(0.01)
+
+        return calls
+
+    results = await asyncio.gather(*[flights.run("key", f) for _ in range(5)])
+
+    assert results == [1] * 5
+    assert calls == 1
+
+
+async def test_calls_with_different_keys_are_not_shared() -> None:
+    flights = SingleFlight[str]("test")
+
+    async def f(value: str) -> str:
+        await asyncio.sleep(0.01)
+
+        return value
+
+    results = await asyncio.gather(flights.run("a", lambda: f("a")), flights.run("b", lambda: f("b")))
+
+    assert list(results) == ["a", "b"]
+
+
+async def test_exceptions_are_shared() -> None:
+    flights = SingleFlight[None]("test")
+
+    async def f() -> None:
+        await asyncio.sleep(0.01)
+
+        raise ValueError("oops")
+
+    results = await asyncio.gather(flights.run("key", f), flights.run("key", f), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_call_is_only_cancelled_once_all_waiters_are_cancelled() -> None:
+    flights = SingleFlight[int]("test")
+    started = asyncio.Event()
+
+    async def f() -> int:
+        started.set()
+
+        await asyncio.sleep(0.05)
+
+        return 1
+
+    first = asyncio.create_task(flights.run("key", f))
+    second = asyncio.create_task(flights.run("key", f))
+
+    await started.wait()
+
+    first.cancel()
+
+    assert await second == 1
+
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    third = asyncio.create_task(flights.run("other", f))
+    await asyncio.sleep(0)
+    third.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await third
+
+    # Let the cancelled call finish cleaning up
+    await asyncio.sleep(0)
+
+    assert not flights._flights  # noqa: SLF001
+
+
+async def test_calls_started_while_previous_call_is_being_cancelled_are_not_cancelled() -> None:
+    flights = SingleFlight[int]("test")
+    started = asyncio.Event()
+    calls = 0
+
+    async def f() -> int:
+        nonlocal calls
+        calls += 1
+
+        started.set()
+
+        try:
+            await asyncio.sleep(0.05)
+
+        except asyncio.CancelledError:
+            # Slow to clean up after being cancelled
+            await asyncio.sleep(0.05)
+            raise
+
+        return calls
+
+    first = asyncio.create_task(flights.run("key", f))
+    await started.wait()
+
+    first.cancel()
+    await asyncio.sleep(0)
+
+    assert await flights.run("key", f) == 2
+
+    with pytest.raises(asyncio.CancelledError):
+        await first
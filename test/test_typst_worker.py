@@ -0,0 +1,116 @@
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from reportobello.infra import typst_worker
+from reportobello.infra.typst_worker import TypstWorker, TypstWorkerPool
+
+
+@pytest.fixture
+def workers(monkeypatch: pytest.MonkeyPatch) -> list[TypstWorker]:
+    # Record every worker the pool starts
+    workers: list[TypstWorker] = []
+
+    class RecordedTypstWorker(TypstWorker):
+        def __init__(self) -> None:
+            super().__init__()
+
+            workers.append(self)
+
+    monkeypatch.setattr(typst_worker, "TypstWorker", RecordedTypstWorker)
+
+    return workers
+
+
+@pytest.fixture
+def pool() -> Iterator[TypstWorkerPool]:
+    pool = TypstWorkerPool(1, max_builds_per_worker=2, build_timeout=2)
+
+    yield pool
+
+    pool.close()
+
+
+def test_workers_are_recycled(pool: TypstWorkerPool, workers: list[TypstWorker], tmp_path: Path) -> None:
+    file = tmp_path / "report.typ"
+    file.write_text('Hello #sys.inputs.at("name")')
+
+    for i in range(3):
+        output = tmp_path / f"report-{i}.pdf"
+
+        assert pool.compile(str(file), str(output), {"name": "world"}) == (0, "")
+        assert output.read_bytes().startswith(b"%PDF")
+
+    # The first worker is stopped once it reaches max_builds_per_worker
+    assert len(workers) == 2
+    assert not workers[0].is_alive
+    assert workers[1].is_alive
+
+
+def test_compile_errors_are_returned(pool: TypstWorkerPool, workers: list[TypstWorker], tmp_path: Path) -> None:
+    file = tmp_path / "report.typ"
+    file.write_text("#let x = ")
+
+    exit_code, stdout = pool.compile(str(file), str(tmp_path / "report.pdf"), {})
+
+    assert exit_code == 1
+    assert "expected expression" in stdout
+    assert not (tmp_path / "report.pdf").exists()
+
+    # Compile errors don't affect the worker
+    assert workers[0].is_alive
+
+
+def test_workers_that_time_out_are_restarted(pool: TypstWorkerPool, workers: list[TypstWorker], tmp_path: Path) -> None:
+    slow = tmp_path / "slow.typ"
+    slow.write_text("#for i in range(100000000) {}")
+
+    assert pool.compile(str(slow), str(tmp_path / "slow.pdf"), {}) == (1, "error: build timed out after 2 seconds")
+
+    assert not workers[0].is_alive
+
+    file = tmp_path / "report.typ"
+    file.write_text("Hello world")
+
+    assert pool.compile(str(file), str(tmp_path / "report.pdf"), {}) == (0, "")
+
+    assert len(workers) == 2
+
+
+def test_slot_is_returned_after_unexpected_errors(
+    pool: TypstWorkerPool, workers: list[TypstWorker], tmp_path: Path
+) -> None:
+    file = tmp_path / "report.typ"
+    file.write_text("Hello world")
+
+    # Inputs that can't be sent to the worker
+    with pytest.raises(AttributeError):
+        pool.compile(str(file), str(tmp_path / "report.pdf"), {"name": lambda: None})  # type: ignore[dict-item]
+
+    assert not workers[0].is_alive
+
+    # The pool only has one slot, so this would block forever if the slot wasn't returned
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(pool.compile, str(file), str(tmp_path / "report.pdf"), {})
+
+        assert future.result(timeout=10) == (0, "")
+
+
+def test_crashed_workers_are_stopped_before_being_replaced(
+    pool: TypstWorkerPool, workers: list[TypstWorker], tmp_path: Path
+) -> None:
+    file = tmp_path / "report.typ"
+    file.write_text("Hello world")
+
+    assert pool.compile(str(file), str(tmp_path / "report.pdf"), {}) == (0, "")
+
+    workers[0].process.kill()
+    workers[0].process.wait()
+
+    assert pool.compile(str(file), str(tmp_path / "report.pdf"), {}) == (0, "")
+
+    assert len(workers) == 2
+    assert workers[0].jobs.closed
+    assert workers[0].results.closed
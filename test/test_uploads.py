@@ -0,0 +1,89 @@
+import asyncio
+from collections.abc import AsyncIterator
+from hashlib import sha3_512
+from pathlib import Path
+
+import pytest
+from starlette.datastructures import Headers
+
+from reportobello.infra.uploads import UploadedFile, UploadRejected, receive_body, receive_files
+
+HEADERS = Headers({"content-type": "multipart/form-data; boundary=boundary"})
+
+
+def multipart(*parts: tuple[str, str | None, bytes]) -> bytes:
+    body = b""
+
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+
+        body += f"--boundary\r\nContent-Disposition: {disposition}\r\nContent-Type: image/png\r\n\r\n".encode()
+        body += content + b"\r\n"
+
+    return body + b"--boundary--\r\n"
+
+
+async def chunked(body: bytes, size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(body), size):
+        await asyncio.sleep(0)
+        yield body[i : i + size]
+
+
+async def receive_all(body: bytes, tmp_path: Path, *, chunk_size: int = 7, max_file_size: int = 100) -> list[bytes]:
+    files: list[UploadedFile] = []
+    contents: list[bytes] = []
+
+    async for file in receive_files(
+        HEADERS, chunked(body, chunk_size), directory=tmp_path, max_file_size=max_file_size, max_files=10
+    ):
+        files.append(file)
+        contents.append(file.path.read_bytes())
+
+        assert file.hash == sha3_512(contents[-1]).hexdigest()
+        assert file.size == len(contents[-1])
+        assert file.content_type == "image/png"
+
+    assert [file.filename for file in files] == [f"{i}.png" for i in range(len(files))]
+
+    # Temporary files are always cleaned up
+    assert not list(tmp_path.iterdir())
+
+    return contents
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+async def test_files_are_received(tmp_path: Path, chunk_size: int) -> None:
+    body = multipart(("a", "0.png", b"hello"), ("b", "1.png", b""), ("c", "2.png", b"x" * 100))
+
+    assert await receive_all(body, tmp_path, chunk_size=chunk_size) == [b"hello", b"", b"x" * 100]
+
+
+async def test_large_files_are_rejected(tmp_path: Path) -> None:
+    body = multipart(("a", "0.png", b"x" * 101))
+
+    with pytest.raises(UploadRejected) as ex:
+        await receive_all(body, tmp_path)
+
+    assert ex.value.status_code == 413
+    assert not list(tmp_path.iterdir())
+
+
+async def test_fields_are_rejected(tmp_path: Path) -> None:
+    with pytest.raises(UploadRejected, match="Only files can be uploaded"):
+        await receive_all(multipart(("a", None, b"value")), tmp_path)
+
+
+async def test_body_is_received_and_hashed(tmp_path: Path) -> None:
+    async with receive_body(chunked(b"hello", 2), directory=tmp_path, max_size=5) as body:
+        assert body.path.read_bytes() == b"hello"
+        assert body.size == 5
+        assert body.hash == sha3_512(b"hello").hexdigest()
+
+    assert not list(tmp_path.iterdir())
+
+    with pytest.raises(UploadRejected) as ex:
+        async with receive_body(chunked(b"hello", 2), directory=tmp_path, max_size=4):
+            pass
+
+    assert ex.value.status_code == 413
+    assert not list(tmp_path.iterdir())